@@ -1,5 +1,8 @@
+import numbers
 from xml.etree import ElementTree
 
+import numpy
+
 from vistas.core.color import RGBColor
 from vistas.core.graphics.feature import FeatureFactory
 from vistas.core.graphics.terrain import TerrainTileFactory
@@ -13,6 +16,97 @@ from vistas.ui.utils import *
 GREY = RGBColor(0.5, 0.5, 0.5)
 
 
+class StyleClassifier:
+    """
+    An Envision style attribute compiled into numpy structures, so that a whole attribute column is classified with a
+    couple of array operations. Range styles (minVal/maxVal) are classified with numpy.digitize over the upper bounds of
+    the ranges, and categorical styles with a sorted value -> class lookup. Class i is legend entry i, and values that
+    don't match any entry are class -1.
+    """
+
+    def __init__(self, legend, minmax=None, categories=None):
+        """
+        Constructor
+        :param legend: The parsed legend entries of the style attribute.
+        :param minmax: A list of inclusive (min, max) ranges, one per legend entry, for range styles.
+        :param categories: The (RGBColor, label) legend categories. Entries are colored by the first category with the
+        same label.
+        """
+
+        self.minmax = minmax
+
+        if minmax is not None:
+            bounds = numpy.array(minmax, dtype=numpy.float64).reshape(-1, 2)
+
+            # Entries are matched first to last, so bins can only be used if the ranges don't overlap
+            order = numpy.argsort(bounds[:, 1], kind='mergesort')
+            self.classes = order
+            self.mins = bounds[order, 0]
+            self.maxs = bounds[order, 1]
+            self.overlapping = bool(numpy.any(self.mins[1:] <= self.maxs[:-1]))
+        else:
+            values, classes = [], []
+            for i, entry in enumerate(legend):
+                try:
+                    values.append(float(entry.get('value')))
+                    classes.append(i)
+                except (TypeError, ValueError):
+                    continue
+
+            # Keep the first entry for each value
+            values, first = numpy.unique(numpy.array(values, dtype=numpy.float64), return_index=True)
+            self.values = values
+            self.classes = numpy.array(classes, dtype=int)[first]
+
+        # One color per class, plus grey for unclassified values
+        colors = {}
+        for color, label in reversed(categories or []):
+            colors[label] = color
+        self.colors = numpy.array(
+            [(colors.get(entry.get('label')) or GREY).rgb.rgb_list for entry in legend] + [GREY.rgb.rgb_list],
+            dtype=numpy.float32
+        )
+
+    @classmethod
+    def from_style(cls, attribute):
+        return cls(attribute.get('legend'), attribute.get('minmax'), attribute.get('categories'))
+
+    def classify(self, values):
+        """ Returns the class of each value in an attribute column, or -1 for values that don't match any entry. """
+
+        # Non-numeric values, including numeric strings, never match an entry
+        values = values if isinstance(values, numpy.ndarray) else numpy.array(values, dtype=object)
+        if values.dtype.kind not in 'biuf':
+            values = numpy.array([v if isinstance(v, numbers.Real) else numpy.nan for v in values], dtype=numpy.float64)
+        values = values.astype(numpy.float64)
+
+        result = numpy.full(values.shape, -1, dtype=int)
+
+        if self.minmax is not None:
+            if self.overlapping:
+                for i, (low, high) in reversed(list(enumerate(self.minmax))):
+                    result[(low <= values) & (values <= high)] = i
+                return result
+
+            # The first range whose upper bound is >= value, as long as the value is also above its lower bound
+            bins = numpy.digitize(values, self.maxs, right=True)
+            valid = bins < len(self.maxs)
+            valid[valid] = self.mins[bins[valid]] <= values[valid]
+            result[valid] = self.classes[bins[valid]]
+
+        elif len(self.values):
+            index = numpy.minimum(numpy.searchsorted(self.values, values), len(self.values) - 1)
+            valid = self.values[index] == values
+            result[valid] = self.classes[index[valid]]
+
+        return result
+
+    def get_colors(self, values):
+        """ Returns an (n, 3) array of the colors of an attribute column """
+
+        return self.colors[self.classify(values)]
+
+
 class EnvisionVisualization(VisualizationPlugin3D):
 
     id = 'envision_tiles_viz'
@@ -32,6 +126,8 @@ class EnvisionVisualization(VisualizationPlugin3D):
         self.feature_layer = None
         self.feature_data = None
         self.delta_data = None
+        self.delta_engines = {}     # Shapefile column -> DeltaEngine
+        self.delta_year = None      # The year of the deltas displayed by the feature layer
 
         # Flags for rendering
         self.needs_mesh = False
@@ -115,10 +211,12 @@ class EnvisionVisualization(VisualizationPlugin3D):
                 self.legend = CategoricalLegend(self.envision_style[self.current_attribute].get('categories'))
 
                 # Decide which color function to use
+                column = self.envision_style[self.current_attribute].get('column')
                 if self.delta_data and self.is_delta_attribute(self.current_attribute) and self.use_deltas:
-                    self.feature_layer.set_color_function(self.color_deltas)
+                    self.feature_layer.set_column_color_function(self.color_deltas, [column])
+                    self.delta_year = Timeline.app().current.year
                 else:
-                    self.feature_layer.set_color_function(self.color_shapes)
+                    self.feature_layer.set_column_color_function(self.color_columns, [column])
 
             else:   # Nothing to be done, color it grey
                 self.legend = None
@@ -157,9 +255,17 @@ class EnvisionVisualization(VisualizationPlugin3D):
 
     def timeline_changed(self):
         if self.feature_data and self.delta_data:
-            self.needs_color = self.use_deltas and \
-                               self.delta_data.time_info.is_temporal and \
-                               self.is_delta_attribute(self.current_attribute)
+            if self.use_deltas and self.delta_data.time_info.is_temporal and \
+                    self.is_delta_attribute(self.current_attribute):
+                year = Timeline.app().current.year
+                engine = self.delta_engines.get(self.envision_style[self.current_attribute].get('column'))
+
+                # Only features touched by deltas between the displayed year and the new one need new colors
+                if engine is not None and self.delta_year is not None and self.feature_layer is not None:
+                    self.feature_layer.recolor(engine.changed_idus(self.delta_year, year))
+                else:
+                    self.needs_color = True
+                self.delta_year = year
         self.refresh()
 
     def get_legend(self, width, height):
@@ -224,6 +330,8 @@ class EnvisionVisualization(VisualizationPlugin3D):
                     minmax.append((float(data.get('minVal')), float(data.get('maxVal'))))
                 self.envision_style[column]['minmax'] = minmax
 
+            self.envision_style[column]['classifier'] = StyleClassifier.from_style(self.envision_style[column])
+
         for column in empties:
             self.envision_style.pop(column)
 
@@ -236,6 +344,8 @@ class EnvisionVisualization(VisualizationPlugin3D):
                 self.envision_style.pop(key)
 
     def set_data(self, data: DataPlugin, role):
+        self.delta_engines = {}
+
         if role == 0:
             self.feature_data = data
             self.needs_mesh = True
@@ -315,6 +425,15 @@ class EnvisionVisualization(VisualizationPlugin3D):
                 self.feature_layer.dispose()
                 self.feature_layer = None
 
+    def color_columns(self, columns):
+        """ Color all features at once based on the compiled Envision XML style of the current attribute. """
+
+        envision_attribute = self.envision_style[self.current_attribute]
+        values = columns[envision_attribute.get('column')]
+        if self.legend is None:
+            return numpy.repeat([GREY.rgb.rgb_list], len(values), axis=0)
+        return envision_attribute.get('classifier').get_colors(values)
+
     def color_shapes(self, feature, data):
         """
         Color features based either on Envision XML style or on a generic color scheme derived from the feature schema.
@@ -325,88 +444,29 @@ class EnvisionVisualization(VisualizationPlugin3D):
 
         if self.envision_style is not None:
             envision_attribute = self.envision_style[self.current_attribute]
-            shp_attribute = envision_attribute.get('column')
-            legend = envision_attribute.get('legend')
-            value = feature.get('properties').get(shp_attribute)
-            minmax = envision_attribute.get('minmax', None)
-            string_value = ''
-
-            if minmax is not None:
-                for i, pair in enumerate(minmax):
-                    if pair[0] <= value <= pair[1]:
-                        string_value = legend[i].get('label')
-                        break
-            else:
-                for entry in legend:
-                    try:
-                        val = float(entry.get('value'))
-                    except ValueError:
-                        continue
-                    if val == value:
-                        string_value = entry.get('label')
-                        break
-
-            color = self.legend.get_color(string_value)
-            if color is None:
-                color = GREY
-            return color
+            value = feature.get('properties').get(envision_attribute.get('column'))
+            return RGBColor(*envision_attribute.get('classifier').get_colors([value])[0])
 
         # Fallback to coloring based on shapefile schema
         else:
             value = feature.get('properties').get(self.current_attribute)
             return self.legend.get_color(value)
 
-    def color_deltas(self, feature, data):
+    def color_deltas(self, columns):
         """
-        Color features based on presence in the Envision Delta Array. Features absent from delta array are colored grey.
+        Color all features by the state of the current attribute at the current year, i.e. its base value plus the
+        deltas of every year up to and including the current one.
         """
 
-        if self.legend is None:
-            return GREY
-
         envision_attribute = self.envision_style[self.current_attribute]
-        shp_attribute = envision_attribute.get('column')
-        legend = envision_attribute.get('legend')
-        value = feature.get('properties').get(shp_attribute)
-        idu = int(feature.get('id'))
-        minmax = envision_attribute.get('minmax', None)
-        string_value = ''
-
-        try:
-            if 'delta_array' not in data:
-                data['delta_array'] = self.delta_data.get_data(shp_attribute, Timeline.app().current)
-                data['index'] = 0
-                if data.get('delta_array') is None:
-                    self.feature_layer.set_color_function(self.color_shapes)
-                    post_message('Could not retrieve deltas, defaulting to base value.', 1)
-                    return self.color_shapes(feature, None)
-
-            darray = data.get('delta_array')
-            index = data.get('index')
-
-            if darray[index].idu == idu:
-                value += darray[index].new_value
-                data['index'] += 1
-            else:
-                if darray[index].idu < idu:
-                    while darray[index].idu <= idu:
-                        index += 1
-                data['index'] = index
-
-                return GREY
-
-        # Handle if we reached the end of the delta array
-        except IndexError:
-            return GREY
-
-        if minmax is not None:
-            for i, pair in enumerate(minmax):
-                if pair[0] <= value <= pair[1]:
-                    string_value = legend[i].get('label')
-                    break
+        column = envision_attribute.get('column')
+        values = columns[column]
+        if self.legend is None:
+            return numpy.repeat([GREY.rgb.rgb_list], len(values), axis=0)
 
-        color = self.legend.get_color(string_value)
-        if color is None:
-            color = GREY
+        # Feature IDUs are their index in the shapefile
+        engine = self.delta_engines.get(column)
+        if engine is None:
+            engine = self.delta_engines[column] = self.delta_data.get_state_engine(column, values)
 
-        return color
+        return envision_attribute.get('classifier').get_colors(engine.state_at(Timeline.app().current.year))
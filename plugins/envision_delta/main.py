@@ -1,71 +1,227 @@
-import csv
 import datetime
 import os
-from collections import namedtuple
+import tempfile
+from bisect import bisect_left
+from threading import Lock
 
 import numpy
 
 from vistas.core.plugins.data import ArrayDataPlugin, TemporalInfo
 
-Delta = namedtuple('Delta', ['year', 'idu', 'field', 'new_value'])
+SIDECAR_VERSION = 1
+CHECKPOINT_YEARS = 10
+
+DELTA_DTYPE = numpy.dtype([
+    ('year', numpy.int32), ('idu', numpy.int32), ('field_code', numpy.int16), ('new_value', numpy.float64)
+])
 
 
-# Todo - store the start/stop indices for each year, so we can do indexing better.
-# This will speed up loading and minimize the amount of IO time we have to spend
 class DeltaArray:
+    """
+    Envision deltas stored as typed columns (year, idu, field code, new value), sorted by year, field and IDU, with a
+    (year, field code) -> (start, stop) index so that the deltas of one field in one year are a single slice.
+    """
+
     def __init__(self):
-        self.deltas = []
-        self.base_year = None
-        self.year_index_map = {}
+        self.deltas = numpy.recarray(0, dtype=DELTA_DTYPE)
+        self.fields = []    # Field names by field code
+        self.years = []
+        self.index = {}     # (year, field code) -> (start, stop)
+        self.timestamps = []
 
     def __len__(self):
         return len(self.deltas)
 
     def __getitem__(self, item):
-        if isinstance(item, slice):
-            return self.deltas[item.start:item.start:item.step]
         return self.deltas[item]
 
-    def add_delta(self, index, year, idu, field, new_value):
-        if self.base_year is None:
-            self.base_year = year
+    def set_columns(self, years, idus, fields, values, field_names):
+        """ Set the deltas from unsorted columns, where `fields` are codes into `field_names`. """
 
-        if year - self.base_year not in self.year_index_map:
-            self.year_index_map[year - self.base_year] = index
+        order = numpy.lexsort((idus, fields, years))
+        deltas = numpy.recarray(len(order), dtype=DELTA_DTYPE)
+        deltas.year = years[order]
+        deltas.idu = idus[order]
+        deltas.field_code = fields[order]
+        deltas.new_value = values[order]
+        self.deltas = deltas
+        self.fields = list(field_names)
+        self._build_index()
 
-        self.deltas.append(Delta(year, idu, field, new_value))
+    def _build_index(self):
+        deltas = self.deltas
+        self.index = {}
+        if len(deltas):
+            changed = (deltas.year[1:] != deltas.year[:-1]) | (deltas.field_code[1:] != deltas.field_code[:-1])
+            starts = numpy.flatnonzero(numpy.concatenate(([True], changed)))
+            stops = numpy.append(starts[1:], len(deltas))
+            for start, stop in zip(starts.tolist(), stops.tolist()):
+                self.index[(int(deltas.year[start]), int(deltas.field_code[start]))] = (start, stop)
 
-    def index_from_year(self, year):
-        if year - self.base_year in self.year_index_map:
-            return self.year_index_map[year - self.base_year]
-        return -1
+        self.years = numpy.unique(deltas.year).tolist()
+        self.timestamps = [datetime.datetime(year=year, month=1, day=1) for year in self.years]
 
-    def index_range_from_year(self, year):
-        return self.index_range_from_year_range(year, year + 1)
+    @property
+    def base_year(self):
+        return self.years[0] if self.years else None
 
-    def index_range_from_year_range(self, from_year, to_year):
-        count = len(self.deltas)
-        end_year = self.deltas[count - 1].year + 1
+    def field_code(self, field):
+        """ Returns the code of a field, or -1 if there are no deltas for the field. """
 
-        if from_year >= end_year:
-            from_index_closed = count
-        else:
-            from_index_closed = self.index_from_year(from_year)
+        try:
+            return self.fields.index(field)
+        except ValueError:
+            return -1
 
-        if to_year >= end_year:
-            to_index_open = count
-        else:
-            to_index_open = self.index_from_year(to_year)
+    def get(self, year, field):
+        """ Returns the deltas for a field in a year as a record array slice, sorted by IDU. """
 
-        if to_year < from_year:
-            from_index_closed -= 1
-            to_index_open -= 1
+        start, stop = self.index.get((year, self.field_code(field)), (0, 0))
+        return self.deltas[start:stop]
 
-        return from_index_closed, to_index_open
+    def has_year(self, year):
+        index = bisect_left(self.years, year)
+        return index < len(self.years) and self.years[index] == year
 
-    @property
-    def timestamps(self):
-        return sorted([datetime.datetime(year=year + self.base_year, month=1, day=1) for year in self.year_index_map])
+    def load_csv(self, path):
+        """ Parse an Envision delta CSV into typed columns """
+
+        data = numpy.genfromtxt(path, delimiter=',', names=True, dtype=None, encoding='utf-8', autostrip=True)
+        data = numpy.atleast_1d(data)
+
+        # Field codes are assigned in order of first appearance
+        names, first, codes = numpy.unique(data['field'].astype(str), return_index=True, return_inverse=True)
+        order = numpy.argsort(first)
+        ranks = numpy.empty_like(order)
+        ranks[order] = numpy.arange(len(order))
+
+        self.set_columns(
+            data['year'].astype(numpy.int32),
+            data['idu'].astype(numpy.int32),
+            ranks[codes.ravel()].astype(numpy.int16),
+            data['newValue'].astype(numpy.float64),
+            names[order].tolist()
+        )
+
+    def load(self, path, fingerprint):
+        """ Load deltas from a binary sidecar. Returns False if it's missing, stale or unreadable. """
+
+        if not os.path.exists(path):
+            return False
+        try:
+            with numpy.load(path) as data:
+                if int(data['version']) != SIDECAR_VERSION or str(data['fingerprint']) != fingerprint:
+                    return False
+                self.deltas = data['deltas'].view(numpy.recarray)
+                self.fields = [str(x) for x in data['fields']]
+        except (OSError, ValueError, KeyError):
+            return False
+
+        self._build_index()
+        return True
+
+    def save(self, path, fingerprint):
+        """ Atomically write deltas to a binary sidecar. Failures are ignored, since the sidecar is optional. """
+
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez(
+                    f, version=SIDECAR_VERSION, fingerprint=fingerprint, deltas=self.deltas.view(numpy.ndarray),
+                    fields=numpy.array(self.fields, dtype=str)
+                )
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class DeltaEngine:
+    """
+    Materializes the full state of a field at any year by applying the deltas of every year up to and including it to
+    the base values with vectorized scatter-adds. The state is checkpointed every `interval` years, so that seeking to
+    an arbitrary year replays at most `interval` years of deltas, and stepping to the next year replays only that year.
+    """
+
+    def __init__(self, delta_array, field, base_values, interval=CHECKPOINT_YEARS):
+        """
+        Constructor
+        :param delta_array: The DeltaArray to apply.
+        :param field: The field whose deltas are applied.
+        :param base_values: The base value of the field for each IDU, indexed by IDU.
+        :param interval: The number of years between checkpoints.
+        """
+
+        self.delta_array = delta_array
+        self.field_code = delta_array.field_code(field)
+        self.interval = interval
+
+        base_values = numpy.array(base_values, dtype=numpy.float64)
+        base_values.setflags(write=False)
+        self.checkpoints = [base_values]    # Checkpoint k is the state before the year first_year + k * interval
+        self._last = None   # (year, state) of the last state materialized
+        self._lock = Lock()
+
+    def state_at(self, year):
+        """ Returns the value of the field for each IDU after the deltas of `year`. The result is read-only. """
+
+        with self._lock:
+            years = self.delta_array.years
+            if self.field_code < 0 or not years or year < years[0]:
+                return self.checkpoints[0]
+
+            # Replay from the closest checkpoint, or from the last state if it's closer
+            end = min(year, years[-1]) + 1
+            k = self._checkpoint(end)
+            start, state = years[0] + k * self.interval, self.checkpoints[k]
+            if self._last is not None and start <= self._last[0] <= end:
+                start, state = self._last
+
+            if start < end:
+                state = self._apply(state, start, end)
+            self._last = (end, state)
+            return state
+
+    def changed_idus(self, from_year, to_year):
+        """ Returns the unique IDUs whose value differs between the states at `from_year` and `to_year`. """
+
+        start, end = sorted((from_year, to_year))
+        idus = [
+            self.delta_array.deltas.idu[s[0]:s[1]] for s in
+            (self.delta_array.index.get((year, self.field_code)) for year in range(start + 1, end + 1)) if s is not None
+        ]
+        return numpy.unique(numpy.concatenate(idus)) if idus else numpy.array([], dtype=numpy.int32)
+
+    def _checkpoint(self, end):
+        """ Returns the index of the last checkpoint at or before the year `end`, building checkpoints as needed. """
+
+        first_year = self.delta_array.years[0]
+        k = (end - first_year) // self.interval
+        while len(self.checkpoints) <= k:
+            previous = len(self.checkpoints) - 1
+            start = first_year + previous * self.interval
+            self.checkpoints.append(self._apply(self.checkpoints[previous], start, start + self.interval))
+        return k
+
+    def _apply(self, state, start, end):
+        """ Returns a copy of `state` with the deltas of the years in [start, end) added. """
+
+        slices = [self.delta_array.index.get((year, self.field_code)) for year in range(start, end)]
+        deltas = [self.delta_array.deltas[s[0]:s[1]] for s in slices if s is not None]
+
+        state = state.copy()
+        if deltas:
+            idus = numpy.concatenate([d.idu for d in deltas])
+            values = numpy.concatenate([d.new_value for d in deltas])
+            valid = (idus >= 0) & (idus < state.size)
+            numpy.add.at(state, idus[valid], values[valid])
+        state.setflags(write=False)
+        return state
 
 
 class EnvisionDeltaArray(ArrayDataPlugin):
@@ -89,40 +245,37 @@ class EnvisionDeltaArray(ArrayDataPlugin):
         self.delta_array = DeltaArray()
         self.variables = []
 
+    @property
+    def sidecar_path(self):
+        return '{}.deltas.npz'.format(os.path.splitext(self.path)[0])
+
     def load_data(self):
-        self.variables.clear()
-        self.delta_array.deltas.clear()
-        self.delta_array.year_index_map.clear()
         self.data_name = self.path.split(os.sep)[-1].split('.')[0]
 
-        with open(self.path, 'r') as f:
-            reader = csv.DictReader(f)
-            for idx, row in enumerate(reader):
-                field = row.get('field')
-                if field not in self.variables:
-                    self.variables.append(field)
-                self.delta_array.add_delta(idx, int(row.get('year')), int(row.get('idu')), field,
-                                           float(row.get('newValue')))
+        # The parsed deltas are kept in a binary sidecar, which is rebuilt whenever the CSV changes
+        stat = os.stat(self.path)
+        fingerprint = '{}:{}'.format(stat.st_size, stat.st_mtime)
+        self.delta_array = DeltaArray()
+        if not self.delta_array.load(self.sidecar_path, fingerprint):
+            self.delta_array.load_csv(self.path)
+            self.delta_array.save(self.sidecar_path, fingerprint)
 
-        timestamps = self.delta_array.timestamps
-        if timestamps:
-            self.time_info.timestamps = timestamps
+        self.variables = list(self.delta_array.fields)
+        self.time_info.timestamps = list(self.delta_array.timestamps)
 
     @staticmethod
     def is_valid_file(path):
         return True
 
     def get_data(self, variable, date=None):
-        if date is None:
-            return None
+        """ Returns the deltas of a variable for the year of `date` as a record array sorted by IDU, or None. """
 
-        first = self.delta_array.index_from_year(date.year)
-        next_year = date + datetime.timedelta(days=365)
-        last = self.delta_array.index_from_year(next_year.year)
-        if next_year > self.delta_array.timestamps[-1]:
-            last = len(self.delta_array)
-        if first != -1:
-            return [x for x in self.delta_array.deltas[first: last] if x.field == variable]
-        else:
+        if date is None or not self.delta_array.has_year(date.year):
             return None
 
+        return self.delta_array.get(date.year, variable)
+
+    def get_state_engine(self, variable, base_values, interval=CHECKPOINT_YEARS):
+        """ Returns a DeltaEngine that materializes the state of a variable at any year from its base values. """
+
+        return DeltaEngine(self.delta_array, variable, base_values, interval)
@@ -11,7 +11,6 @@ import numpy.ma as ma
 
 from vistas.core.gis.extent import Extent
 from vistas.core.plugins.data import RasterDataPlugin, VariableStats, TemporalInfo
-from vistas.core.timeline import Timeline
 
 
 class ESRIGridAscii(RasterDataPlugin):
@@ -51,9 +50,6 @@ class ESRIGridAscii(RasterDataPlugin):
         self._is_subday = False
         self._is_velma = False
         self._velma_pattern = None
-        self._current_grid = None
-        self._current_time = None
-        self._current_variable = None
 
     def load_data(self):
         filename = self.path.split(os.sep)[-1]
@@ -123,22 +119,11 @@ class ESRIGridAscii(RasterDataPlugin):
         except rasterio.RasterioIOError:
             return False
 
-    def get_data(self, variable, date=None):
-        if self._current_grid is not None and self._current_time == date and self._current_variable == variable:
-            return self._current_grid.copy()
+    def _timestep_path(self, date):
+        """ Returns the path of the file holding the grid at a timestep """
 
         path = os.path.abspath(self.path)
         if self._is_velma and self.time_info.is_temporal:
-            if date is None:
-                date = Timeline.app().current
-
-            start = self.time_info.timestamps[0]
-            end = self.time_info.timestamps[-1]
-            if date < start:
-                date = start
-            elif date > end:
-                date = end
-
             filename = "{}_{}".format(self.data_name, self._loop)
             if self._has_layer:
                 filename = filename + '_{}'.format(self._layer)
@@ -147,12 +132,15 @@ class ESRIGridAscii(RasterDataPlugin):
                 filename = filename + '_{:2d}_{:2d}'.format(date.hour, date.minute)
             filename = "{}.asc".format(filename)
             path = os.path.join(os.path.dirname(path), filename)
+        return path
+
+    def read_data(self, variable, date=None):
+        with rasterio.open(self._timestep_path(date)) as src:
+            return ma.array(src.read(1), mask=np.logical_not(src.read_masks(1)))
 
-        with rasterio.open(path) as src:
-            self._current_grid = ma.array(src.read(1), mask=np.logical_not(src.read_masks(1)))
-        self._current_variable = variable
-        self._current_time = date
-        return self._current_grid.copy()
+    def read_window(self, variable, date, window):
+        with rasterio.open(self._timestep_path(date)) as src:
+            return ma.array(src.read(1, window=window), mask=np.logical_not(src.read_masks(1, window=window)))
 
     @property
     def variables(self):
@@ -33,8 +33,6 @@ class GeoTIFF(RasterDataPlugin):
         self.affine = None
         self._nodata = None
         self._count = None
-        self._current_band = None
-        self._current_grid = None
 
     def load_data(self):
         file_name = self.path.split(os.sep)[-1]
@@ -58,14 +56,15 @@ class GeoTIFF(RasterDataPlugin):
     def is_valid_file(path):
         return True
 
-    def get_data(self, variable, date=None):
+    def read_data(self, variable, date=None):
         band = int(self._band(variable))
-        if band == self._current_band:
-            return self._current_grid.copy()
-        self._current_band = band
         with rasterio.open(self.path, 'r') as src:
-            self._current_grid = ma.array(src.read(band), mask=np.logical_not(src.read_masks(band)))
-        return self._current_grid.copy()
+            return ma.array(src.read(band), mask=np.logical_not(src.read_masks(band)))
+
+    def read_window(self, variable, date, window):
+        band = int(self._band(variable))
+        with rasterio.open(self.path, 'r') as src:
+            return ma.array(src.read(band, window=window), mask=np.logical_not(src.read_masks(band, window=window)))
 
     @property
     def variables(self):
@@ -6,7 +6,7 @@ from PIL import Image
 from matplotlib import pyplot, dates
 
 from vistas.core.color import RGBColor
-from vistas.core.plugins.data import DataPlugin
+from vistas.core.plugins.data import DataPlugin, RasterDataPlugin
 from vistas.core.plugins.option import Option, OptionGroup
 from vistas.core.plugins.visualization import VisualizationPlugin2D, VisualizationUpdateEvent
 from vistas.core.timeline import Timeline
@@ -24,6 +24,7 @@ class GraphVisualization(VisualizationPlugin2D):
         super().__init__()
 
         self.data = []
+        self.raster_data = []
         self.option_groups = []
 
         self.global_options = OptionGroup()
@@ -60,79 +61,61 @@ class GraphVisualization(VisualizationPlugin2D):
         return options
 
     def _update_options(self):
-
-        if len(self.data) < len(self.option_groups):
-
-            # We removed a data plugin, figure out which one
-            while len(self.data) < len(self.option_groups):
-
-                group = None
-                for g in self.option_groups:
-                    found = False
-                    for p in self.data:
-                        if p.data_name == g.name:
-                            found = True
-                            break
-                    if not found:
-                        group = g
-                        break
-
-                self.option_groups.remove(group)
-
-        elif len(self.data) > len(self.option_groups):
-
-            # We added data, figure out which one
-            while len(self.data) > len(self.option_groups):
-
-                plugin = None
-
-                for p in self.data:
-                    found = False
-                    for group in self.option_groups:
-                        if group.name == p.data_name:
-                            found = True
-                            break
-
-                    if not found:
-                        plugin = p
-                        break
-
-                label = plugin.data_name
-                group = OptionGroup(label)
+        plugins = self.data + self.raster_data
+        names = [plugin.data_name for plugin in plugins]
+
+        # Drop the groups of removed data, and add groups for new data
+        self.option_groups = [group for group in self.option_groups if group.name in names]
+        for plugin in plugins:
+            if not any(group.name == plugin.data_name for group in self.option_groups):
+                group = OptionGroup(plugin.data_name)
                 attr_option = Option(self, Option.CHOICE, 'Variable', 0)
                 attr_option.labels = plugin.variables
                 color_option = Option(self, Option.COLOR, 'Color', RGBColor(0, 0, 1))
                 group.items = [attr_option, color_option]
+
+                # Rasters are plotted as the history of a single cell
+                if isinstance(plugin, RasterDataPlugin):
+                    height, width = plugin.shape[-2:]
+                    group.items += [
+                        Option(self, Option.INT, 'Row', 0, 0, height - 1),
+                        Option(self, Option.INT, 'Column', 0, 0, width - 1)
+                    ]
                 self.option_groups.append(group)
 
+    def _role_data(self, role):
+        return self.data if role == 0 else self.raster_data
+
     @property
     def can_visualize(self):
-        return len(self.data) > 0
+        return len(self.data + self.raster_data) > 0
 
     @property
     def visualization_name(self):
-        return 'Graph Visualization' if len(self.data) == 0 else 'Graph of {}'.format(self.data[0].data_name)
+        plugins = self.data + self.raster_data
+        return 'Graph Visualization' if len(plugins) == 0 else 'Graph of {}'.format(plugins[0].data_name)
 
     @property
     def data_roles(self):
         return [
-            (DataPlugin.ARRAY, 'Data')
+            (DataPlugin.ARRAY, 'Data'),
+            (DataPlugin.RASTER, 'Raster Data')
         ]
 
     def role_supports_multiple_inputs(self, role):
-        if role == 0:
+        if role in (0, 1):
             return True
         return False
 
     def role_size(self, role):
-        return len(self.data)
+        return len(self._role_data(role))
 
     def set_data(self, data: DataPlugin, role):
 
         if data is None:
-            self.data = []
+            self._role_data(role)[:] = []
         else:
-            self.data.append(data)
+            self._role_data(role).append(data)
 
         self._update_options()
 
@@ -140,18 +123,19 @@ class GraphVisualization(VisualizationPlugin2D):
 
     def remove_subdata(self, role, subrole):
 
-        if subrole < len(self.data):
-            self.data.pop(subrole)
+        if subrole < len(self._role_data(role)):
+            self._role_data(role).pop(subrole)
 
         self._update_options()
 
         wx.PostEvent(App.get().app_controller.main_window, VisualizationUpdateEvent(plugin=self))
 
     def get_data(self, role):
-        return self.data[0] if len(self.data) > 0 else None
+        data = self._role_data(role)
+        return data[0] if len(data) > 0 else None
 
     def get_multiple_data(self, role):
-        return self.data
+        return self._role_data(role)
 
     def fig_to_pil(self, fig):
         f = BytesIO()
@@ -178,12 +162,17 @@ class GraphVisualization(VisualizationPlugin2D):
             ax = fig.add_subplot(1, 1, 1, facecolor=background_color)
             ax.margins(1 / width, 1 / height)
 
-            for data_plugin in self.data:
+            for data_plugin in self.data + self.raster_data:
 
                 data_color = self.get_group_option(data_plugin, 'Color').value.rgb.rgb_list
                 data_variable = data_plugin.variables[self.get_group_option(data_plugin, 'Variable').value]
 
-                data = (data_plugin.get_data(data_variable),)
+                if isinstance(data_plugin, RasterDataPlugin):
+                    row = self.get_group_option(data_plugin, 'Row').value
+                    col = self.get_group_option(data_plugin, 'Column').value
+                    data = (data_plugin.time_series(data_variable, row, col),)
+                else:
+                    data = (data_plugin.get_data(data_variable),)
                 if data_plugin.time_info.is_temporal:
                     data = ([(x - datetime(1, 1, 1)).days for x in data_plugin.time_info.timestamps],) + data
                     ax.xaxis.set_major_formatter(dates.DateFormatter('%b %d, %Y'))
@@ -200,7 +189,7 @@ class GraphVisualization(VisualizationPlugin2D):
                 for text in legend.get_texts():
                     text.set_color(label_color)
 
-            if show_cursor and any([x.time_info.is_temporal for x in self.data]):
+            if show_cursor and any([x.time_info.is_temporal for x in self.data + self.raster_data]):
                 current_time = Timeline.app().current
                 color = (1, 1, 1) if self.bg_color_option.value.hsv.v < .5 else (0, 0, 0)
                 ax.axvline(x=(current_time - datetime(1, 1, 1)).days, color=color)
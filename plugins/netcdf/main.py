@@ -6,6 +6,7 @@ from clover.netcdf.variable import SpatialCoordinateVariable, SpatialCoordinateV
 import clover.netcdf.describe
 from netCDF4 import Dataset
 import datetime as dt
+import numpy
 import wx
 
 from vistas.core.gis.extent import Extent
@@ -13,6 +14,8 @@ from vistas.core.plugins.data import RasterDataPlugin, TemporalInfo, VariableSta
 from vistas.core.timeline import Timeline
 from vistas.ui.app import App
 
+CHUNK_CACHE_BYTES = 256 * 1024 ** 2
+
 
 class NetCDF4DataPlugin(RasterDataPlugin):
 
@@ -49,12 +52,13 @@ class NetCDF4DataPlugin(RasterDataPlugin):
         self.affine = None
         self._resolution = None
 
-        # Grid caching
-        self._current_variable = None
-        self._current_grid = None
         self.var_shape = None
+        self._times = numpy.array([], dtype='datetime64[us]')     # Timestamps, for nearest time lookups
+        self._dataset = None    # Kept open between reads, so that chunk caches persist
+        self._dataset_variables = {}
 
     def load_data(self):
+        self.close()
         self.data_name = self.path.split(os.sep)[-1].split('.')[0]
         with Dataset(self.path, 'r') as ds:
             # This should be: self.variables = clover.netcdf.utilities.data_variables(ds)
@@ -104,6 +108,8 @@ class NetCDF4DataPlugin(RasterDataPlugin):
             if not self.time_info.is_temporal and len(self.var_shape) == 3:
                 self.var_shape = self.var_shape[1:]
 
+        self._times = numpy.array(self.time_info.timestamps, dtype='datetime64[us]')
+
     @staticmethod
     def is_valid_file(path):
         try:
@@ -114,23 +120,92 @@ class NetCDF4DataPlugin(RasterDataPlugin):
         except:
             return False
 
-    def get_data(self, variable, date=None):
-        if variable != self._current_variable: # read data from disk
-            with Dataset(self.path, 'r') as ds:
-                slice_to_read = slice(None)
+    def close(self):
+        """ Close the dataset kept open for reads, releasing the file. It is reopened by the next read. """
+
+        with self._read_lock:
+            if self._dataset is not None:
+                self._dataset.close()
+                self._dataset = None
+                self._dataset_variables = {}
+
+    def timestep(self, date=None):
+        if not self.time_info or not self.time_info.is_temporal:
+            return None
+
+        if date is None:
+            date = Timeline.app().current
+        return self.time_info.timestamps[self._time_index(date)]
+
+    def _time_index(self, date):
+        """ Returns the index of the timestep nearest to `date` """
+
+        target = numpy.datetime64(date, 'us')
+        i = int(numpy.searchsorted(self._times, target))
+        if i == 0:
+            return 0
+        if i == len(self._times):
+            return i - 1
+        return i - 1 if target - self._times[i - 1] <= self._times[i] - target else i
+
+    def _variable(self, variable):
+        """
+        Returns a netCDF4 variable from the open dataset. The chunk cache of chunked variables is sized to hold every
+        chunk of a timestep, so that stepping through timesteps that share chunks decompresses each chunk only once.
+        """
+
+        var = self._dataset_variables.get(variable)
+        if var is not None:
+            return var
+
+        if self._dataset is None:
+            self._dataset = Dataset(self.path, 'r')
+
+        # Only netCDF-4 files have chunks; chunking() is None for netCDF-3 files
+        var = self._dataset.variables[variable]
+        chunking = var.chunking()
+        if isinstance(chunking, (list, tuple)) and len(var.shape) == 3:
+            _, height, width = var.shape
+            _, chunk_height, chunk_width = chunking
+            num_chunks = -(-height // chunk_height) * -(-width // chunk_width)
+            size = num_chunks * int(numpy.prod(chunking)) * var.dtype.itemsize
+            var.set_var_chunk_cache(size=min(size, CHUNK_CACHE_BYTES))
+
+        self._dataset_variables[variable] = var
+        return var
+
+    def read_data(self, variable, date=None):
+        return self.read_window(variable, date, None)
+
+    def read_window(self, variable, date, window):
+        """ Read a single timestep, and optionally only a window of it, rather than the whole variable """
+
+        (row_start, row_stop), (col_start, col_stop) = window or ((None, None), (None, None))
+        rows, cols = slice(row_start, row_stop), slice(col_start, col_stop)
+
+        with self._read_lock:
+            var = self._variable(variable)
+            if len(var.shape) == 3:
                 # If it has a time dimension but no coord var we treat it as non-temporal
-                if len(ds.variables[variable].shape) == 3 and not self.time_info.is_temporal:
-                    slice_to_read = -1
-                self._current_grid = ds.variables[variable][slice_to_read]
-            self._current_variable = variable
-
-        slice_to_return = slice(None)
-        if self.time_info.is_temporal:
-            if date is None:
-                date = Timeline.app().current
-            slice_to_return = min([i for i in enumerate(self.time_info.timestamps)],
-                key=lambda d: abs(d[1] - date))[0]
-        return self._current_grid[slice_to_return]
+                t = self._time_index(date) if self.time_info.is_temporal else -1
+                return var[t, rows, cols]
+            return var[rows, cols]
+
+    def time_series(self, variable, rows, cols):
+        rows, cols = numpy.broadcast_arrays(numpy.asarray(rows, dtype=int), numpy.asarray(cols, dtype=int))
+        with self._read_lock:
+            is_3d = len(self._variable(variable).shape) == 3
+        if not self.time_info.is_temporal or not is_3d:
+            return super().time_series(variable, rows, cols)
+
+        # Read the window around the cells for every timestep in a single slice
+        window = self._cell_window(rows, cols)
+        (row_start, row_stop), (col_start, col_stop) = window
+        with self._read_lock:
+            block = numpy.ma.asarray(self._variable(variable)[:, row_start:row_stop, col_start:col_stop])
+
+        series = block[:, (rows - row_start).ravel(), (cols - col_start).ravel()]
+        return series.reshape((block.shape[0],) + rows.shape)
 
     @property
     def shape(self):
@@ -1,6 +1,7 @@
 import os
 
 import fiona
+import numpy
 from pyproj import Proj
 
 from vistas.core.gis.extent import Extent
@@ -25,9 +26,11 @@ class Shapefile(FeatureDataPlugin):
         self.data_name = None
         self.extent = None
         self._num_features = 0
+        self._columns = {}
 
     def load_data(self):
         self.data_name = self.path.split(os.sep)[-1].split('.')[0]
+        self._columns = {}
         with fiona.open(self.path, 'r') as shp:
             self.metadata = shp.meta
             projection = Proj(init=self.metadata['crs']['init'])
@@ -82,3 +85,16 @@ class Shapefile(FeatureDataPlugin):
     def get_features(self, date=None):
         with fiona.open(self.path, 'r') as shp:
             yield from shp
+
+    def get_columns(self, variables, date=None):
+        # Attribute columns are read in one pass and kept, since recoloring typically switches between a few attributes
+        missing = [var for var in variables if var not in self._columns]
+        if missing:
+            values = {var: [] for var in missing}
+            with fiona.open(self.path, 'r') as shp:
+                for feature in shp:
+                    properties = feature['properties']
+                    for var in missing:
+                        values[var].append(properties.get(var))
+            self._columns.update({var: numpy.array(column) for var, column in values.items()})
+        return {var: self._columns[var] for var in variables}
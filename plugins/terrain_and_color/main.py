@@ -586,32 +586,30 @@ class TerrainAndColorPlugin(VisualizationPlugin3D):
             cell_x = int(round((point.y / res)))
             cell_y = int(round((point.x / res)))
 
-            terrain_attr = self._elevation_attribute.selected
-            terrain_ref = self.terrain_data.get_data(terrain_attr)
-
             if self.attribute_data is not None:
-                attribute_ref = self.attribute_data.get_data(
-                    self._attribute.selected, Timeline.app().current
-                )
-                attr_height, attr_width = attribute_ref.shape
+                attr_height, attr_width = self.attribute_data.shape[-2:]
                 if 0 <= cell_x < attr_width and 0 <= cell_y < attr_height:
 
+                    # Sample single cells, rather than reading whole grids
                     result = OrderedDict()
                     result['Point'] = "{}, {}".format(cell_x, cell_y)
-                    result['Value'] = attribute_ref[cell_y, cell_x]
-                    result['Height'] = terrain_ref[cell_y, cell_x]
+                    result['Value'] = self.attribute_data.sample(
+                        self._attribute.selected, Timeline.app().current, cell_y, cell_x
+                    )
+                    result['Height'] = self.terrain_data.sample(
+                        self._elevation_attribute.selected, None, cell_y, cell_x
+                    )
 
                     if self.flow_dir_data is not None:
-                        flow_dir_ref = self.flow_dir_data.get_data(self.flow_dir_data.variables[0])
-                        direction = flow_dir_ref[cell_y, cell_x]
+                        direction = self.flow_dir_data.sample(self.flow_dir_data.variables[0], None, cell_y, cell_x)
                         result['Flow Direction (input)'] = direction
                         degrees = 45.0 + 45.0 * direction
                         result['Flow Direction (degrees)'] = degrees if degrees < 360.0 else degrees - 360.0
 
                     if self.flow_acc_data is not None:
-                        result['Flow Accumulation'] = self.flow_acc_data.get_data(
-                            self.flow_acc_data.variables[0]
-                        )[cell_y, cell_x]
+                        result['Flow Accumulation'] = self.flow_acc_data.sample(
+                            self.flow_acc_data.variables[0], None, cell_y, cell_x
+                        )
 
                     self.selected_point = (cell_x, cell_y)
                     self._needs_boundaries = True
@@ -0,0 +1,83 @@
+import json
+import os
+
+from pyproj import Proj
+from rasterio.transform import Affine
+
+from vistas.core.gis.extent import Extent
+from vistas.core.plugins.data import RasterDataPlugin, VariableStats, TemporalInfo
+from vistas.core.timecube import TimeCube
+
+
+class TimeCubeDataPlugin(RasterDataPlugin):
+
+    id = 'time_cube'
+    name = 'Time Cube Data Plugin'
+    description = 'Reads chunked time cubes (.vcube) converted from other raster data.'
+    author = 'Conservation Biology Institute'
+    version = '1.0'
+    extensions = [('vcube', 'VISTAS Time Cube')]
+
+    data_name = None
+    extent = None
+    affine = None
+    shape = None
+    resolution = None
+    time_info = None
+    variables = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.data_name = None
+        self.extent = None
+        self.affine = None
+        self.shape = None
+        self.resolution = None
+        self.time_info = TemporalInfo()
+        self.variables = []
+        self.cube = None
+        self._indices = {}
+
+    def load_data(self):
+        self.cube = TimeCube(self.path)
+        self.data_name = self.cube.data_name
+        self.variables = list(self.cube.variables)
+        self.shape = self.cube.shape[1:]
+        self.resolution = self.cube.resolution
+        self.affine = Affine(*self.cube.affine) if self.cube.affine is not None else None
+
+        if self.cube.bounds is not None:
+            projection = Proj(self.cube.projection) if self.cube.projection else None
+            self.extent = Extent(*self.cube.bounds, projection=projection)
+
+        self.time_info = TemporalInfo()
+        self.time_info.timestamps = list(self.cube.timestamps)
+        self._indices = {date: i for i, date in enumerate(self.cube.timestamps)}
+
+    @staticmethod
+    def is_valid_file(path):
+        try:
+            with open(path, 'r') as f:
+                return 'chunks' in json.load(f)
+        except (OSError, ValueError):
+            return False
+
+    def read_data(self, variable, date=None):
+        return self.cube.read(variable, self._indices.get(date, 0))
+
+    def read_window(self, variable, date, window):
+        return self.cube.read(variable, self._indices.get(date, 0), window)
+
+    def calculate_stats(self):
+        if self.stats.is_stale:
+            for variable in self.variables:
+                mins, maxs = [], []
+                for i in range(self.cube.shape[0]):
+                    grid = self.cube.read(variable, i)
+                    if grid.count():
+                        mins.append(grid.min())
+                        maxs.append(grid.max())
+                if mins:
+                    self.stats[variable] = VariableStats(float(min(mins)), float(max(maxs)))
+            self.save_stats()
@@ -1,3 +1,4 @@
+import multiprocessing
 import platform
 
 import matplotlib
@@ -7,5 +8,8 @@ if platform.uname().system == 'Windows':
 
 from vistas.ui.app import App
 
-app = App.get()
-app.MainLoop()
+if __name__ == '__main__':
+    multiprocessing.freeze_support()    # Worker processes (e.g. for triangulation) re-import this module
+
+    app = App.get()
+    app.MainLoop()
@@ -0,0 +1,91 @@
+from io import BytesIO
+from unittest.mock import patch
+
+import mercantile
+import numpy
+import pytest
+from PIL import Image
+from pyproj import Proj
+
+from vistas.core.gis import elevation
+from vistas.core.gis.elevation import ElevationService, MissingTilesError, tile_coords
+from vistas.core.gis.extent import Extent
+from vistas.core.gis.tiles import DirectoryTileSource, DirectoryTileStore
+from vistas.core.task import Task
+
+
+def test_tile_coords():
+    lons = numpy.array([-122.68, 0.0, 151.2, -179.9])
+    lats = numpy.array([45.52, 0.0, -33.86, 84.0])
+    xs, ys = tile_coords(lons, lats, 12)
+
+    for lon, lat, x, y in zip(lons, lats, xs, ys):
+        assert mercantile.tile(lon, lat, 12) == mercantile.Tile(int(x), int(y), 12)
+
+
+def test_decoded_grid_cache(tmpdir):
+    # Terrarium encoding of 100m: (R * 256 + G + B / 256) - 32768
+    rgb = numpy.zeros((256, 256, 3), dtype=numpy.uint8)
+    rgb[:, :, 0] = 128
+    rgb[:, :, 1] = 100
+    Image.fromarray(rgb).save(str(tmpdir.join('1', '0', '1.png').ensure()))
+
+    store = DirectoryTileStore(str(tmpdir))
+    source = DirectoryTileSource('Test', str(tmpdir))
+
+    ElevationService.tile_cache.clear()
+    grid = ElevationService(source, source, elevation_store=store, normals_store=store).get_grid(0, 1, 1)
+    assert numpy.allclose(grid, 100)
+    assert tmpdir.join('1', '0', '1.npy').exists()
+
+    # Decoded grid is preferred over the PNG on later reads
+    ElevationService.tile_cache.clear()
+    with patch('{}.Image.open'.format(elevation.__name__)) as open_mock:
+        grid = ElevationService(source, source, elevation_store=store, normals_store=store).get_grid(0, 1, 1)
+        assert not open_mock.called
+        assert isinstance(grid, numpy.memmap)
+        assert numpy.allclose(grid, 100)
+    ElevationService.tile_cache.clear()
+
+
+def test_local_normals(tmpdir):
+    # A 45 degree slope rising to the east, over two adjacent tiles
+    heights = numpy.tile(numpy.arange(512, dtype=numpy.float32), (256, 1)) * elevation.meters_per_px(15)
+    store = DirectoryTileStore(str(tmpdir))
+    for x in range(2):
+        store.write_many([(mercantile.Tile(x, 0, 15), _encode_png(heights[:, x * 256: (x + 1) * 256]))])
+
+    source = DirectoryTileSource('Local', str(tmpdir))
+    service = ElevationService(source, source, elevation_store=store, normals_store=store, local_normals=True)
+
+    ElevationService.tile_cache.clear()
+    mosaic = service.merge_grids(0, 0, 1, 0, 15, src=ElevationService.AWS_NORMALS)
+    expected = numpy.array([-1, 0, 1]) / numpy.sqrt(2) * 0.5 + 0.5
+    assert numpy.allclose(mosaic[:, 1:-1], expected, atol=1e-3)
+
+    # Normals of a single tile use the neighboring tile, so they match the mosaic at the seam
+    tile = service.get_grid(0, 0, 15, src=ElevationService.AWS_NORMALS)
+    assert numpy.allclose(tile, mosaic[:, :256])
+    ElevationService.tile_cache.clear()
+
+
+def _encode_png(heights):
+    f = BytesIO()
+    Image.fromarray(elevation.encode_terrarium(heights)).save(f, format='png')
+    return f.getvalue()
+
+
+def test_create_dem_missing_tiles(tmpdir):
+    source = DirectoryTileSource('Empty', str(tmpdir.mkdir('source')))
+    store = DirectoryTileStore(str(tmpdir.mkdir('store')))
+    service = ElevationService(source, source, elevation_store=store, normals_store=store)
+
+    # Tiles that can't be fetched are reported, rather than written to the DEM as flat patches
+    extent = Extent(-122.7, 45.5, -122.6, 45.6, projection=Proj(init='EPSG:4326'))
+    path = tmpdir.join('dem.asc')
+    task = Task('DEM')
+    with pytest.raises(MissingTilesError) as e:
+        service.create_dem(extent, extent, (10, 10), 1000, str(path), task)
+    task.status = Task.COMPLETE     # Remove the task from the task list, as GenerateDEMThread does
+    assert len(e.value.failed) == 10
+    assert not path.exists()
@@ -0,0 +1,48 @@
+from io import BytesIO
+
+import mercantile
+import numpy
+import rasterio
+from PIL import Image
+from rasterio.transform import Affine
+
+from vistas.core.gis.elevation import meters_per_px
+from vistas.core.gis.raster_source import MERCATOR_ORIGIN, RasterTileSource, downsample
+
+
+def test_downsample_is_aligned_and_ignores_nodata():
+    grid = numpy.array([
+        [1, 3, 5],
+        [numpy.nan, 5, 7]
+    ], dtype=numpy.float32)
+
+    # An odd x offset pads the left column, so the first output cell only covers the first input column
+    result, x0, y0 = downsample(grid, 3, 2)
+    assert (x0, y0) == (1, 1)
+    numpy.testing.assert_allclose(result, [[1, 5]])
+
+
+def test_raster_source_renders_terrarium_tiles(tmpdir):
+    # A 64 x 64 pixel DEM in Web Mercator, covering exactly one z=14 tile at 1/4 of its native resolution
+    tile = mercantile.Tile(2800, 6000, 14)
+    resolution = meters_per_px(14) * 4
+    heights = numpy.linspace(100, 200, 64 * 64, dtype=numpy.float32).reshape(64, 64)
+
+    path = str(tmpdir.join('dem.tif'))
+    left = tile.x * 256 * meters_per_px(14) - MERCATOR_ORIGIN
+    top = MERCATOR_ORIGIN - tile.y * 256 * meters_per_px(14)
+    with rasterio.open(path, 'w', driver='GTiff', width=64, height=64, count=1, dtype='float32', crs='EPSG:3857',
+                       transform=Affine(resolution, 0, left, 0, -resolution, top)) as dst:
+        dst.write(heights, 1)
+
+    source = RasterTileSource(path, cache_dir=str(tmpdir.join('cache')))
+    assert source.max_zoom == 12
+
+    rgb = numpy.asarray(Image.open(BytesIO(source.render(tile))).convert('RGB')).astype(numpy.float32)
+    decoded = rgb[:, :, 0] * 256.0 + rgb[:, :, 1] + rgb[:, :, 2] / 256.0 - 32768.0
+    numpy.testing.assert_allclose(decoded[::4, ::4], heights, atol=0.01)
+
+    # Lower zoom levels are built from the base level, and tiles above it are upsampled from it
+    source.render(mercantile.parent(tile, zoom=11))
+    assert set(source._levels) == {11, 12}
+    assert len(tmpdir.join('cache').listdir()[0].listdir()) == 2
@@ -0,0 +1,101 @@
+import os
+import threading
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+from mercantile import Tile
+from pytest import fixture
+
+from vistas.core.gis.tiles import TileSource, URLTileSource, DirectoryTileSource, TileFetcher, DirectoryTileStore, \
+    MBTilesStore
+from vistas.core.task import Task
+
+
+@fixture(scope='function')
+def tile_dir(tmpdir):
+    for tile in (Tile(0, 0, 1), Tile(1, 0, 1)):
+        path = tmpdir.join(str(tile.z), str(tile.x), '{}.png'.format(tile.y))
+        path.write_binary('{}/{}/{}'.format(tile.z, tile.x, tile.y).encode(), ensure=True)
+    return str(tmpdir)
+
+
+@fixture(scope='function')
+def tile_server(tile_dir):
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=tile_dir))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}.png'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def _fetch(source, tiles, **kwargs):
+    received = {}
+    task = Task('Fetching')
+    jobs = [(source, t, lambda tile, data: received.update({tile: data})) for t in tiles]
+    failed = TileFetcher(**kwargs).fetch(jobs, task)
+    task.status = Task.COMPLETE
+    return received, [job[1] for job in failed], task
+
+
+def test_directory_source(tile_dir):
+    tiles = [Tile(0, 0, 1), Tile(1, 0, 1), Tile(1, 1, 1)]
+    received, failed, task = _fetch(DirectoryTileSource('Local', tile_dir), tiles)
+
+    assert received == {Tile(0, 0, 1): b'1/0/0', Tile(1, 0, 1): b'1/1/0'}
+    assert failed == [Tile(1, 1, 1)]
+    assert task.target == task.progress == 3
+
+
+def test_url_source(tile_server):
+    tiles = [Tile(0, 0, 1), Tile(1, 0, 1), Tile(1, 1, 1)]
+    received, failed, task = _fetch(URLTileSource('Test', tile_server), tiles, max_connections=2)
+
+    assert received == {Tile(0, 0, 1): b'1/0/0', Tile(1, 0, 1): b'1/1/0'}
+    assert failed == [Tile(1, 1, 1)]
+    assert task.progress == 3
+
+
+def test_retries():
+    class FlakySource(TileSource):
+        def __init__(self, failures):
+            super().__init__('Flaky')
+            self.failures = failures
+            self.attempts = 0
+
+        async def fetch(self, session, tile):
+            self.attempts += 1
+            if self.attempts <= self.failures:
+                raise OSError('Connection reset')
+            return b'data'
+
+    source = FlakySource(2)
+    received, failed, _ = _fetch(source, [Tile(0, 0, 0)], retries=2, backoff=0)
+    assert received == {Tile(0, 0, 0): b'data'}
+    assert source.attempts == 3
+
+    source = FlakySource(3)
+    received, failed, _ = _fetch(source, [Tile(0, 0, 0)], retries=2, backoff=0)
+    assert not received
+    assert failed == [Tile(0, 0, 0)]
+
+
+def test_mbtiles_store(tile_dir, tmpdir):
+    store = MBTilesStore(str(tmpdir.join('tiles.mbtiles')))
+    assert store.import_directory(tile_dir) == 2
+    assert store.existing(1, 0, 0, 1, 1) == {(0, 0), (1, 0)}
+    assert store.existing(1, 1, 0, 1, 0) == {(1, 0)}
+    assert store.read(Tile(1, 0, 1)) == b'1/1/0'
+    assert store.read(Tile(1, 1, 1)) is None
+
+    store.write_many([(Tile(1, 1, 1), b'new')])
+    assert store.read(Tile(1, 1, 1)) == b'new'
+
+    export_dir = tmpdir.join('export')
+    assert store.export_directory(str(export_dir)) == 3
+    assert DirectoryTileStore(str(export_dir)).existing(1, 0, 0, 1, 1) == {(0, 0), (1, 0), (1, 1)}
+    assert export_dir.join('1', '1', '1.png').read_binary() == b'new'
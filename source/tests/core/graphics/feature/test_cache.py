@@ -0,0 +1,34 @@
+import os
+
+import numpy
+import pyproj
+
+from vistas.core.graphics.feature.cache import FeatureMeshCache
+
+
+def test_feature_mesh_cache(tmpdir):
+    data_path = tmpdir.join('features.shp')
+    data_path.write_binary(b'shapes')
+    cache_dir = str(tmpdir.join('cache'))
+    wgs84 = pyproj.Proj(init='EPSG:4326')
+
+    verts = numpy.arange(12, dtype=numpy.float32).reshape(4, 3)
+    offsets = numpy.array([8])
+    cache = FeatureMeshCache(str(data_path), wgs84, cache_dir)
+    assert cache.load_mesh() is None
+    cache.save_mesh(verts, offsets)
+    cache.save_drape(9, 'Test', numpy.ones(4), numpy.zeros(12))
+
+    cache = FeatureMeshCache(str(data_path), wgs84, cache_dir)
+    cached_verts, cached_offsets = cache.load_mesh()
+    assert numpy.array_equal(cached_verts, verts) and numpy.array_equal(cached_offsets, offsets)
+    assert numpy.array_equal(cache.load_drape(9, 'Test')[0], numpy.ones(4))
+    assert cache.load_drape(10, 'Test') is None
+    assert cache.load_drape(9, 'Other') is None
+
+    # A different projection or changes to any of the source files invalidate the cache
+    assert FeatureMeshCache(str(data_path), pyproj.Proj(init='EPSG:3857'), cache_dir).load_mesh() is None
+    tmpdir.join('features.dbf').write_binary(b'attributes')
+    assert FeatureMeshCache(str(data_path), wgs84, cache_dir).load_mesh() is None
+    os.remove(str(tmpdir.join('features.dbf')))
+    assert FeatureMeshCache(str(data_path), wgs84, cache_dir).load_mesh() is not None
@@ -0,0 +1,132 @@
+from unittest.mock import MagicMock, patch
+
+import mercantile
+import numpy
+import pyproj
+import shapely.geometry as shp
+from shapely.ops import transform
+from triangle import triangulate
+
+from vistas.core.color import RGBColor
+from vistas.core.graphics.feature import factory
+from vistas.core.graphics.feature.factory import FeatureFactory
+
+
+def _features():
+    square = shp.box(0, 0, 1, 1)
+    pentagon = shp.Polygon([(2, 0), (3, 0), (3.5, 1), (2.5, 2), (1.5, 1)])
+    triangle = shp.Polygon([(-1, -1), (0, -2), (-2, -2)])
+    return [
+        dict(geometry=shp.mapping(square)),
+        dict(geometry=shp.mapping(shp.MultiPolygon([pentagon, triangle]))),
+        dict(geometry=shp.mapping(triangle))
+    ]
+
+
+def _reference(features, project):
+    """ Per-feature projection and triangulation, as previously done by generate_meshes """
+
+    tris = []
+    offsets = []
+    offset = 0
+    for feature in features:
+        shape = transform(project, shp.shape(feature['geometry']))
+        polys = [shape] if isinstance(shape, shp.Polygon) else list(shape.geoms)
+        for p in polys:
+            triangulation = triangulate(dict(vertices=numpy.array(list(p.exterior.coords)[:-1])))
+            t = triangulation.get('vertices')[triangulation.get('triangles')].reshape(-1, 2)
+            offset += t.size
+            tris.append(t)
+        offsets.append(offset)
+    return numpy.concatenate(tris), numpy.array(offsets)
+
+
+def test_triangulation_matches_per_feature():
+    data_src = MagicMock()
+    data_src.get_features.side_effect = _features
+    data_src.get_num_features.return_value = 3
+
+    coords, ring_offsets, feature_rings = FeatureFactory._extract_rings(MagicMock(data_src=data_src))
+    assert list(feature_rings) == [1, 3, 4]
+
+    wgs84, mercator = pyproj.Proj(init='EPSG:4326'), pyproj.Proj(init='EPSG:3857')
+    xs, ys = pyproj.transform(wgs84, mercator, coords[:, 0], coords[:, 1])
+    coords = numpy.column_stack((xs, ys))
+
+    # Use one ring per chunk, so that the process pool is used
+    with patch('{}.TRIANGULATE_CHUNK_RINGS'.format(factory.__name__), 1):
+        triangles, ring_sizes = FeatureFactory._triangulate(coords, ring_offsets)
+    offsets = numpy.concatenate(([0], numpy.cumsum(ring_sizes)))[feature_rings]
+
+    expected_triangles, expected_offsets = _reference(
+        _features(), lambda x, y, z=None: pyproj.transform(wgs84, mercator, x, y)
+    )
+    assert numpy.array_equal(triangles, expected_triangles)
+    assert numpy.array_equal(offsets, expected_offsets)
+
+
+def test_colors_expand_to_vertices():
+    data_src = MagicMock()
+    data_src.get_features.side_effect = lambda date=None: iter([dict(properties=dict(value=v)) for v in (0, 1, 2)])
+    data_src.get_columns.side_effect = lambda variables, date=None: dict(value=numpy.array([0, 1, 2]))
+    data_src.get_num_features.return_value = 3
+
+    factory = MagicMock(offsets=numpy.array([6, 24, 30]))    # 3, 9 and 3 vertices
+    expected = numpy.repeat([[0, 0, 0], [0.5, 0.5, 0.5], [1, 1, 1]], [3, 9, 3], axis=0)
+
+    factory.data_src = data_src
+    factory.vertex_ranges = lambda features=None: FeatureFactory.vertex_ranges(factory, features)
+    factory._color_func = None
+    factory._column_color_func = lambda columns: numpy.column_stack([columns['value'] / 2] * 3)
+    factory._color_variables = ['value']
+    colors = FeatureFactory.generate_colors(factory)
+    assert colors.dtype == numpy.float32
+    assert numpy.array_equal(colors, expected)
+
+    # Per-feature color functions give the same result
+    factory._column_color_func = None
+    factory._color_func = lambda feature, data: RGBColor(*[feature['properties']['value'] / 2] * 3)
+    factory._generate_feature_colors = lambda func, task: FeatureFactory._generate_feature_colors(factory, func, task)
+    assert numpy.array_equal(FeatureFactory.generate_colors(factory), expected)
+
+    # Only the vertices of some features
+    colors = FeatureFactory.generate_colors(factory, features=numpy.array([0, 2]))
+    assert numpy.array_equal(colors, numpy.concatenate((expected[:3], expected[12:])))
+    assert [list(x) for x in FeatureFactory.vertex_ranges(factory, numpy.array([0, 2]))] == [[0, 12], [3, 15]]
+
+
+def test_sample_elevation_reports_missing_tiles():
+    verts = numpy.array([[0.1, 0.2, 0], [0.9, 0.8, 0]], dtype=numpy.float32)
+    service = MagicMock()
+    service.create_data_dem.side_effect = [(numpy.ones((4, 4)), []), (numpy.zeros((4, 4, 3)), [])]
+
+    heights, normals, complete = FeatureFactory._sample_elevation(MagicMock(zoom=5), service, verts)
+    assert heights.shape == (2,) and normals.shape == (6,)
+    assert complete
+
+    # Drapes sampled from placeholder tiles are reported as incomplete, so that they aren't cached. Tiles missing from
+    # both requests are only counted once.
+    tile, other = mercantile.Tile(0, 0, 5), mercantile.Tile(1, 0, 5)
+    service.create_data_dem.side_effect = [
+        (numpy.ones((4, 4)), [(None, tile, None)]), (numpy.zeros((4, 4, 3)), [(None, tile, None), (None, other, None)])
+    ]
+    with patch('{}.post_message'.format(factory.__name__)) as post_message:
+        *_, complete = FeatureFactory._sample_elevation(MagicMock(zoom=5), service, verts)
+        assert post_message.call_args[0][0].startswith('2 elevation tiles')
+    assert not complete
+
+
+def test_colors_without_cached_mesh():
+    data_src = MagicMock()
+    data_src.get_features.side_effect = _features
+    data_src.get_num_features.return_value = 3
+
+    # Offsets are rebuilt if the mesh cache was removed after the vertices were built
+    mock = MagicMock(offsets=None, _color_func=None, _column_color_func=None, use_cache=True, data_src=data_src)
+    mock.feature_cache.load_mesh.return_value = None
+    mock._build_mesh.return_value = (None, numpy.array([6, 24, 30]))
+    mock._default_color_function = FeatureFactory._default_color_function
+    mock.vertex_ranges = lambda features=None: FeatureFactory.vertex_ranges(mock, features)
+    colors = FeatureFactory.generate_colors(mock)
+    assert colors.shape == (15, 3)
+    assert list(mock.offsets) == [6, 24, 30]
@@ -0,0 +1,23 @@
+import numpy
+
+from vistas.core.graphics.terrain.factory import stitch_seams
+
+
+def test_stitch_seams():
+    grids = {(x, y): numpy.full((4, 4), x * 10 + y, dtype=numpy.float32) for x, y in ((0, 0), (1, 0), (0, 1))}
+    stitched = stitch_seams(grids)
+
+    # The north-west tile takes its neighbors' edges; the others have no eastern or southern neighbor
+    assert set(stitched) == {(0, 0)}
+    nw = stitched[(0, 0)]
+    assert (nw[:-1, -1] == 10).all()
+    assert (nw[-1] == 1).all()
+    assert (nw[:-1, :-1] == 0).all()
+
+    # Stitching across the bottom row, which previously never matched its neighbor
+    grids[(1, 1)] = numpy.full((4, 4), 11, dtype=numpy.float32)
+    stitched = stitch_seams(grids)
+    assert set(stitched) == {(0, 0), (1, 0), (0, 1)}
+    assert (stitched[(1, 0)][-1] == 11).all()
+    assert (stitched[(0, 1)][:, -1] == 11).all()
+    assert stitched[(0, 0)][-1, -1] == 11
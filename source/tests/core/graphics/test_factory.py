@@ -0,0 +1,77 @@
+from unittest.mock import MagicMock, patch
+
+from mercantile import Tile
+
+from tests.fixtures import generic_app
+from vistas.core import threading
+from vistas.core.graphics import factory
+from vistas.core.graphics.factory import BuildScheduler, MeshFactoryWorker, MapMeshFactory
+from vistas.core.task import Task
+
+generic_app  # Make the fixture import look used to IDEs
+
+
+def test_newer_build_supersedes(generic_app):
+    def run_test():
+        factory = MagicMock()
+        factory.scheduler = BuildScheduler()
+
+        with patch.object(BuildScheduler, 'pool') as pool_mock:
+            first = MeshFactoryWorker(factory)
+            first.start()
+            second = MeshFactoryWorker(factory)
+            second.start()
+            assert pool_mock.submit.call_count == 2
+
+        assert first.superseded and first.task.should_stop
+        assert not second.superseded and not second.should_stop
+
+        # Calls to the main thread from a superseded build are dropped
+        sync_fn = MagicMock()
+        with patch('{}.wx.PostEvent'.format(threading.__name__), new=lambda handler, event: handler.on_sync(event)):
+            first.sync_with_main(sync_fn)
+            assert not sync_fn.called
+            second.sync_with_main(sync_fn)
+            assert sync_fn.called
+
+        Task.tasks = []
+
+    generic_app(run_test)
+
+
+def test_map_mesh_factory_retains_zoom_levels():
+    built = []
+
+    class Factory(MapMeshFactory):
+        mesh_cache_bytes = 250
+
+        def build(self):
+            built.append(self.zoom)
+            self.items.append(MagicMock(geometry=MagicMock(nbytes=100)))
+            self.built = True
+
+    extent = MagicMock()
+    extent.tiles = lambda zoom: [Tile(0, 0, zoom)]
+
+    with patch('{}.BoundingBoxHelper'.format(factory.__name__)), patch('{}.post_redisplay'.format(factory.__name__)):
+        mesh_factory = Factory(extent, None, initial_zoom=9)
+        mesh_9 = mesh_factory.items[0]
+        mesh_factory.zoom = 10
+        mesh_10 = mesh_factory.items[0]
+
+        # Switching back to a zoom level restores its meshes without building
+        mesh_factory.zoom = 9
+        assert built == [9, 10]
+        assert mesh_factory.items == [mesh_9]
+
+        # Only two mesh sets fit in the budget, so the least recently used one is released
+        mesh_factory.zoom = 11
+        mesh_factory.zoom = 12
+        assert built == [9, 10, 11, 12]
+        assert mesh_10.geometry.dispose.called
+        assert not mesh_9.geometry.dispose.called
+        assert mesh_factory.mesh_cache.evictions == 1
+
+        mesh_factory.dispose()
+        assert mesh_9.geometry.dispose.called
+        assert len(mesh_factory.mesh_cache) == 0
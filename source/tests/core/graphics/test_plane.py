@@ -0,0 +1,57 @@
+import numpy
+
+from vistas.core.graphics import plane
+
+
+def _loop_indices(width, height):
+    index_array = []
+    for j in range(height - 1):
+        for i in range(width - 1):
+            a = i + width * j
+            b = i + width * (j + 1)
+            c = (i + 1) + width * (j + 1)
+            d = (i + 1) + width * j
+            index_array += [a, b, d]
+            index_array += [b, c, d]
+    return numpy.array(index_array)
+
+
+def test_make_grid_indices():
+    for width, height in ((2, 2), (5, 3), (3, 7)):
+        assert (plane.make_grid_indices(width, height) == _loop_indices(width, height)).all()
+
+
+def test_get_grid_indices_cached():
+    plane.clear_grid_index_cache()
+    first = plane.get_grid_indices(16, 8)
+    assert plane.get_grid_indices(16, 8) is first
+    assert not first.flags.writeable
+    assert first.dtype == numpy.uint32
+    assert plane.get_grid_indices(8, 16) is not first
+
+
+def test_compute_grid_normals_slope():
+    heights = numpy.fromfunction(lambda x, y: 2 * x, (4, 5))     # z = 2x
+    normals = plane.compute_grid_normals(heights, 1.0)
+    expected = numpy.array([-2, 0, 1]) / numpy.sqrt(5)
+    assert numpy.allclose(normals, expected)
+
+
+def test_compute_grid_normals_flat():
+    normals = plane.compute_grid_normals(numpy.zeros((3, 3)), 10.0)
+    assert numpy.allclose(normals, [0, 0, 1])
+
+
+def test_prepare_plane():
+    heights = numpy.fromfunction(lambda x, y: x + y, (3, 4))
+    prepared = plane.PlaneGeometry.prepare(4, 3, 2.0, heights)
+
+    vertices = prepared.vertices.reshape(3, 4, 3)
+    assert numpy.allclose(vertices[:, :, 2], heights)
+    assert numpy.allclose(vertices[-1, -1, :2], [4.0, 6.0])
+    assert numpy.allclose(prepared.normals, plane.compute_grid_normals(heights, 2.0))
+    assert prepared.indices is plane.get_grid_indices(4, 3)
+
+    bbox = prepared.bounding_box
+    assert (bbox.min_x, bbox.min_y, bbox.min_z) == (0, 0, 0)
+    assert (bbox.max_x, bbox.max_y, bbox.max_z) == (4, 6, 5)
@@ -0,0 +1,129 @@
+import datetime
+
+import numpy
+
+from vistas.core.cache import LRUCache
+from vistas.core.plugins.data import RasterDataPlugin, TemporalInfo, grid_nbytes
+
+
+class CountingRaster(RasterDataPlugin):
+    """ A raster whose value at each timestep is the timestep's day, counting reads """
+
+    time_info = None
+
+    def __init__(self, path, timestamps):
+        super().__init__()
+        self.path = path
+        self.time_info = TemporalInfo()
+        self.time_info.timestamps = timestamps
+        self.reads = []
+
+    def read_data(self, variable, date=None):
+        self.reads.append((variable, date))
+        return numpy.full((10, 10), date.day, dtype=numpy.float64)
+
+
+def test_grid_cache(monkeypatch):
+    monkeypatch.setattr(RasterDataPlugin, '_grid_cache', LRUCache(3 * 800))
+
+    days = [datetime.datetime(2000, 1, d) for d in (1, 2, 3, 4)]
+    a = CountingRaster('a.asc', days)
+    b = CountingRaster('b.asc', days)
+
+    # Dates snap to the nearest timestep, so that they share cache entries
+    assert a.get_data('v', days[0])[0, 0] == 1
+    assert a.get_data('v', datetime.datetime(2000, 1, 1, 6))[0, 0] == 1
+    assert a.get_data('v', datetime.datetime(1999, 1, 1))[0, 0] == 1
+    assert a.get_data('v', datetime.datetime(2000, 1, 2, 18))[0, 0] == 3
+    assert b.get_data('v', days[0])[0, 0] == 1
+    assert a.reads == [('v', days[0]), ('v', days[2])]
+    assert b.reads == [('v', days[0])]
+
+    # Returned grids are copies
+    a.get_data('v', days[0])[:] = 0
+    assert a.get_data('v', days[0])[0, 0] == 1
+
+    # The least recently used grid is evicted once the budget is exceeded
+    a.get_data('v', days[3])
+    a.get_data('v', days[2])
+    assert a.reads[-2:] == [('v', days[3]), ('v', days[2])]
+
+    stats = RasterDataPlugin.grid_cache().stats
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (4, 5, 2)
+
+
+def test_grid_nbytes():
+    grid = numpy.zeros((10, 10), dtype=numpy.float32)
+    assert grid_nbytes(grid) == 400
+    assert grid_nbytes(numpy.ma.masked_equal(grid, 0)) == 500
+
+
+def test_prefetch(monkeypatch):
+    monkeypatch.setattr(RasterDataPlugin, '_grid_cache', LRUCache(10 * 800))
+
+    days = [datetime.datetime(2000, 1, d) for d in (1, 2, 3, 4)]
+    a = CountingRaster('a.asc', days)
+
+    for future in a.prefetch('v', days[1:3]):
+        future.result()
+    assert a.prefetch('v', days[1:3]) == []
+
+    assert a.get_data('v', days[1])[0, 0] == 2
+    assert a.get_data_async('v', days[2]).result()[0, 0] == 3
+    assert a.reads == [('v', days[1]), ('v', days[2])]
+
+
+class WindowedRaster(CountingRaster):
+    """ A raster whose cells hold day * 1000 + row * 10 + column, counting windowed reads """
+
+    def __init__(self, path, timestamps):
+        super().__init__(path, timestamps)
+        self.windows = []
+
+    def read_data(self, variable, date=None):
+        self.reads.append((variable, date))
+        rows, cols = numpy.indices((10, 10))
+        return numpy.ma.masked_equal(date.day * 1000 + rows * 10 + cols, date.day * 1000)
+
+    def read_window(self, variable, date, window):
+        self.windows.append((date, window))
+        (row_start, row_stop), (col_start, col_stop) = window
+        return self.read_data(variable, date)[row_start:row_stop, col_start:col_stop]
+
+
+def test_sample(monkeypatch):
+    monkeypatch.setattr(RasterDataPlugin, '_grid_cache', LRUCache(10 * 800))
+
+    days = [datetime.datetime(2000, 1, d) for d in (1, 2, 3)]
+    a = WindowedRaster('a.asc', days)
+
+    # Uncached grids are read over the window around the cells
+    assert a.sample('v', days[1], 3, 4) == 2034
+    values = a.sample('v', days[1], [2, 5], [7, 1])
+    assert values.tolist() == [2027, 2051]
+    assert a.windows == [(days[1], ((3, 4), (4, 5))), (days[1], ((2, 6), (1, 8)))]
+    assert a.sample('v', days[1], 0, 0) is numpy.ma.masked
+
+    # Cached grids are sampled without reading
+    a.get_data('v', days[0])
+    assert a.sample('v', days[0], [[1], [2]], [3, 4]).tolist() == [[1013, 1014], [1023, 1024]]
+    assert len(a.windows) == 3
+
+    # Plugins without windowed reads sample from the whole grid
+    b = CountingRaster('b.asc', days)
+    assert b.sample('v', days[2], 9, 9) == 3
+    assert b.reads == [('v', days[2])]
+
+
+def test_time_series(monkeypatch):
+    monkeypatch.setattr(RasterDataPlugin, '_grid_cache', LRUCache(10 * 800))
+
+    days = [datetime.datetime(2000, 1, d) for d in (1, 2, 3)]
+    a = WindowedRaster('a.asc', days)
+
+    series = a.time_series('v', [0, 6], [0, 2])
+    assert series.shape == (3, 2)
+    assert series[:, 1].tolist() == [1062, 2062, 3062]
+    assert series.mask[:, 0].all()
+    assert a.windows == [(d, ((0, 7), (0, 3))) for d in days]
+    assert a.time_series('v', 6, 2).tolist() == [1062, 2062, 3062]
@@ -0,0 +1,127 @@
+import datetime
+from unittest.mock import MagicMock, patch
+
+import numpy
+import pytest
+
+from vistas.core.color import RGBColor
+from vistas.core.legend import CategoricalLegend
+from tests.fixtures import load_plugin
+
+RANGES = {
+    'sorted': [(0, 9.5), (10, 19.5), (20, 30)],
+    'unsorted': [(20, 30), (0, 9.5), (10, 19.5)],
+    'touching': [(0, 10), (10, 20), (15, 30)],
+}
+
+
+@pytest.fixture(scope='module')
+def envision_module():
+    return load_plugin('envision')
+
+
+def _style(legend):
+    """ A style attribute, as built by EnvisionVisualization.parse_envision_style() """
+
+    categories = [(RGBColor(i / 10, 0, 1 - i / 10), entry['label']) for i, entry in enumerate(legend)]
+    style = {'legend': legend, 'categories': categories}
+    if 'minVal' in legend[0]:
+        style['minmax'] = [(float(entry['minVal']), float(entry['maxVal'])) for entry in legend]
+    return style
+
+
+def _reference_color(style, value, grey):
+    """ First-match lookup, as previously done by EnvisionVisualization.color_shapes() """
+
+    legend = style['legend']
+    minmax = style.get('minmax')
+    string_value = ''
+
+    if minmax is not None:
+        for i, pair in enumerate(minmax):
+            if pair[0] <= value <= pair[1]:
+                string_value = legend[i].get('label')
+                break
+    else:
+        for entry in legend:
+            try:
+                val = float(entry.get('value'))
+            except ValueError:
+                continue
+            if val == value:
+                string_value = entry.get('label')
+                break
+
+    color = CategoricalLegend(style['categories']).get_color(string_value)
+    if color is None:
+        color = grey
+    return color.rgb.rgb_list
+
+
+@pytest.mark.parametrize('ranges', RANGES.values(), ids=list(RANGES.keys()))
+def test_range_classifier(envision_module, ranges):
+    legend = [dict(label='Class {}'.format(i), minVal=str(lo), maxVal=str(hi)) for i, (lo, hi) in enumerate(ranges)]
+    style = _style(legend)
+    classifier = envision_module.StyleClassifier.from_style(style)
+    assert classifier.overlapping == (ranges is RANGES['touching'])
+
+    # Every bound, the gaps between ranges, values outside of all ranges, and NaN
+    values = numpy.concatenate((numpy.arange(-5, 35.5, 0.25), [9.75, 19.75, 30.0001, numpy.nan]))
+    expected = [_reference_color(style, v, envision_module.GREY) for v in values]
+    assert numpy.allclose(classifier.get_colors(values), expected)
+
+    classes = classifier.classify(numpy.array([0, 9.5, 10, 19.5, 20, 30, 9.75, -1, numpy.nan]))
+    if ranges is RANGES['touching']:
+        assert list(classes) == [0, 0, 0, 1, 1, 2, 0, -1, -1]
+    else:
+        first, second, third = [ranges.index(r) for r in RANGES['sorted']]
+        assert list(classes) == [first, first, second, second, third, third, -1, -1, -1]
+
+
+def test_categorical_classifier(envision_module):
+    legend = [
+        dict(label='One', value='1'),
+        dict(label='Two', value='2'),
+        dict(label='Other', value='other'),     # Non-numeric values can't match
+        dict(label='Duplicate', value='2'),     # Shadowed by 'Two'
+        dict(label='One', value='3.5'),         # Colored by the first 'One' category
+        dict(label='Negative', value='-4'),
+    ]
+    style = _style(legend)
+    classifier = envision_module.StyleClassifier.from_style(style)
+
+    values = [1, 2, 2.0, 3.5, -4, 0, 5, numpy.nan, None, 'other', '1']
+    expected = [_reference_color(style, v, envision_module.GREY) for v in values]
+    assert numpy.allclose(classifier.get_colors(values), expected)
+    assert list(classifier.classify(values)) == [0, 1, 1, 4, 5, -1, -1, -1, -1, -1, -1]
+
+    # Whole numeric columns
+    column = numpy.array([2, 1, 7, -4], dtype=numpy.int32)
+    assert list(classifier.classify(column)) == [1, 0, -1, 5]
+    expected = [_reference_color(style, v, envision_module.GREY) for v in column]
+    assert numpy.allclose(classifier.get_colors(column), expected)
+
+
+def test_color_deltas(envision_module, tmpdir):
+    path = tmpdir.join('deltas.csv')
+    path.write('year,idu,field,newValue\n2000,0,LULC,10\n2001,1,LULC,10\n2002,0,LULC,5\n')
+    delta_data = load_plugin('envision_delta').EnvisionDeltaArray()
+    delta_data.set_path(str(path))
+
+    legend = [dict(label='Low', minVal='0', maxVal='9'), dict(label='High', minVal='10', maxVal='100')]
+    style = _style(legend)
+    style['column'] = 'LULC'
+    style['classifier'] = envision_module.StyleClassifier.from_style(style)
+    viz = MagicMock(
+        envision_style={'Land Use': style}, current_attribute='Land Use', delta_data=delta_data, delta_engines={}
+    )
+    base = numpy.array([1, 2, 3])
+
+    # Features are colored by their base value plus the deltas up to the current year. Features without deltas show
+    # their base value, where they were previously colored grey.
+    with patch.object(envision_module, 'Timeline') as timeline:
+        for year, expected in [(1999, [1, 2, 3]), (2000, [11, 2, 3]), (2001, [11, 12, 3]), (2002, [16, 12, 3])]:
+            timeline.app().current = datetime.datetime(year, 1, 1)
+            colors = envision_module.EnvisionVisualization.color_deltas(viz, {'LULC': base})
+            assert numpy.allclose(colors, [_reference_color(style, v, envision_module.GREY) for v in expected])
+            assert not numpy.allclose(colors[2], envision_module.GREY.rgb.rgb_list)
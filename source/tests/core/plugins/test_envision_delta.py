@@ -0,0 +1,176 @@
+import datetime
+import os
+from unittest.mock import patch
+
+import numpy
+import pytest
+
+from tests.fixtures import load_plugin
+
+CSV = """year,idu,field,newValue
+2001,3,LULC,1.5
+2000,1,AREA,2
+2000, 0 ,LULC,3
+
+2001,2,AREA,4.25
+2001,1,AREA,5
+2003,0,LULC,6
+"""
+
+
+@pytest.fixture(scope='module')
+def delta_module():
+    return load_plugin('envision_delta')
+
+
+@pytest.fixture
+def csv_path(tmpdir):
+    path = tmpdir.join('deltas.csv')
+    path.write(CSV)
+    return str(path)
+
+
+def test_load_csv(delta_module, csv_path):
+    deltas = delta_module.DeltaArray()
+    deltas.load_csv(csv_path)
+
+    # Sorted by year, field and IDU, with fields coded in order of first appearance
+    assert deltas.fields == ['LULC', 'AREA']
+    assert deltas.years == [2000, 2001, 2003]
+    assert deltas.base_year == 2000
+    assert [d.year for d in deltas.timestamps] == [2000, 2001, 2003]
+    assert list(deltas.deltas.year) == [2000, 2000, 2001, 2001, 2001, 2003]
+    assert list(deltas.deltas.idu) == [0, 1, 3, 1, 2, 0]
+    assert list(deltas.deltas.field_code) == [0, 1, 0, 1, 1, 0]
+    assert list(deltas.deltas.new_value) == [3, 2, 1.5, 5, 4.25, 6]
+
+
+def test_index(delta_module, csv_path):
+    deltas = delta_module.DeltaArray()
+    deltas.load_csv(csv_path)
+
+    assert deltas.index == {
+        (2000, 0): (0, 1), (2000, 1): (1, 2), (2001, 0): (2, 3), (2001, 1): (3, 5), (2003, 0): (5, 6)
+    }
+    area = deltas.get(2001, 'AREA')
+    assert list(area.idu) == [1, 2] and list(area.new_value) == [5, 4.25]
+    assert len(deltas.get(2003, 'AREA')) == 0
+    assert len(deltas.get(2002, 'LULC')) == 0
+    assert len(deltas.get(2000, 'MISSING')) == 0
+    assert deltas.has_year(2003) and not deltas.has_year(2002)
+
+
+def test_sidecar(delta_module, csv_path, tmpdir, monkeypatch):
+    deltas = delta_module.DeltaArray()
+    deltas.load_csv(csv_path)
+    sidecar = str(tmpdir.join('deltas.deltas.npz'))
+    deltas.save(sidecar, '10:1.0')
+
+    loaded = delta_module.DeltaArray()
+    assert loaded.load(sidecar, '10:1.0')
+    assert numpy.array_equal(loaded.deltas, deltas.deltas)
+    assert loaded.fields == deltas.fields
+    assert loaded.index == deltas.index
+    assert loaded.years == deltas.years
+
+    # Sidecars for a different version of the CSV, or of the format, are rejected
+    assert not delta_module.DeltaArray().load(sidecar, '10:2.0')
+    assert not delta_module.DeltaArray().load(str(tmpdir.join('missing.npz')), '10:1.0')
+    monkeypatch.setattr(delta_module, 'SIDECAR_VERSION', delta_module.SIDECAR_VERSION + 1)
+    assert not delta_module.DeltaArray().load(sidecar, '10:1.0')
+
+
+def test_stale_sidecar(delta_module, csv_path):
+    plugin = delta_module.EnvisionDeltaArray()
+    plugin.set_path(csv_path)
+    assert os.path.exists(plugin.sidecar_path)
+    assert plugin.variables == ['LULC', 'AREA']
+
+    # The sidecar is reused while the CSV is unchanged
+    with patch.object(delta_module.DeltaArray, 'load_csv') as load_csv:
+        delta_module.EnvisionDeltaArray().set_path(csv_path)
+        assert not load_csv.called
+
+    # ... and rebuilt once its size or modification time changes
+    with open(csv_path, 'a') as f:
+        f.write('2004,7,SLOPE,1\n')
+    stat = os.stat(csv_path)
+    os.utime(csv_path, (stat.st_atime, stat.st_mtime + 10))
+
+    plugin = delta_module.EnvisionDeltaArray()
+    plugin.set_path(csv_path)
+    assert plugin.variables == ['LULC', 'AREA', 'SLOPE']
+    assert plugin.delta_array.years == [2000, 2001, 2003, 2004]
+
+
+def test_get_data(delta_module, csv_path):
+    plugin = delta_module.EnvisionDeltaArray()
+    plugin.set_path(csv_path)
+
+    # Deltas of a year are a record array slice, rather than a list of namedtuples
+    data = plugin.get_data('AREA', datetime.datetime(2001, 1, 1))
+    assert isinstance(data, numpy.recarray)
+    assert list(data.idu) == [1, 2] and list(data.new_value) == [5, 4.25]
+    assert len(plugin.get_data('AREA', datetime.datetime(2003, 6, 1))) == 0
+    assert plugin.get_data('AREA', datetime.datetime(2002, 1, 1)) is None
+    assert plugin.get_data('AREA') is None
+
+
+def _engine_deltas(delta_module):
+    """ Random deltas for two fields and 50 IDUs over 2000 - 2030, with some years that have no deltas """
+
+    rng = numpy.random.RandomState(0)
+    years = numpy.array([y for y in range(2000, 2031) if y not in (2005, 2006, 2007, 2021)])
+    rows = numpy.array([
+        (y, rng.randint(0, 50), rng.randint(0, 2), rng.randint(-5, 6)) for y in years for _ in range(20)
+    ])
+    deltas = delta_module.DeltaArray()
+    deltas.set_columns(
+        rows[:, 0].astype(numpy.int32), rows[:, 1].astype(numpy.int32), rows[:, 2].astype(numpy.int16),
+        rows[:, 3].astype(numpy.float64), ['LULC', 'AREA']
+    )
+    return deltas, rows
+
+
+def _cumulative_state(rows, field_code, base, year):
+    """ The base values plus every delta of a field up to and including `year` """
+
+    state = base.astype(numpy.float64)
+    for y, idu, code, value in rows:
+        if code == field_code and y <= year:
+            state[idu] += value
+    return state
+
+
+def test_engine_forward(delta_module):
+    deltas, rows = _engine_deltas(delta_module)
+    base = numpy.arange(50)
+    engine = delta_module.DeltaEngine(deltas, 'AREA', base, interval=4)
+
+    # Stepping one year at a time crosses checkpoints, and years without deltas keep the previous state
+    for year in range(1995, 2035):
+        state = engine.state_at(year)
+        assert numpy.array_equal(state, _cumulative_state(rows, 1, base, year))
+        assert not state.flags.writeable
+    assert numpy.array_equal(engine.state_at(2007), engine.state_at(2004))
+
+
+def test_engine_random_access(delta_module):
+    deltas, rows = _engine_deltas(delta_module)
+    base = numpy.arange(50)
+    engine = delta_module.DeltaEngine(deltas, 'LULC', base, interval=4)
+
+    # Backward from the last state materialized, to either side of a checkpoint, and to the same year again
+    for year in [2030, 2012, 2011, 2013, 2029, 2004, 2030, 2030, 1990, 2021, 2019]:
+        assert numpy.array_equal(engine.state_at(year), _cumulative_state(rows, 0, base, year))
+
+    for year in numpy.random.RandomState(1).randint(1995, 2035, 50):
+        assert numpy.array_equal(engine.state_at(year), _cumulative_state(rows, 0, base, year))
+
+
+def test_engine_missing_field(delta_module):
+    deltas, _ = _engine_deltas(delta_module)
+    base = numpy.arange(50)
+    engine = delta_module.DeltaEngine(deltas, 'MISSING', base)
+    for year in (1990, 2000, 2015, 2040):
+        assert numpy.array_equal(engine.state_at(year), base)
@@ -0,0 +1,59 @@
+import datetime
+
+import numpy
+import pytest
+
+from vistas.core.cache import LRUCache
+from vistas.core.plugins.data import RasterDataPlugin, TemporalInfo
+from tests.fixtures import load_plugin
+
+netCDF4 = pytest.importorskip('netCDF4')
+pytest.importorskip('clover')
+
+DAYS = [datetime.datetime(2000, 1, d) for d in (1, 2, 3)]
+
+
+@pytest.fixture(scope='module')
+def netcdf_module():
+    return load_plugin('netcdf')
+
+
+@pytest.fixture(params=['NETCDF3_CLASSIC', 'NETCDF4'])
+def plugin(request, tmpdir, monkeypatch, netcdf_module):
+    monkeypatch.setattr(RasterDataPlugin, '_grid_cache', LRUCache(1024 ** 2))
+
+    path = str(tmpdir.join('test.nc'))
+    with netCDF4.Dataset(path, 'w', format=request.param) as ds:
+        ds.createDimension('time', 3)
+        ds.createDimension('y', 4)
+        ds.createDimension('x', 5)
+        ds.createVariable('value', 'f4', ('time', 'y', 'x'))[:] = numpy.arange(60).reshape(3, 4, 5)
+        ds.createVariable('mask', 'i2', ('y', 'x'))[:] = numpy.arange(20).reshape(4, 5)
+
+    # Set up the plugin as load_data() would, which requires coordinate variables
+    plugin = netcdf_module.NetCDF4DataPlugin()
+    plugin.path = path
+    plugin.time_info = TemporalInfo()
+    plugin.time_info.timestamps = DAYS
+    plugin._times = numpy.array(DAYS, dtype='datetime64[us]')
+    yield plugin
+    plugin.close()
+
+
+def test_read(plugin):
+    assert plugin.timestep(datetime.datetime(2000, 1, 2, 13)) == DAYS[2]
+    assert plugin.get_data('value', DAYS[1]).tolist() == numpy.arange(20, 40).reshape(4, 5).tolist()
+    assert plugin.read_window('value', DAYS[2], ((1, 3), (2, 4))).tolist() == [[47, 48], [52, 53]]
+    assert plugin.get_data('mask', DAYS[1]).tolist() == numpy.arange(20).reshape(4, 5).tolist()
+
+
+def test_time_series(plugin):
+    assert plugin.time_series('value', [0, 3], [1, 4]).tolist() == [[1, 19], [21, 39], [41, 59]]
+    assert plugin.time_series('mask', 2, 3).tolist() == [13, 13, 13]
+
+
+def test_close(plugin):
+    plugin.get_data('value', DAYS[0])
+    plugin.close()
+    assert plugin._dataset is None
+    assert plugin.sample('value', DAYS[1], 0, 0) == 20
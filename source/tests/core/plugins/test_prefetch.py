@@ -0,0 +1,40 @@
+import datetime
+from unittest.mock import MagicMock, patch
+
+from vistas.core.plugins import prefetch
+from vistas.core.plugins.data import RasterDataPlugin
+from vistas.core.plugins.prefetch import TimelinePrefetcher
+
+
+def test_prefetch_follows_timeline():
+    timestamps = [datetime.datetime(2000, 1, 1) + datetime.timedelta(days=d) for d in range(20)]
+    timeline = MagicMock(timestamps=timestamps, current_index=10)
+    plugin = MagicMock()
+    plugin.prefetch.return_value = []
+
+    prefetcher = TimelinePrefetcher(timeline, seconds=1, max_steps=4)
+    clock = patch('{}.time.monotonic'.format(prefetch.__name__))
+    active = patch.object(RasterDataPlugin, 'active_variables', return_value=[(plugin, 'v')])
+    with clock as monotonic, active:
+        # Stepping backwards slowly prefetches a single step behind
+        monotonic.return_value = 0
+        prefetcher.timeline_changed()
+        timeline.current_index = 9
+        monotonic.return_value = 2
+        prefetcher.timeline_changed()
+        assert prefetcher.direction == -1
+        assert plugin.prefetch.call_args[0] == ('v', [timestamps[8]])
+
+        # Fast playback forward prefetches further ahead, up to max_steps
+        for i in range(10, 14):
+            timeline.current_index = i
+            monotonic.return_value += 0.1
+            prefetcher.timeline_changed()
+        assert prefetcher.direction == 1
+        assert plugin.prefetch.call_args[0] == ('v', timestamps[14:18])
+
+        # Nothing is prefetched past the end of the timeline
+        timeline.current_index = 19
+        monotonic.return_value += 0.1
+        prefetcher.timeline_changed()
+        assert plugin.prefetch.call_args[0] == ('v', timestamps[14:18])
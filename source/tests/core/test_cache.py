@@ -0,0 +1,50 @@
+import numpy
+
+from vistas.core.cache import LRUCache
+
+
+def test_get_put():
+    cache = LRUCache(1024)
+    a = numpy.zeros(16, dtype=numpy.float32)
+    cache.put('a', a)
+
+    assert cache.get('a') is a
+    assert cache.get('b') is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.nbytes == a.nbytes
+
+
+def test_eviction():
+    evicted = []
+    cache = LRUCache(256, on_evict=lambda key, value: evicted.append(key))
+    for key in ('a', 'b', 'c'):
+        cache.put(key, numpy.zeros(100, dtype=numpy.uint8))
+
+    # 'a' is least recently used, but touching it makes 'b' the next to go
+    assert evicted == ['a']
+    cache.get('c')
+    cache.put('d', numpy.zeros(100, dtype=numpy.uint8))
+    assert evicted == ['a', 'b']
+    assert cache.keys() == ['c', 'd']
+    assert cache.evictions == 2
+    assert cache.nbytes == 200
+
+
+def test_oversized_entry():
+    cache = LRUCache(10)
+    cache.put('a', numpy.zeros(100, dtype=numpy.uint8))
+    assert 'a' not in cache
+    assert cache.nbytes == 0
+
+
+def test_replace_and_resize():
+    cache = LRUCache(1000)
+    cache.put('a', numpy.zeros(100, dtype=numpy.uint8))
+    cache.put('a', numpy.zeros(300, dtype=numpy.uint8))
+    assert cache.nbytes == 300
+    assert len(cache) == 1
+
+    cache.put('b', numpy.zeros(300, dtype=numpy.uint8))
+    cache.resize(400)
+    assert cache.keys() == ['b']
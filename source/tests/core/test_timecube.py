@@ -0,0 +1,65 @@
+import datetime
+
+import numpy
+import pytest
+from pyproj import Proj
+
+from vistas.core.cache import LRUCache
+from vistas.core.gis.extent import Extent
+from vistas.core.plugins.data import RasterDataPlugin, TemporalInfo
+from vistas.core.timecube import TimeCube, ingest
+
+
+class SeriesRaster(RasterDataPlugin):
+    """ A temporal raster with a recognizable value in every cell, and a masked corner """
+
+    time_info = None
+    variables = None
+    shape = None
+    affine = None
+    resolution = None
+    extent = None
+    data_name = None
+
+    def __init__(self, num_steps, shape):
+        super().__init__()
+        self.path = 'series.asc'
+        self.data_name = 'series'
+        self.variables = ['a', 'b']
+        self.shape = shape
+        self.affine = (10, 0, 0, 0, -10, 0)
+        self.resolution = 10
+        self.extent = Extent(0, -shape[0] * 10, shape[1] * 10, 0, Proj(init='EPSG:3857'))
+        self.time_info = TemporalInfo()
+        start = datetime.datetime(2000, 1, 1)
+        self.time_info.timestamps = [start + datetime.timedelta(days=d) for d in range(num_steps)]
+
+    def expected(self, variable, index):
+        rows, cols = numpy.indices(self.shape)
+        grid = rows * 1000 + cols + index * 1000000 + (0.5 if variable == 'b' else 0)
+        return numpy.ma.masked_where((rows < 2) & (cols < 2), grid.astype(numpy.int32 if variable == 'a' else float))
+
+    def read_data(self, variable, date=None):
+        return self.expected(variable, self.time_info.timestamps.index(date))
+
+
+@pytest.mark.parametrize('compression', ['zlib', None])
+def test_time_cube_round_trip(tmpdir, monkeypatch, compression):
+    monkeypatch.setattr(RasterDataPlugin, '_grid_cache', LRUCache(1024 ** 2))
+
+    plugin = SeriesRaster(5, (11, 7))
+    path = str(tmpdir.join('series.vcube'))
+    assert ingest(plugin, path, time_chunk=2, space_chunk=4, compression=compression)
+
+    cube = TimeCube(path)
+    assert cube.shape == (5, 11, 7)
+    assert cube.timestamps == plugin.time_info.timestamps
+    for variable in plugin.variables:
+        for i in range(5):
+            grid = cube.read(variable, i)
+            expected = plugin.expected(variable, i)
+            assert numpy.array_equal(grid.mask, expected.mask)
+            assert numpy.array_equal(grid.compressed(), expected.compressed())
+
+    window = cube.read('b', 3, ((1, 9), (3, 7)))
+    assert numpy.array_equal(window.filled(-1), plugin.expected('b', 3)[1:9, 3:7].filled(-1))
@@ -1,6 +1,12 @@
+import os
+import sys
+from importlib.util import spec_from_file_location, module_from_spec
+
 import pytest
 import wx
 
+PLUGINS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'plugins')
+
 
 @pytest.fixture(scope='function')
 def generic_app():
@@ -32,3 +38,18 @@ def generic_app():
             raise app.exc
 
     return run_test
+
+
+def load_plugin(name):
+    """
+    Import the main module of a plugin in the plugins directory. Each module is only run once, since plugin ids must be
+    unique.
+    """
+
+    module_name = 'plugins.{}'.format(name)
+    if module_name not in sys.modules:
+        spec = spec_from_file_location(module_name, os.path.join(PLUGINS_DIR, name, 'main.py'))
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+    return sys.modules[module_name]
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from threading import RLock
+
+
+def nbytes(value):
+    """ Default size function for cache entries. Works with numpy arrays and tuples/lists of numpy arrays. """
+
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(x) for x in value)
+    return getattr(value, 'nbytes', 0)
+
+
+class LRUCache:
+    """
+    A thread-safe, least-recently-used cache bounded by the total size of its entries in bytes. Keeps hit, miss and
+    eviction counters for inspection.
+    """
+
+    def __init__(self, max_bytes, sizeof=nbytes, on_evict=None):
+        """
+        Constructor
+        :param max_bytes: The total size budget of the cache. Least-recently-used entries are evicted to stay within it.
+        :param sizeof: A function returning the size in bytes of a cached value.
+        :param on_evict: An optional callback, called with (key, value) whenever an entry is evicted.
+        """
+
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()   # key -> (value, size)
+        self.lock = RLock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self._entries
+
+    def keys(self):
+        with self.lock:
+            return list(self._entries.keys())
+
+    def get(self, key, default=None):
+        """ Return the value for `key` and mark it as most recently used, or `default` on a miss. """
+
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """ Add or replace an entry, evicting least-recently-used entries as needed to stay within budget. """
+
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+
+            if size > self.max_bytes:
+                return      # Never cache something that can't fit
+
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+
+    def remove(self, key):
+        """ Remove an entry without counting it as an eviction. Returns the removed value, or None. """
+
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.nbytes -= entry[1]
+            return entry[0]
+
+    def resize(self, max_bytes):
+        """ Change the size budget, evicting entries if the cache no longer fits. """
+
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self._entries),
+                'nbytes': self.nbytes, 'max_bytes': self.max_bytes
+            }
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            key, (value, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
@@ -1,27 +1,80 @@
-import asyncio
 import os
+import tempfile
 from io import BytesIO
-from typing import Dict, Union
+from typing import Dict, List, Tuple, Union
 
-import aiohttp
 import mercantile
 import numpy
 from PIL import Image
 from pyproj import Proj, transform
 
+from vistas.core.cache import LRUCache
 from vistas.core.gis.file_writer import RasterWriter
+from vistas.core.gis.tiles import URLTileSource, TileFetcher, DirectoryTileStore, MBTilesStore
 from vistas.core.paths import get_config_dir
 from vistas.core.plugins.data import FeatureDataPlugin
 from vistas.core.plugins.interface import Plugin
+from vistas.core.preferences import Preferences
 
 TILE_SIZE = 256                 # Our tile representation size, can be changed
 DEFAULT_TILE_SIZE = 256         # ZXY tiles
+TILE_CACHE_BYTES = 256 * 1024 ** 2
+
+
+class MissingTilesError(Exception):
+    """ Raised when a DEM can't be built because some of the tiles it needs could not be retrieved. """
+
+    def __init__(self, failed):
+        super().__init__('{} elevation tiles could not be retrieved'.format(len(failed)))
+        self.failed = failed
 
 
 def meters_per_px(zoom):
     return 6378137.0 * 2 * numpy.pi / (TILE_SIZE * (2 ** zoom))
 
 
+def tile_coords(lons, lats, zoom):
+    """
+    Vectorized equivalent of mercantile.tile() that returns fractional XYZ tile coordinates for arrays of lon/lat
+    values. The integer part is the tile and the fractional part is the position within the tile.
+    """
+
+    n = 2 ** zoom
+    lats = numpy.clip(lats, -85.051129, 85.051129)
+    xs = (lons + 180.0) / 360.0 * n
+    ys = (1.0 - numpy.arcsinh(numpy.tan(numpy.radians(lats))) / numpy.pi) / 2.0 * n
+    return numpy.clip(xs, 0, n - 1e-9), numpy.clip(ys, 0, n - 1e-9)
+
+
+def encode_terrarium(heights):
+    """ Encode a height grid in meters as a terrarium RGB image array. """
+
+    value = numpy.clip(heights.astype(numpy.float64) + 32768.0, 0, 65536 - 1 / 256)
+    rgb = numpy.empty((*heights.shape, 3), dtype=numpy.uint8)
+    rgb[:, :, 0] = value // 256
+    rgb[:, :, 1] = numpy.floor(value) % 256
+    rgb[:, :, 2] = numpy.floor((value - numpy.floor(value)) * 256)
+    return rgb
+
+
+def heights_to_normals(heights, resolution):
+    """
+    Compute normals for a north-up height grid with square pixels of `resolution` meters. Normals use the same [0, 1]
+    encoding as decoded normal tiles, i.e. (n + 1) / 2 for the east, north and up components.
+    """
+
+    normals = numpy.empty((*heights.shape, 3), dtype=numpy.float32)
+    normals[:, :, 2] = 1.0
+    if min(heights.shape) < 2:
+        normals[:, :, 0:2] = 0.0
+    else:
+        d_south, d_east = numpy.gradient(heights.astype(numpy.float32), resolution)
+        normals[:, :, 0] = -d_east
+        normals[:, :, 1] = d_south
+        normals /= numpy.sqrt((normals ** 2).sum(axis=2))[:, :, None]
+    return normals * 0.5 + 0.5
+
+
 class ElevationService:
     """
     An interface for obtaining elevation data from public datasets sorted as a tile service. Can generate a digital
@@ -29,15 +82,96 @@ class ElevationService:
     """
 
     TILE_SIZE = 256
+    DEM_BLOCK_ROWS = 256
     AWS_ELEVATION = "https://s3.amazonaws.com/elevation-tiles-prod/terrarium/{z}/{x}/{y}.png"
     AWS_NORMALS = "https://s3.amazonaws.com/elevation-tiles-prod/normal/{z}/{x}/{y}.png"
 
-    def __init__(self):
-        self.x = None
-        self.y = None
+    # Decoded tiles shared by all ElevationService instances, keyed by (source name, src, z, x, y)
+    tile_cache = LRUCache(TILE_CACHE_BYTES)
+
+    # Sources used when none are given to the constructor. See set_default_sources()
+    default_elevation_source = None
+    default_normals_source = None
+
+    def __init__(self, elevation_source=None, normals_source=None, fetcher=None, elevation_store=None,
+                 normals_store=None, local_normals=None):
+        """
+        Constructor
+        :param elevation_source: The TileSource for terrarium-encoded elevation tiles. Defaults to AWS.
+        :param normals_source: The TileSource for normal tiles. Defaults to AWS.
+        :param fetcher: The TileFetcher used to retrieve missing tiles.
+        :param elevation_store: The TileStore for elevation tiles. Defaults to the user's tile cache.
+        :param normals_store: The TileStore for normal tiles. Defaults to the user's tile cache.
+        :param local_normals: Compute normals from elevation data rather than fetching normal tiles. Defaults to the
+        'elevation_local_normals' preference.
+        """
+
         self.resolution = None
-        self._current_grid = None
         self._zoom = None
+        if elevation_source is None and normals_source is None:
+            elevation_source, normals_source = self.get_default_sources()
+        self.elevation_source = elevation_source or URLTileSource('AWS', self.AWS_ELEVATION)
+        self.normals_source = normals_source or URLTileSource('AWS', self.AWS_NORMALS)
+        self.fetcher = fetcher or TileFetcher()
+        self.elevation_store = elevation_store or self.default_store(self.elevation_source, 'Elevation')
+        self.normals_store = normals_store or self.default_store(self.normals_source, 'Normals')
+        self._local_normals = local_normals
+
+    @classmethod
+    def set_default_sources(cls, elevation_source=None, normals_source=None):
+        """ Set the elevation and normal sources used by all new ElevationServices, e.g. for offline use. """
+
+        cls.default_elevation_source = elevation_source
+        cls.default_normals_source = normals_source
+
+    @classmethod
+    def get_default_sources(cls):
+        """
+        Returns the default (elevation, normals) sources. If none have been set and the 'elevation_raster_path'
+        preference names a local DEM, tiles are served from that raster instead of AWS.
+        """
+
+        if cls.default_elevation_source is None and cls.default_normals_source is None:
+            raster_path = Preferences.app().get('elevation_raster_path')
+            if raster_path and os.path.exists(raster_path):
+                from vistas.core.gis.raster_source import RasterTileSource
+                cls.set_default_sources(RasterTileSource(raster_path), RasterTileSource(raster_path, normals=True))
+        return cls.default_elevation_source, cls.default_normals_source
+
+    @staticmethod
+    def default_store(source, datatype):
+        """
+        Returns the TileStore in the user's tile cache for a source and tile type. The 'elevation_tile_store'
+        preference selects between a directory of PNG and decoded grid files ('directory', the default) and a single
+        MBTiles database ('mbtiles'), which keeps decoded grids in memory only.
+        """
+
+        path = os.path.join(get_config_dir(), 'Tiles', source.name, datatype)
+        if Preferences.app().get('elevation_tile_store', 'directory') == 'mbtiles':
+            return MBTilesStore(path + '.mbtiles')
+        return DirectoryTileStore(path)
+
+    def get_source(self, src=AWS_ELEVATION):
+        """ Returns the TileSource serving the given tile type. """
+
+        return self.normals_source if src == self.AWS_NORMALS else self.elevation_source
+
+    def get_store(self, src=AWS_ELEVATION):
+        """ Returns the TileStore holding the given tile type. """
+
+        return self.normals_store if src == self.AWS_NORMALS else self.elevation_store
+
+    @property
+    def local_normals(self):
+        """ Whether normals are computed from elevation data rather than fetched as normal tiles. """
+
+        if self._local_normals is None:
+            self._local_normals = Preferences.app().get('elevation_local_normals', False)
+        return self._local_normals
+
+    @local_normals.setter
+    def local_normals(self, local_normals):
+        self._local_normals = local_normals
 
     @property
     def zoom(self):
@@ -67,102 +201,185 @@ class ElevationService:
         self._zoom = int(zoom)
 
     def get_grid(self, x, y, z=None, src=AWS_ELEVATION):
-        z = z if z else self.zoom
-        if x != self.x or y != self.y or src != self.AWS_ELEVATION:
-            self.x = x
-            self.y = y
-            img = Image.open(self._get_tile_path(z, x, y, src=src))
-            grid = numpy.array(img.getdata(), dtype=numpy.float32).reshape(256, 256, 3 if src == self.AWS_ELEVATION else 4)
-            img.close()
-
-            # decode AWS elevation to height grid
-            if src == self.AWS_ELEVATION:
-                self._current_grid = (grid[:, :, 0] * 256.0 + grid[:, :, 1] + grid[:, :, 2] / 256.0) - 32768.0
+        """
+        Returns the decoded grid for a tile: heights for AWS_ELEVATION, normals for AWS_NORMALS. Grids are shared
+        through the process-wide tile cache and are read-only.
+        """
+
+        grid = self._cached_grid(x, y, z if z is not None else self.zoom, src)
+        return grid if grid is not None else self._empty_grid(src)
+
+    def _cached_grid(self, x, y, z, src=AWS_ELEVATION):
+        """ Returns the decoded grid for a tile from the tile cache, decoding it if needed, or None if it's missing. """
+
+        local = src == self.AWS_NORMALS and self.local_normals
+        key = (self.elevation_source.name, 'normals', z, x, y) if local else (self.get_source(src).name, src, z, x, y)
+        grid = self.tile_cache.get(key)
+        if grid is None:
+            if local:
+                grid = self.merge_grids(x, y, x, y, z, src)
             else:
-                self._current_grid = grid[:, :, 0:3] / 256.0
-        return self._current_grid
+                try:
+                    grid = self._decode_tile(z, x, y, src)
+                except FileNotFoundError:
+                    return None     # Tile could not be fetched, don't cache the hole
+            grid.setflags(write=False)
+            self.tile_cache.put(key, grid)
+        return grid
+
+    def _empty_grid(self, src=AWS_ELEVATION):
+        if src == self.AWS_ELEVATION:
+            return numpy.zeros((DEFAULT_TILE_SIZE, DEFAULT_TILE_SIZE), dtype=numpy.float32)
+        grid = numpy.empty((DEFAULT_TILE_SIZE, DEFAULT_TILE_SIZE, 3), dtype=numpy.float32)
+        grid[:] = (0.5, 0.5, 1.0)     # Encoded flat normal
+        return grid
+
+    def _decode_tile(self, z, x, y, src=AWS_ELEVATION):
+        """
+        Load a decoded tile grid. Decoded grids are persisted as .npy files next to the tile images and memory-mapped
+        on later reads, so PNG decoding only happens once per tile.
+        """
+
+        store = self.get_store(src)
+        tile = mercantile.Tile(x, y, z)
+        grid_path = store.grid_path(tile)
+        if grid_path is not None and os.path.exists(grid_path):
+            try:
+                return numpy.load(grid_path, mmap_mode='r')
+            except (OSError, ValueError):
+                pass    # Partial or corrupt file, decode it again
+
+        data = store.read(tile)
+        if data is None:
+            raise FileNotFoundError(tile)
+
+        with Image.open(BytesIO(data)) as img:
+            grid = numpy.asarray(img.convert('RGB'), dtype=numpy.float32)
+
+        # decode AWS elevation to height grid
+        if src == self.AWS_ELEVATION:
+            grid = (grid[:, :, 0] * 256.0 + grid[:, :, 1] + grid[:, :, 2] / 256.0) - 32768.0
+        else:
+            grid = grid / 256.0
+
+        if grid_path is not None:
+            self._save_grid(grid_path, grid)
+        return grid
 
     @staticmethod
-    def _get_tile_path(z, x, y, src=AWS_ELEVATION):
-        if src == ElevationService.AWS_ELEVATION:
-            datatype = 'Elevation'
+    def _save_grid(path, grid):
+        """ Atomically write a decoded grid, so concurrent readers never see a partial file. """
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        except OSError:
+            return  # The decoded grid cache is optional, e.g. on read-only storage
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, grid)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def merge_grids(self, min_x, min_y, max_x, max_y, z=None, src=AWS_ELEVATION):
+        """
+        Merge the grids of a contiguous range of tiles (inclusive) into a single mosaic. With local normals, the
+        normals mosaic is computed from the elevation mosaic in one pass instead.
+        """
+
+        if src == self.AWS_NORMALS and self.local_normals:
+            z = z if z is not None else self.zoom
+            heights = self._padded_heights(min_x, min_y, max_x, max_y, z)
+            return heights_to_normals(heights, meters_per_px(z))[1:-1, 1:-1]
+
+        shape = ((max_y - min_y + 1) * DEFAULT_TILE_SIZE, (max_x - min_x + 1) * DEFAULT_TILE_SIZE)
+        if src == self.AWS_ELEVATION:
+            data = numpy.zeros(shape, dtype=numpy.float32)
         else:
-            datatype = 'Normals'
-        return os.path.join(get_config_dir(), 'Tiles', 'AWS', datatype, str(z), str(x), "{}.png".format(y))
+            data = numpy.zeros((*shape, 3), dtype=numpy.float32)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                w = (x - min_x) * DEFAULT_TILE_SIZE
+                h = (y - min_y) * DEFAULT_TILE_SIZE
+                data[h: h + DEFAULT_TILE_SIZE, w: w + DEFAULT_TILE_SIZE] = self.get_grid(x, y, z, src=src)
+        return data
+
+    def _padded_heights(self, min_x, min_y, max_x, max_y, z):
+        """
+        Returns the elevation mosaic for a tile range with a 1 pixel border taken from neighboring tiles, so that
+        normals along the mosaic edges match those of adjacent mosaics. Where there is no neighboring tile, e.g. at the
+        edges of the world, the border repeats the edge of the mosaic.
+        """
+
+        last = 2 ** z - 1
+
+        def neighbor(x, y):
+            return self._cached_grid(x, y, z) if 0 <= x <= last and 0 <= y <= last else None
+
+        heights = numpy.pad(self.merge_grids(min_x, min_y, max_x, max_y, z), 1, mode='edge')
+
+        for x in range(min_x, max_x + 1):
+            w = (x - min_x) * DEFAULT_TILE_SIZE + 1
+            above, below = neighbor(x, min_y - 1), neighbor(x, max_y + 1)
+            if above is not None:
+                heights[0, w: w + DEFAULT_TILE_SIZE] = above[-1]
+            if below is not None:
+                heights[-1, w: w + DEFAULT_TILE_SIZE] = below[0]
+
+        for y in range(min_y, max_y + 1):
+            h = (y - min_y) * DEFAULT_TILE_SIZE + 1
+            left, right = neighbor(min_x - 1, y), neighbor(max_x + 1, y)
+            if left is not None:
+                heights[h: h + DEFAULT_TILE_SIZE, 0] = left[:, -1]
+            if right is not None:
+                heights[h: h + DEFAULT_TILE_SIZE, -1] = right[:, 0]
+
+        return heights
 
     def get_tiles(self, extent, task=None):
-        async def fetch_tile(client, url, tile_path):
-            async with client.get(url) as r:
-                tile_im = Image.open(BytesIO(await r.read()))
-
-                if not os.path.exists(tile_path):
-                    if not os.path.exists(os.path.dirname(tile_path)):
-                        os.makedirs(os.path.dirname(tile_path))
-                    tile_im.save(tile_path)
-                if task:
-                    task.inc_progress()
-
-        loop = asyncio.get_event_loop()
-
-        # Retrieve tiles that we don't currently have
-        with aiohttp.ClientSession(loop=loop) as client:
-            requests = []
-            min_x, min_y, max_x, max_y = [None] * 4
-            for t in mercantile.tiles(extent.xmin, extent.ymin, extent.xmax, extent.ymax, [self.zoom]):
-                z, x, y = t.z, t.x, t.y
-                if min_x is None:
-                    min_x = max_x = x
-                    min_y = max_y = y
-                else:
-                    min_x = x if x < min_x else min_x
-                    min_y = y if y < min_y else min_y
-                    max_x = x if x > max_x else max_x
-                    max_y = y if y > max_y else max_y
-
-                path = self._get_tile_path(z, x, y)
-                npath = self._get_tile_path(z, x, y, self.AWS_NORMALS)
-                if not os.path.exists(path):
-                    url = self.AWS_ELEVATION.format(z=z, x=x, y=y)
-                    nurl = self.AWS_NORMALS.format(z=z, x=x, y=y)
-                    requests.append(fetch_tile(client, url, path))
-                    requests.append(fetch_tile(client, nurl, npath))
-
-            # Get corner tiles for good measure
-            min_x -= 1
-            min_y -= 1
-            max_x += 1
-            max_y += 1
-
-            for i in range(min_x, max_x+1):
-
-                # Top tiles
-                if not os.path.exists(self._get_tile_path(self.zoom, i, min_y)):
-                    requests.append(
-                        fetch_tile(client, self.AWS_ELEVATION.format(
-                            z=self.zoom, x=i, y=min_y
-                        ), self._get_tile_path(self.zoom, i, min_y))
-                    )
-
-                # Bottom tiles
-                if not os.path.exists(self._get_tile_path(self.zoom, i, max_y)):
-                    requests.append(    # Bottom tiles
-                        fetch_tile(client, self.AWS_ELEVATION.format(
-                            z=self.zoom, x=i, y=max_y
-                        ), self._get_tile_path(self.zoom, i, max_y))
-                    )
-
-                if i == min_x or i == max_x:    # Side tiles
-                    for j in range(min_y+1, max_y):
-                        if not os.path.exists(self._get_tile_path(self.zoom, i, j)):
-                            requests.append(
-                                fetch_tile(client, self.AWS_ELEVATION.format(
-                                    z=self.zoom, x=i, y=j
-                                ), self._get_tile_path(self.zoom, i, j))
-                            )
-            if task:
-                task.target = len(requests)
-
-            loop.run_until_complete(asyncio.gather(*requests))
+        """
+        Ensure tiles covering the extent, plus a border of one tile for seams, are on disk. Normals are only retrieved
+        for tiles within the extent, and not at all when they are computed locally. Returns the list of
+        (source, tile, callback) jobs that could not be fetched.
+        """
+
+        z = self.zoom
+        tiles = list(mercantile.tiles(extent.xmin, extent.ymin, extent.xmax, extent.ymax, [z]))
+        if not tiles:
+            return []
+
+        min_x = min(t.x for t in tiles)
+        max_x = max(t.x for t in tiles)
+        min_y = min(t.y for t in tiles)
+        max_y = max(t.y for t in tiles)
+        last = 2 ** z - 1
+
+        # Retrieve tiles that we don't currently have, checking the whole range at once
+        x0, y0 = max(min_x - 1, 0), max(min_y - 1, 0)
+        x1, y1 = min(max_x + 1, last), min(max_y + 1, last)
+        elevation_tiles = self.elevation_store.existing(z, x0, y0, x1, y1)
+        normal_tiles = set() if self.local_normals else self.normals_store.existing(z, min_x, min_y, max_x, max_y)
+        save_elevation = self.elevation_store.writer()
+        save_normals = self.normals_store.writer()
+
+        jobs = []
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                tile = mercantile.Tile(x, y, z)
+                if (x, y) not in elevation_tiles:
+                    jobs.append((self.elevation_source, tile, save_elevation))
+                in_extent = min_x <= x <= max_x and min_y <= y <= max_y
+                if not self.local_normals and in_extent and (x, y) not in normal_tiles:
+                    jobs.append((self.normals_source, tile, save_normals))
+
+        try:
+            return self.fetcher.fetch(jobs, task)
+        finally:
+            save_elevation.flush()
+            save_normals.flush()
 
     def create_dem(self, native_extent, projected_extent, shape, resolution, save_path, task):
 
@@ -171,40 +388,37 @@ class ElevationService:
         # Ensure tiles for extent are on disk
         task.status = task.RUNNING
         task.description = 'Collecting elevation data...'
-        self.get_tiles(projected_extent, task)
+        failed = self.get_tiles(projected_extent, task)
+        if failed:
+            raise MissingTilesError(failed)     # Missing tiles would be written as flat, zero elevation patches
 
         task.description = 'Building DEM file...'
         height, width = shape
-        task.target = width * height
-        height_grid = numpy.zeros(shape, dtype=numpy.float32)
-        for j in range(height):
-            for i in range(width):
-                x = native_extent.xmin + i * resolution
-                y = native_extent.ymax - j * resolution
-
-                # convert x,y to wgs extent
-                lon, lat = transform(native_extent.projection, projected_extent.projection, x, y)
-
-                # determine tile and get the right grid
-                tile = mercantile.tile(lon, lat, self.zoom)
-                bounds = mercantile.bounds(tile)
-
-                # determine position within grid
-                p_x = (lon - bounds.west) / (bounds.east - bounds.west)
-                p_y = (1 - ((lat - bounds.south) / (bounds.north - bounds.south)))
+        task.target = height
+        task.progress = 0
+
+        # Project the whole output grid at once
+        xs = native_extent.xmin + numpy.arange(width) * resolution
+        ys = native_extent.ymax - numpy.arange(height) * resolution
+        xs, ys = numpy.meshgrid(xs, ys)
+        lons, lats = transform(native_extent.projection, projected_extent.projection, xs.ravel(), ys.ravel())
+
+        # Fractional tile coordinates, then tiles and in-tile pixels, for every output cell
+        tile_xs, tile_ys = tile_coords(numpy.asarray(lons), numpy.asarray(lats), self.zoom)
+        px = numpy.floor(tile_xs * DEFAULT_TILE_SIZE).astype(numpy.int64).reshape(shape)
+        py = numpy.floor(tile_ys * DEFAULT_TILE_SIZE).astype(numpy.int64).reshape(shape)
+
+        min_x, max_x = int(px.min()) // DEFAULT_TILE_SIZE, int(px.max()) // DEFAULT_TILE_SIZE
+        min_y, max_y = int(py.min()) // DEFAULT_TILE_SIZE, int(py.max()) // DEFAULT_TILE_SIZE
+        mosaic = self.merge_grids(min_x, min_y, max_x, max_y)
+        px -= min_x * DEFAULT_TILE_SIZE
+        py -= min_y * DEFAULT_TILE_SIZE
 
-                if p_y < 0.0:
-                    p_y += 1.0
-                    y -= 1
-                elif p_y >= 1.0:
-                    p_y -= 1.0
-                    y += 1
-
-                u = int(numpy.floor(p_x * DEFAULT_TILE_SIZE))
-                v = int(numpy.floor(p_y * DEFAULT_TILE_SIZE))
-
-                height_grid[j][i] = self.get_grid(tile.x, tile.y)[v, u]
-                task.inc_progress()
+        height_grid = numpy.zeros(shape, dtype=numpy.float32)
+        for row in range(0, height, self.DEM_BLOCK_ROWS):
+            block = slice(row, row + self.DEM_BLOCK_ROWS)
+            height_grid[block] = mosaic[py[block], px[block]]
+            task.inc_progress(height_grid[block].shape[0])
 
         RasterWriter.write_esri_grid_ascii_file(save_path, height_grid, native_extent, resolution)
 
@@ -247,32 +461,25 @@ class ElevationService:
         new_plugin.calculate_stats()
         return new_plugin
 
-    def create_data_dem(self, extent, zoom, merge=False, src=AWS_ELEVATION) -> Union[Dict[mercantile.Tile, numpy.ndarray], numpy.ndarray]:
+    def create_data_dem(self, extent, zoom, merge=False, src=AWS_ELEVATION) -> \
+            Tuple[Union[Dict[mercantile.Tile, numpy.ndarray], numpy.ndarray], List]:
         """
         Creates an elevation grid from elevation data in memory.
         :param extent Extent to build the DEM for.
         :param zoom The zoom level to render the DEM at.
         :param merge Indicate whether to return the DEM as a single numpy grid, or as a cache, using mercantile.Tile
         objects to index into the cache.
-        :return {mercantile.Tile: numpy.ndarray} if merge==False, numpy.ndarray if merge==True
+        :return ({mercantile.Tile: numpy.ndarray} if merge==False, numpy.ndarray if merge==True), and the list of tile
+        jobs that could not be fetched. Tiles that could not be fetched are flat in the DEM, so it shouldn't be cached.
         """
 
         self._zoom = zoom
         wgs84 = extent.project(Proj(init='EPSG:4326'))
-        self.get_tiles(wgs84)
+        failed = self.get_tiles(wgs84)
         tiles = extent.tiles(self.zoom)
         if merge:
             ul = tiles[0]
             br = tiles[-1]
-            shape = ((br.y - ul.y + 1) * DEFAULT_TILE_SIZE, (br.x - ul.x + 1) * DEFAULT_TILE_SIZE)
-            if src == self.AWS_ELEVATION:
-                data = numpy.zeros(shape, dtype=numpy.float32)
-            else:
-                data = numpy.zeros((*shape, 3), dtype=numpy.float32)
-            for tile in tiles:
-                w = (tile.x - ul.x) * DEFAULT_TILE_SIZE
-                h = (tile.y - ul.y) * DEFAULT_TILE_SIZE
-                data[h: h + DEFAULT_TILE_SIZE, w: w + DEFAULT_TILE_SIZE] = self.get_grid(tile.x, tile.y, src=src)
-            return data
+            return self.merge_grids(ul.x, ul.y, br.x, br.y, src=src), failed
         else:
-            return {t: self.get_grid(t.x, t.y) for t in tiles}
+            return {t: self.get_grid(t.x, t.y) for t in tiles}, failed
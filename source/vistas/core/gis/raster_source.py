@@ -0,0 +1,186 @@
+import asyncio
+import glob
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from threading import Lock
+
+import numpy
+import rasterio
+from PIL import Image
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from rasterio.warp import reproject, transform_bounds, Resampling
+
+from vistas.core.gis.elevation import DEFAULT_TILE_SIZE, meters_per_px, encode_terrarium, heights_to_normals
+from vistas.core.gis.tiles import TileSource
+from vistas.core.paths import get_config_dir
+
+MERCATOR_ORIGIN = 6378137.0 * numpy.pi     # Web Mercator x/y of the top-left corner of the world
+MAX_ZOOM = 15
+
+
+class RasterTileSource(TileSource):
+    """
+    A TileSource that serves terrarium-encoded elevation tiles (or normal tiles) from a local DEM raster, so that
+    elevation data is available without network access.
+
+    The raster is reprojected to Web Mercator once, at the zoom level closest to its native resolution, and each lower
+    zoom level is built by 2x2 downsampling of the level above. Levels are cached on disk as memory-mapped grids, so
+    changing zoom reads from the pyramid rather than the full-resolution raster.
+    """
+
+    def __init__(self, path, name=None, normals=False, band=1, cache_dir=None):
+        """
+        Constructor
+        :param path: Path to a single-band DEM raster with heights in meters, in any projection.
+        :param name: The name of the source. Defaults to a name derived from the raster path.
+        :param normals: Serve normal tiles instead of elevation tiles.
+        :param band: The raster band containing heights.
+        :param cache_dir: The directory in which to cache pyramid levels. Defaults to the user's tile cache.
+        """
+
+        self.path = os.path.abspath(path)
+        stat = os.stat(self.path)
+        fingerprint = hashlib.sha1('{}:{}:{}'.format(self.path, stat.st_size, stat.st_mtime).encode()).hexdigest()
+
+        super().__init__(name or 'Raster-{}'.format(fingerprint[:12]))
+        self.normals = normals
+        self.band = band
+        self.cache_dir = os.path.join(
+            cache_dir or os.path.join(get_config_dir(), 'Tiles', 'Pyramids'), fingerprint[:16]
+        )
+
+        with rasterio.open(self.path) as src:
+            self.bounds = transform_bounds(src.crs, CRS.from_epsg(3857), *src.bounds)
+            native_resolution = (self.bounds[2] - self.bounds[0]) / src.width
+
+        # The base level is the first zoom that is at least as detailed as the raster itself
+        self.max_zoom = MAX_ZOOM
+        for z in range(MAX_ZOOM + 1):
+            if meters_per_px(z) <= native_resolution * 1.001:     # Allow for rounding in the reprojected bounds
+                self.max_zoom = z
+                break
+
+        self._levels = {}
+        self._lock = Lock()
+
+    async def fetch(self, session, tile):
+        return await asyncio.get_event_loop().run_in_executor(None, self.render, tile)
+
+    def render(self, tile):
+        """ Returns the PNG-encoded elevation or normal tile. """
+
+        # Sample a 1 pixel border around the tile so normals at the tile edges are computed from real neighbors
+        border = 1 if self.normals else 0
+        heights = self.sample(tile, border)
+        if self.normals:
+            rgb = numpy.clip(
+                numpy.round(heights_to_normals(heights, meters_per_px(tile.z)) * 256), 0, 255
+            ).astype(numpy.uint8)[border:-border, border:-border]
+        else:
+            rgb = encode_terrarium(heights)
+
+        f = BytesIO()
+        Image.fromarray(rgb, 'RGB').save(f, format='png')
+        return f.getvalue()
+
+    def sample(self, tile, border=0):
+        """ Returns the heights for a tile, plus `border` pixels on every side. Areas outside the raster are 0. """
+
+        z = min(tile.z, self.max_zoom)
+        grid, x0, y0 = self.level(z)
+        scale = 2 ** (tile.z - z)
+
+        # Global pixel coordinates at the tile zoom, mapped to the level with nearest-neighbor upsampling if needed
+        pixels = numpy.arange(-border, DEFAULT_TILE_SIZE + border)
+        rows = (tile.y * DEFAULT_TILE_SIZE + pixels) // scale - y0
+        cols = (tile.x * DEFAULT_TILE_SIZE + pixels) // scale - x0
+        valid_rows = (rows >= 0) & (rows < grid.shape[0])
+        valid_cols = (cols >= 0) & (cols < grid.shape[1])
+
+        heights = numpy.zeros((pixels.size, pixels.size), dtype=numpy.float32)
+        if valid_rows.any() and valid_cols.any():
+            heights[numpy.ix_(valid_rows, valid_cols)] = grid[numpy.ix_(rows[valid_rows], cols[valid_cols])]
+        heights[numpy.isnan(heights)] = 0.0
+        return heights
+
+    def level(self, z):
+        """ Returns (grid, x0, y0) for a pyramid level, where (x0, y0) is the global pixel offset of the grid. """
+
+        with self._lock:
+            if z not in self._levels:
+                self._levels[z] = self._load_level(z) or self._build_level(z)
+            return self._levels[z]
+
+    def _load_level(self, z):
+        paths = glob.glob(os.path.join(self.cache_dir, '{}_*_*.npy'.format(z)))
+        if not paths:
+            return None
+        _, x0, y0 = os.path.splitext(os.path.basename(paths[0]))[0].split('_')
+        try:
+            return numpy.load(paths[0], mmap_mode='r'), int(x0), int(y0)
+        except (OSError, ValueError):
+            return None
+
+    def _build_level(self, z):
+        if z == self.max_zoom:
+            grid, x0, y0 = self._reproject(z)
+        else:
+            grid, x0, y0 = self._levels.get(z + 1) or self._load_level(z + 1) or self._build_level(z + 1)
+            grid, x0, y0 = downsample(grid, x0, y0)
+        self._levels[z] = self._save_level(z, grid, x0, y0)
+        return self._levels[z]
+
+    def _reproject(self, z):
+        resolution = meters_per_px(z)
+        left, bottom, right, top = self.bounds
+        x0 = int(numpy.floor((left + MERCATOR_ORIGIN) / resolution))
+        y0 = int(numpy.floor((MERCATOR_ORIGIN - top) / resolution))
+        x1 = int(numpy.ceil((right + MERCATOR_ORIGIN) / resolution))
+        y1 = int(numpy.ceil((MERCATOR_ORIGIN - bottom) / resolution))
+
+        grid = numpy.full((y1 - y0, x1 - x0), numpy.nan, dtype=numpy.float32)
+        with rasterio.open(self.path) as src:
+            reproject(
+                source=rasterio.band(src, self.band), destination=grid,
+                dst_transform=Affine(resolution, 0, x0 * resolution - MERCATOR_ORIGIN,
+                                     0, -resolution, MERCATOR_ORIGIN - y0 * resolution),
+                dst_crs=CRS.from_epsg(3857), dst_nodata=numpy.nan, resampling=Resampling.bilinear
+            )
+        return grid, x0, y0
+
+    def _save_level(self, z, grid, x0, y0):
+        path = os.path.join(self.cache_dir, '{}_{}_{}.npy'.format(z, x0, y0))
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, grid)
+            os.replace(tmp_path, path)
+            return numpy.load(path, mmap_mode='r'), x0, y0
+        except OSError:
+            return grid, x0, y0     # Keep the level in memory only
+
+
+def downsample(grid, x0, y0):
+    """
+    Halve the resolution of a pyramid level by averaging 2x2 blocks, ignoring NaN (no data) cells. The grid is padded
+    as needed so that blocks stay aligned to the global pixel grid. Returns (grid, x0, y0) for the next level down.
+    """
+
+    pad_top, pad_left = y0 % 2, x0 % 2
+    height, width = grid.shape
+    pad_bottom, pad_right = (height + pad_top) % 2, (width + pad_left) % 2
+
+    padded = numpy.full((height + pad_top + pad_bottom, width + pad_left + pad_right), numpy.nan, dtype=numpy.float32)
+    padded[pad_top:pad_top + height, pad_left:pad_left + width] = grid
+
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = ~numpy.isnan(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = numpy.where(valid, blocks, 0).sum(axis=(1, 3))
+    result = numpy.full(counts.shape, numpy.nan, dtype=numpy.float32)
+    numpy.divide(sums, counts, out=result, where=counts > 0)
+    return result, (x0 - pad_left) // 2, (y0 - pad_top) // 2
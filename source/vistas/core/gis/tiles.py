@@ -0,0 +1,338 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+import aiohttp
+import mercantile
+
+
+class TileNotFoundError(Exception):
+    """ Raised by a TileSource when a tile does not exist. Missing tiles are not retried. """
+
+    pass
+
+
+class TileSource:
+    """ Interface for a source of XYZ tile images. """
+
+    def __init__(self, name):
+        """
+        Constructor
+        :param name: A unique, filesystem-safe name for the source. Used to separate tiles from different sources in
+        on-disk and in-memory caches.
+        """
+
+        self.name = name
+
+    async def fetch(self, session, tile):
+        """ Returns the encoded image data for a tile. `session` is a shared aiohttp.ClientSession. """
+
+        raise NotImplemented
+
+
+class URLTileSource(TileSource):
+    """ A TileSource backed by a tile server, e.g. 'https://example.com/{z}/{x}/{y}.png' """
+
+    def __init__(self, name, url_template):
+        super().__init__(name)
+        self.url_template = url_template
+
+    async def fetch(self, session, tile):
+        async with session.get(self.url_template.format(z=tile.z, x=tile.x, y=tile.y)) as r:
+            if r.status == 404:
+                raise TileNotFoundError(tile)
+            r.raise_for_status()
+            return await r.read()
+
+
+class DirectoryTileSource(TileSource):
+    """ A TileSource backed by a local directory of tiles, e.g. a mirrored tile set on a network share. """
+
+    def __init__(self, name, path, template=os.path.join('{z}', '{x}', '{y}.png')):
+        super().__init__(name)
+        self.path = path
+        self.template = template
+
+    async def fetch(self, session, tile):
+        path = os.path.join(self.path, self.template.format(z=tile.z, x=tile.x, y=tile.y))
+        if not os.path.exists(path):
+            raise TileNotFoundError(tile)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class TileFetcher:
+    """
+    Fetches tiles from TileSources with a bounded number of concurrent requests, retrying failed requests with
+    exponential backoff.
+    """
+
+    def __init__(self, max_connections=8, retries=3, backoff=0.5, timeout=30):
+        """
+        Constructor
+        :param max_connections: The maximum number of tiles requested at once.
+        :param retries: The number of times a failed request is retried before the tile is given up on.
+        :param backoff: Seconds to wait before the first retry. Doubles with every subsequent retry.
+        :param timeout: Seconds to wait for a single tile request.
+        """
+
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def fetch(self, jobs, task=None):
+        """
+        Fetch tiles and hand them to a callback as they arrive.
+        :param jobs: A list of (TileSource, mercantile.Tile, callback) tuples. `callback(tile, data)` is called with the
+        encoded image data of each tile that was fetched.
+        :param task: An optional Task that is advanced once per job. Remaining jobs are skipped if the task is stopped.
+        :return: A list of the jobs that failed.
+        """
+
+        jobs = list(jobs)
+        if task:
+            task.target = len(jobs)
+            task.progress = 0
+
+        if not jobs:
+            return []
+
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+
+        return loop.run_until_complete(self._fetch_all(jobs, task))
+
+    async def _fetch_all(self, jobs, task):
+        semaphore = asyncio.Semaphore(self.max_connections)
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            results = await asyncio.gather(*[self._fetch_one(session, semaphore, job, task) for job in jobs])
+        return [job for job, ok in zip(jobs, results) if not ok]
+
+    async def _fetch_one(self, session, semaphore, job, task):
+        source, tile, callback = job
+        try:
+            async with semaphore:
+                if task and task.should_stop:
+                    return False
+
+                for attempt in range(self.retries + 1):
+                    try:
+                        data = await asyncio.wait_for(source.fetch(session, tile), self.timeout)
+                        break
+                    except TileNotFoundError:
+                        return False
+                    except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                        if attempt == self.retries:
+                            return False
+                        await asyncio.sleep(self.backoff * 2 ** attempt)
+
+            callback(tile, data)
+            return True
+        finally:
+            if task:
+                task.inc_progress()
+
+
+class TileStore:
+    """ Interface for local storage of encoded tiles of a single type (e.g. elevation) from a single source. """
+
+    def existing(self, z, min_x, min_y, max_x, max_y):
+        """ Returns the set of (x, y) tile coordinates within an inclusive tile range that are already stored. """
+
+        raise NotImplemented
+
+    def read(self, tile):
+        """ Returns the encoded image data for a tile, or None if it isn't stored. """
+
+        raise NotImplemented
+
+    def write_many(self, items):
+        """ Store many tiles at once from an iterable of (mercantile.Tile, data) pairs. """
+
+        raise NotImplemented
+
+    def grid_path(self, tile):
+        """ Returns the path of the decoded grid file for a tile, or None if decoded grids shouldn't be persisted. """
+
+        return None
+
+    def writer(self, batch_size=256):
+        """ Returns a callback suitable for TileFetcher jobs that buffers tiles and stores them in batches. """
+
+        return BufferedTileWriter(self, batch_size)
+
+
+class BufferedTileWriter:
+    """ Buffers fetched tiles and writes them to a TileStore in batches. Call flush() once fetching is done. """
+
+    def __init__(self, store, batch_size=256):
+        self.store = store
+        self.batch_size = batch_size
+        self.items = []
+
+    def __call__(self, tile, data):
+        self.items.append((tile, data))
+        if len(self.items) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        items, self.items = self.items, []
+        if items:
+            self.store.write_many(items)
+
+
+class DirectoryTileStore(TileStore):
+    """ Stores tiles as individual files in a {z}/{x}/{y}.png directory tree, with decoded grids alongside. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def tile_path(self, tile):
+        return os.path.join(self.path, str(tile.z), str(tile.x), '{}.png'.format(tile.y))
+
+    def grid_path(self, tile):
+        return os.path.join(self.path, str(tile.z), str(tile.x), '{}.npy'.format(tile.y))
+
+    def existing(self, z, min_x, min_y, max_x, max_y):
+        # One directory listing per tile column
+        result = set()
+        for x in range(min_x, max_x + 1):
+            try:
+                names = os.listdir(os.path.join(self.path, str(z), str(x)))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                y = name[:-4]
+                if name.endswith('.png') and y.isdigit() and min_y <= int(y) <= max_y:
+                    result.add((x, int(y)))
+        return result
+
+    def read(self, tile):
+        try:
+            with open(self.tile_path(tile), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_many(self, items):
+        for tile, data in items:
+            path = self.tile_path(tile)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Write atomically so concurrent readers never see a partial tile
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+
+class MBTilesStore(TileStore):
+    """
+    Stores tiles in a single SQLite database following the MBTiles layout, so that a large tile cache is one file
+    rather than hundreds of thousands, and existence checks for a tile range are a single indexed query. Note that
+    MBTiles rows use the TMS scheme, i.e. row = 2^z - 1 - y.
+    """
+
+    def __init__(self, path, grid_dir=None):
+        """
+        Constructor
+        :param path: Path to the .mbtiles file. Created if it doesn't exist.
+        :param grid_dir: Optional directory in which to persist decoded grids. Decoded grids aren't persisted if None.
+        """
+
+        self.path = path
+        self.grid_dir = grid_dir
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, '
+                'tile_data BLOB, PRIMARY KEY (zoom_level, tile_column, tile_row))'
+            )
+            db.execute("INSERT OR IGNORE INTO metadata VALUES ('format', 'png')")
+
+    def _connect(self):
+        # One short-lived connection per operation keeps the store safe to use from any thread
+        return closing_connection(sqlite3.connect(self.path, timeout=30))
+
+    @staticmethod
+    def _row(z, y):
+        return 2 ** z - 1 - y
+
+    def grid_path(self, tile):
+        if self.grid_dir is None:
+            return None
+        return os.path.join(self.grid_dir, str(tile.z), str(tile.x), '{}.npy'.format(tile.y))
+
+    def existing(self, z, min_x, min_y, max_x, max_y):
+        with self._connect() as db:
+            rows = db.execute(
+                'SELECT tile_column, tile_row FROM tiles WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? '
+                'AND tile_row BETWEEN ? AND ?', (z, min_x, max_x, self._row(z, max_y), self._row(z, min_y))
+            ).fetchall()
+        return {(x, self._row(z, row)) for x, row in rows}
+
+    def read(self, tile):
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                (tile.z, tile.x, self._row(tile.z, tile.y))
+            ).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def write_many(self, items):
+        with self._connect() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                ((t.z, t.x, self._row(t.z, t.y), sqlite3.Binary(data)) for t, data in items)
+            )
+
+    def import_directory(self, path, batch_size=256):
+        """ Import tiles from a {z}/{x}/{y}.png directory tree, e.g. an existing tile cache. Returns the count. """
+
+        writer = self.writer(batch_size)
+        count = 0
+        for z in (d for d in os.listdir(path) if d.isdigit()):
+            for x in (d for d in os.listdir(os.path.join(path, z)) if d.isdigit()):
+                column = os.path.join(path, z, x)
+                for name in os.listdir(column):
+                    y = name[:-4]
+                    if not (name.endswith('.png') and y.isdigit()):
+                        continue
+                    with open(os.path.join(column, name), 'rb') as f:
+                        writer(mercantile.Tile(int(x), int(y), int(z)), f.read())
+                    count += 1
+        writer.flush()
+        return count
+
+    def export_directory(self, path):
+        """ Export all tiles to a {z}/{x}/{y}.png directory tree. Returns the count. """
+
+        target = DirectoryTileStore(path)
+        with self._connect() as db:
+            rows = db.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles')
+            count = 0
+            for z, x, row, data in rows:
+                target.write_many([(mercantile.Tile(x, self._row(z, row), z), bytes(data))])
+                count += 1
+        return count
+
+
+@contextmanager
+def closing_connection(db):
+    """ Commit (or roll back) and close an SQLite connection when the block exits. """
+
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
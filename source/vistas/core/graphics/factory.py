@@ -1,36 +1,129 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
 import mercantile
 
 from vistas.core.bounds import union_bboxs
+from vistas.core.cache import LRUCache
 from vistas.core.graphics.bounding_box import BoundingBoxHelper
 from vistas.core.graphics.object import Object3D
 from vistas.core.task import Task
-from vistas.core.threading import Thread
+from vistas.core.threading import ThreadSyncHandler
 from vistas.ui.utils import post_redisplay
 
+MAX_BUILD_WORKERS = 4
+MESH_CACHE_BYTES = 512 * 1024 ** 2
+
 
 def use_event_loop(func):
-    """ Wraps a Thread run function to ensure an event loop is started and refreshes the UI when compeleted. """
+    """
+    Wraps a worker run function to ensure an event loop is started and refreshes the UI when completed. Workers that
+    were superseded or cancelled before they started are skipped.
+    """
     def decorator(*args, **kwargs):
         self = args[0]
-        self.task.status = Task.RUNNING
-        self.init_event_loop()
-        func(*args, **kwargs)
-        self.sync_with_main(post_redisplay)
-        self.task.status = Task.COMPLETE
+        with self.task.lock:
+            if self.should_stop:
+                self.task.status = Task.COMPLETE
+                return
+            self.task.status = Task.RUNNING
+
+        try:
+            self.init_event_loop()
+            func(*args, **kwargs)
+            self.sync_with_main(post_redisplay if self.should_stop else self.factory.build_finished)
+        finally:
+            if self.loop is not None:
+                self.loop.close()
+            self.task.status = Task.COMPLETE
     return decorator
 
 
-class MeshFactoryWorker(Thread):
-    """ Interface for executing work from a MeshFactory in a separate thread. """
+class BuildScheduler:
+    """
+    Runs the builds of a MeshFactory on a worker pool shared by all factories. Every build is numbered with a
+    generation; starting a new build supersedes older ones, which are asked to stop through their Task and whose
+    remaining calls to the main thread are dropped.
+    """
+
+    pool = ThreadPoolExecutor(max_workers=MAX_BUILD_WORKERS)
+
+    def __init__(self):
+        self.generation = 0
+        self.current = None
+        self.lock = Lock()
+
+    def submit(self, worker):
+        """ Schedule a worker, superseding the build in progress, if any. """
+
+        with self.lock:
+            self.generation += 1
+            worker.generation = self.generation
+            if self.current is not None:
+                self.current.cancel()
+            self.current = worker
+        self.pool.submit(worker.run).add_done_callback(self._report_exception)
+
+    @staticmethod
+    def _report_exception(future):
+        # Pool threads swallow exceptions, so report them the same way as exceptions in any other thread
+        exception = future.exception()
+        if exception is not None:
+            sys.excepthook(type(exception), exception, exception.__traceback__)
+
+    def cancel(self):
+        """ Supersede the build in progress without starting a new one. """
+
+        with self.lock:
+            self.generation += 1
+            if self.current is not None:
+                self.current.cancel()
+                self.current = None
+
+
+class MeshFactoryWorker(ThreadSyncHandler):
+    """ Interface for executing work from a MeshFactory in the factory's BuildScheduler. """
 
     task_name = "Creating Meshes"
     task_description = task_name
 
-    def __init__(self, factory, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, factory):
+        super().__init__()
         self.factory = factory
+        self.generation = None
         self.task = Task(self.task_name, self.task_description)
 
+    def start(self):
+        self.factory.scheduler.submit(self)
+
+    def run(self):
+        raise NotImplemented
+
+    @property
+    def superseded(self):
+        return self.generation != self.factory.scheduler.generation
+
+    @property
+    def should_stop(self):
+        """ Whether this build was superseded or cancelled by the user. Checked periodically by long-running work. """
+
+        return self.superseded or self.task.should_stop
+
+    def cancel(self):
+        with self.task.lock:
+            if not self.task.complete:
+                self.task.status = Task.SHOULD_STOP
+
+    def sync_with_main(self, func, args=(), kwargs={}, block=False, delay=0):
+        """ Call `func` on the main thread, unless this build has been superseded by the time it gets there. """
+
+        def call_if_current(*args, **kwargs):
+            if not self.superseded:
+                func(*args, **kwargs)
+
+        super().sync_with_main(call_if_current, args, kwargs, block, delay)
+
 
 class MeshFactory(Object3D):
     """
@@ -43,15 +136,24 @@ class MeshFactory(Object3D):
         super().__init__()
         self.items = []     # List[Mesh]
         self.bbox_helper = BoundingBoxHelper(self)
+        self.scheduler = BuildScheduler()
+        self.built = False      # Whether the last build ran to completion
 
     def update(self):
         self.bbox_helper.update()
 
     def build(self):
-        """ Signal that work needs to be done. """
+        """ Signal that work needs to be done. Supersedes any build that is still in progress. """
 
+        self.built = False
         self.worker_class(self).start()
 
+    def build_finished(self):
+        """ Called on the main thread once a build has completed without being stopped. """
+
+        self.built = True
+        post_redisplay()
+
     def dispose(self):
         """ Dispose of all current meshes. """
 
@@ -79,7 +181,12 @@ class MeshFactory(Object3D):
 
 
 class MapMeshFactory(MeshFactory):
-    """ A MeshFactory that is geospatially referenced. """
+    """
+    A MeshFactory that is geospatially referenced. Meshes built for recently used zoom levels are retained in an LRU
+    cache bounded by `mesh_cache_bytes`, so that switching back to a zoom level doesn't require a rebuild.
+    """
+
+    mesh_cache_bytes = MESH_CACHE_BYTES
 
     def __init__(self, extent, shader, plugin=None, initial_zoom=10):
         super().__init__()
@@ -90,6 +197,7 @@ class MapMeshFactory(MeshFactory):
         self.tiles = []
         self._ul = None
         self._br = None
+        self.mesh_cache = LRUCache(self.mesh_cache_bytes, sizeof=self.retained_nbytes, on_evict=self._on_evict)
         self.zoom = initial_zoom
 
     @property
@@ -99,16 +207,66 @@ class MapMeshFactory(MeshFactory):
     @zoom.setter
     def zoom(self, zoom):
         if zoom != self._zoom:
+            if self._zoom is not None:
+                self.retain_meshes()
+
             self._zoom = zoom
             self.tiles = self.extent.tiles(self.zoom)
             self._ul = self.tiles[0]
             self._br = self.tiles[-1]
 
-            # Destroy these meshes
-            self.dispose()
+            # Reuse meshes for this zoom if we have them, otherwise build new meshes
+            if not self.restore_meshes():
+                self.build()
+
+    def retain_meshes(self):
+        """ Move the meshes for the current zoom level into the mesh cache, or dispose of them if they're incomplete. """
+
+        if self.built and self.items and self.retained_nbytes(self.items) <= self.mesh_cache.max_bytes:
+            self.mesh_cache.put(self._zoom, list(self.items))
+            del self.items[:]
+        else:
+            super().dispose()
+
+    def restore_meshes(self):
+        """ Restore the meshes for the current zoom level from the mesh cache. Returns False if they aren't cached. """
+
+        items = self.mesh_cache.remove(self._zoom)
+        if items is None:
+            return False
+
+        self.scheduler.cancel()     # Don't let a build for the previous zoom add to these meshes
+        self.items.extend(items)
+        self.built = True
+        self.update()
+        post_redisplay()
+        return True
+
+    def retained_nbytes(self, entry):
+        """ The size of a mesh cache entry, i.e. the GPU buffers of a list of meshes. """
+
+        return sum(mesh.geometry.nbytes for mesh in entry)
+
+    def release_retained(self, entry):
+        """ Release a mesh cache entry that is no longer needed. """
+
+        for mesh in entry:
+            mesh.geometry.dispose()
+
+    def _on_evict(self, zoom, entry):
+        self.release_retained(entry)
+
+        # Report the eviction through the build in progress, if any
+        worker = self.scheduler.current
+        if worker is not None and not worker.task.complete:
+            worker.task.description = 'Released cached meshes for zoom level {}'.format(zoom)
+
+    def dispose(self):
+        """ Dispose of all current and cached meshes. """
 
-            # Now build new meshes
-            self.build()
+        super().dispose()
+        for zoom in self.mesh_cache.keys():
+            self.release_retained(self.mesh_cache.remove(zoom))
 
     @property
     def mercator_bounds(self):
@@ -0,0 +1,111 @@
+import glob
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+from vistas.core.paths import get_config_dir
+from vistas.core.preferences import Preferences
+
+CACHE_VERSION = 2
+
+
+def default_cache_dir():
+    """ The directory for feature mesh caches, set by the 'feature_cache_dir' preference. """
+
+    return Preferences.app().get('feature_cache_dir') or os.path.join(get_config_dir(), 'Cache', 'Features')
+
+
+def source_fingerprint(path):
+    """
+    Fingerprint a data source by the path, size and modification time of every file that makes it up, e.g. the
+    .shp, .shx, .dbf and .prj files of a shapefile.
+    """
+
+    base = os.path.splitext(os.path.abspath(path))[0]
+    parts = []
+    for file_path in sorted(glob.glob(glob.escape(base) + '.*')):
+        stat = os.stat(file_path)
+        parts.append('{}:{}:{}'.format(file_path, stat.st_size, stat.st_mtime))
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+class FeatureMeshCache:
+    """
+    An on-disk cache of triangulated feature meshes, keyed by the content fingerprint of the data source, its
+    projection and the cache format version, so that it is invalidated whenever any of them change. Draped vertex
+    heights and normals are cached separately per zoom level and elevation source.
+    """
+
+    def __init__(self, data_path, projection, cache_dir=None):
+        """
+        Constructor
+        :param data_path: The path of the feature data source.
+        :param projection: The pyproj.Proj of the data source.
+        :param cache_dir: The directory to cache meshes in. Defaults to default_cache_dir().
+        """
+
+        self.data_path = data_path
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.fingerprint = source_fingerprint(data_path)
+        srs = projection.srs if projection is not None else ''
+        self.key = hashlib.sha1('{}:{}:{}'.format(CACHE_VERSION, self.fingerprint, srs).encode()).hexdigest()
+
+    @property
+    def mesh_path(self):
+        return os.path.join(self.cache_dir, '{}.npz'.format(self.key))
+
+    def drape_path(self, zoom, elevation_key):
+        elevation_hash = hashlib.sha1(elevation_key.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, '{}.{}.{}.npz'.format(self.key, zoom, elevation_hash))
+
+    def load_mesh(self):
+        """ Returns cached (vertices, offsets), or None. """
+
+        data = self._load(self.mesh_path)
+        if data is None:
+            return None
+        return data['verts'], data['offsets']
+
+    def save_mesh(self, verts, offsets):
+        self._save(self.mesh_path, verts=verts, offsets=offsets)
+
+    def load_drape(self, zoom, elevation_key):
+        """ Returns cached (heights, normals) for a zoom level and elevation source, or None. """
+
+        data = self._load(self.drape_path(zoom, elevation_key))
+        if data is None:
+            return None
+        return data['heights'], data['normals']
+
+    def save_drape(self, zoom, elevation_key, heights, normals):
+        self._save(self.drape_path(zoom, elevation_key), heights=heights, normals=normals)
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with numpy.load(path) as data:
+                if int(data['version']) != CACHE_VERSION or str(data['fingerprint']) != self.fingerprint:
+                    return None
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError, KeyError):
+            return None     # Partial or corrupt file, rebuild it
+
+    def _save(self, path, **arrays):
+        """ Atomically write a cache file. Failures are ignored, since the cache is optional. """
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez(f, version=CACHE_VERSION, fingerprint=self.fingerprint, **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
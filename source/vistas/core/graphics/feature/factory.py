@@ -1,19 +1,35 @@
-import os
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy
 import pyproj
 import shapely.geometry as shp
-from shapely.ops import transform
 from triangle import triangulate
 
+from vistas.core.cache import nbytes
 from vistas.core.color import RGBColor
 from vistas.core.gis.elevation import ElevationService, TILE_SIZE, meters_per_px
 from vistas.core.graphics.factory import MapMeshFactory, MeshFactoryWorker, use_event_loop
+from vistas.core.graphics.feature.cache import FeatureMeshCache
 from vistas.core.graphics.feature.geometry import FeatureGeometry
 from vistas.core.graphics.feature.shader import FeatureShaderProgram
 from vistas.core.graphics.mesh import Mesh
 from vistas.core.plugins.data import FeatureDataPlugin
+from vistas.ui.utils import post_message, post_redisplay
+
+TRIANGULATE_CHUNK_RINGS = 2000
+
+
+def triangulate_rings(coords, ring_offsets):
+    """
+    Triangulate polygon rings, where ring i is coords[ring_offsets[i]:ring_offsets[i + 1]]. Returns an (n, 2) array of
+    triangle vertices for all rings, and the number of coordinates (2 per vertex) produced for each ring.
+    """
+
+    triangles = []
+    for start, end in zip(ring_offsets[:-1], ring_offsets[1:]):
+        triangulation = triangulate(dict(vertices=coords[start:end]))
+        triangles.append(triangulation.get('vertices')[triangulation.get('triangles')].reshape(-1, 2))
+    return numpy.concatenate(triangles), numpy.array([t.size for t in triangles])
 
 
 class FeatureFactoryWorker(MeshFactoryWorker):
@@ -23,17 +39,21 @@ class FeatureFactoryWorker(MeshFactoryWorker):
     @use_event_loop
     def run(self):
         verts, indices, normals, colors = [None] * 4
-        if self.factory.needs_vertices and not self.task.should_stop:
+        if self.factory.needs_vertices and not self.should_stop:
             verts, indices, normals = self.factory.generate_meshes(self.task)
-            self.factory.needs_vertices = False
 
-        if self.factory.needs_color and not self.task.should_stop:
-            colors = self.factory.generate_colors(self.task)
-            self.factory.needs_color = False
+        color_features = self.factory.recolor_features
+        if self.factory.needs_color and not self.should_stop:
+            colors = self.factory.generate_colors(self.task, color_features)
+
+        # Results of a stopped build may be incomplete
+        if self.should_stop:
+            return
 
         self.sync_with_main(
-            self.factory.update_features, kwargs=dict(vertices=verts, indices=indices, normals=normals, colors=colors),
-            block=True
+            self.factory.update_features, kwargs=dict(
+                vertices=verts, indices=indices, normals=normals, colors=colors, color_features=color_features
+            ), block=True
         )
 
 
@@ -45,6 +65,8 @@ class FeatureFactory(MapMeshFactory):
     def __init__(self, extent, data_src: FeatureDataPlugin, shader=None, plugin=None, initial_zoom=10):
         super().__init__(extent, shader or FeatureShaderProgram(), plugin, initial_zoom)
         self._color_func = None
+        self._column_color_func = None
+        self._color_variables = None
         self._render_thread = None
 
         if not isinstance(data_src, FeatureDataPlugin):
@@ -52,14 +74,44 @@ class FeatureFactory(MapMeshFactory):
         self.data_src = data_src
 
         self.use_cache = self.data_src is not None
+        self.feature_cache = None
         if self.use_cache:
-            ext = '.{}'.format(self.data_src.path.split('.')[-1])
-            self._cache = self.data_src.path.replace(ext, '.ttt')
-            self._npz_path = self._cache + '.npz'
+            self.feature_cache = FeatureMeshCache(self.data_src.path, self.extent.projection)
 
         self.offsets = None
         self.needs_vertices = True
-        self.needs_color = False
+        self._needs_color = False
+        self.recolor_features = None    # The features to recolor if only some need it, or None for all features
+
+    @property
+    def needs_color(self):
+        return self._needs_color
+
+    @needs_color.setter
+    def needs_color(self, needs_color):
+        self._needs_color = needs_color
+        self.recolor_features = None
+
+    def recolor(self, features):
+        """
+        Rebuild the colors of only some features, e.g. those whose attributes changed. Only the vertex ranges of these
+        features are recomputed and uploaded, unless all features already need new colors.
+        :param features: An array of feature indices.
+        """
+
+        if self.needs_vertices or not self.items or self.offsets is None:
+            self.needs_color = True
+        elif not self.needs_color or self.recolor_features is not None:
+            features = numpy.asarray(features, dtype=int)
+            features = features[(features >= 0) & (features < len(self.offsets))]
+            if not self.needs_color:
+                if not features.size:
+                    return
+                self.needs_color = True
+                self.recolor_features = numpy.unique(features)
+            else:
+                self.recolor_features = numpy.union1d(self.recolor_features, features)
+        self.build()
 
     @property
     def zoom(self):
@@ -68,16 +120,55 @@ class FeatureFactory(MapMeshFactory):
     @zoom.setter
     def zoom(self, zoom):
         if zoom != self._zoom:
+            if self._zoom is not None:
+                self.retain_meshes()
+
             self._zoom = zoom
-            self.needs_vertices = True
             tiles = self.extent.tiles(self.zoom)
             self._ul = tiles[0]
             self._br = tiles[-1]
-            self.build()
 
-    def update_features(self, vertices=None, indices=None, normals=None, colors=None):
+            if not self.restore_meshes():
+                self.needs_vertices = True
+                self.build()
+
+    def retain_meshes(self):
+        """
+        All zoom levels share a single mesh whose vertices are replaced on zoom changes, so only the vertex data for
+        the current zoom level is retained.
+        """
+
+        if self.items and not self.needs_vertices:
+            geometry = self.items[0].geometry
+            self.mesh_cache.put(self._zoom, (geometry.vertices, geometry.indices, geometry.normals))
+
+    def restore_meshes(self):
+        # Retained vertex data replaces the vertices of the existing mesh, so leave it cached until there is one
+        if not self.items:
+            return False
+
+        entry = self.mesh_cache.remove(self._zoom)
+        if entry is None:
+            return False
+
+        self.scheduler.cancel()
+        self.update_features(*entry)
+        if self.needs_color:
+            self.build()    # Only colors remain to be built
+        else:
+            post_redisplay()
+        return True
+
+    def retained_nbytes(self, entry):
+        return nbytes(entry)
+
+    def release_retained(self, entry):
+        pass    # Vertex data only, nothing to release
+
+    def update_features(self, vertices=None, indices=None, normals=None, colors=None, color_features=None):
         # Update geometry information
         if all(x is not None for x in (vertices, indices, normals)):
+            self.needs_vertices = False
             if not self.items:
                 num_indices = num_vertices = len(indices)
                 geometry = FeatureGeometry(num_indices, num_vertices, indices=indices, vertices=vertices)
@@ -89,96 +180,197 @@ class FeatureFactory(MapMeshFactory):
                 geometry = mesh.geometry
                 geometry.vertices = vertices
                 geometry.indices = indices
+                geometry.normals = normals
                 geometry.compute_bounding_box()
                 mesh.update()
         # Update color buffer
-        if self.items and colors is not None:
-            self.items[0].geometry.colors = colors
+        if colors is not None:
+            self.needs_color = False
+            if self.items:
+                if color_features is None:
+                    self.items[0].geometry.colors = colors
+                else:
+                    self.items[0].geometry.update_colors(colors, *self.vertex_ranges(color_features))
         self.update()
 
     def generate_meshes(self, task=None):
-        """ Generates polygon mesh vertices for a feature collection """
+        """ Generates polygon mesh vertices for a feature collection, reusing cached meshes and heights if possible """
 
-        mercator = pyproj.Proj(init='EPSG:3857')
         mbounds = self.mercator_bounds
 
         # Check if a cache for this feature exists
-        if self.use_cache and os.path.exists(self._npz_path):
+        cached = self.feature_cache.load_mesh() if self.use_cache else None
+        if cached is not None:
             if task:
                 task.status = task.INDETERMINATE
 
-            nfile = numpy.load(self._npz_path)
-            verts = nfile['verts']
+            verts, offsets = cached
 
         # Build it out
         else:
-            task.progress = 0
-            task.target = self.data_src.get_num_features()
+            built = self._build_mesh(task)
+            if built is None:
+                return None, None, None
+            verts, offsets = built
 
-            project = partial(pyproj.transform, self.extent.projection, mercator)   # Our projection method
+        self.offsets = offsets
 
-            tris = []
-            offsets = []
-            offset = 0
-            for feature in self.data_src.get_features():
-                shape = transform(project, shp.shape(feature['geometry']))
-                if task:
-                    task.inc_progress()
+        # Translate vertices to scene coordinates
+        # Scale vertices according to current mercator_bounds
+        verts[:, 1] = (verts[:, 1] - mbounds.left) / (mbounds.right - mbounds.left)
+        verts[:, 0] = (1 - (verts[:, 0] - mbounds.bottom) / (mbounds.top - mbounds.bottom))
 
-                if isinstance(shape, shp.Polygon):
-                    polys = [list(shape.exterior.coords)[:-1]]
-                elif isinstance(shape, shp.MultiPolygon):
-                    polys = [list(p.exterior.coords)[:-1] for p in shape]
-                else:
-                    raise ValueError("Can't render non polygons!")
+        # Drape vertices over elevation data, reusing heights and normals sampled at this zoom before
+        e = ElevationService()
+        elevation_key = '{}:{}'.format(e.elevation_source.name, 'local' if e.local_normals else e.normals_source.name)
+        drape = self.feature_cache.load_drape(self.zoom, elevation_key) if self.use_cache else None
+        if drape is not None:
+            heights, normals = drape
+        else:
+            heights, normals, complete = self._sample_elevation(e, verts)
 
-                for p in polys:
-                    triangulation = triangulate(dict(vertices=numpy.array(p)))
-                    t = triangulation.get('vertices')[triangulation.get('triangles')].reshape(-1, 2)
-                    offset += t.size
-                    tris.append(t)
+            # Don't persist placeholder heights, so that missing tiles are fetched again next time
+            if self.use_cache and complete:
+                self.feature_cache.save_drape(self.zoom, elevation_key, heights, normals)
+        verts[:, 2] = heights
 
-                offsets.append(offset)
+        # Scale vertices based on tile size
+        verts[:, 0] *= (self._br.y - self._ul.y + 1) * TILE_SIZE
+        verts[:, 1] *= (self._br.x - self._ul.x + 1) * TILE_SIZE
 
-            triangles = numpy.concatenate(tris)
-            offsets = numpy.array(offsets)
+        # Vertex indices are assumed to be unique
+        indices = numpy.arange(verts.shape[0])
+        return verts, indices, normals
 
-            # Make room for elevation info
-            xs = triangles[:, 0]
-            ys = triangles[:, 1]
-            verts = numpy.dstack((ys, xs, numpy.zeros_like(xs)))[0]
-            verts = verts.astype(numpy.float32)
+    def _build_mesh(self, task=None):
+        """ Triangulate the feature collection. Returns (vertices, offsets), or None if the task was stopped. """
 
-            # cache the vertices
-            if self.use_cache:
-                numpy.savez(self._cache, verts=verts, offsets=offsets)
+        mercator = pyproj.Proj(init='EPSG:3857')
+        rings = self._extract_rings(task)
+        if rings is None:
+            return None
+        coords, ring_offsets, feature_rings = rings
+
+        # Project all coordinates at once
+        xs, ys = pyproj.transform(self.extent.projection, mercator, coords[:, 0], coords[:, 1])
+        coords = numpy.column_stack((xs, ys))
+
+        triangulated = self._triangulate(coords, ring_offsets, task)
+        if triangulated is None:
+            return None
+        triangles, ring_sizes = triangulated
+
+        # Offsets are cumulative coordinate (not vertex) counts at the end of each feature
+        offsets = numpy.concatenate(([0], numpy.cumsum(ring_sizes)))[feature_rings]
+
+        # Make room for elevation info
+        xs = triangles[:, 0]
+        ys = triangles[:, 1]
+        verts = numpy.dstack((ys, xs, numpy.zeros_like(xs)))[0]
+        verts = verts.astype(numpy.float32)
+
+        # cache the vertices
+        if self.use_cache:
+            self.feature_cache.save_mesh(verts, offsets)
+        return verts, offsets
 
-        # Translate vertices to scene coordinates
-        # Scale vertices according to current mercator_bounds
-        verts[:, 1] = (verts[:, 1] - mbounds.left) / (mbounds.right - mbounds.left)
-        verts[:, 0] = (1 - (verts[:, 0] - mbounds.bottom) / (mbounds.top - mbounds.bottom))
+    def _sample_elevation(self, elevation_service, verts):
+        """
+        Sample heights (in pixels) and normals at vertices in scene coordinates from data DEMs. Returns (heights,
+        normals, complete), where `complete` is False if any elevation tiles could not be retrieved.
+        """
 
-        # Get data DEM to sample elevation from.
-        e = ElevationService()
-        dem = e.create_data_dem(self.extent, self.zoom, merge=True)
+        dem, failed = elevation_service.create_data_dem(self.extent, self.zoom, merge=True)
         dheight, dwidth = dem.shape
 
         # Index into current DEM and assign heights
         us = numpy.floor(verts[:, 1] * dwidth).astype(int)
         vs = numpy.floor(verts[:, 0] * dheight).astype(int)
-        verts[:, 2] = dem[vs, us].ravel() / meters_per_px(self.zoom)
+        heights = dem[vs, us].ravel() / meters_per_px(self.zoom)
 
-        # Scale vertices based on tile size
-        verts[:, 0] *= (self._br.y - self._ul.y + 1) * TILE_SIZE
-        verts[:, 1] *= (self._br.x - self._ul.x + 1) * TILE_SIZE
-
-        normals = e.create_data_dem(
+        normals, normals_failed = elevation_service.create_data_dem(
             self.extent, self.zoom, merge=True, src=ElevationService.AWS_NORMALS
-        )[vs, us].ravel()
+        )
+        normals = normals[vs, us].ravel()
 
-        # Vertex indices are assumed to be unique
-        indices = numpy.arange(verts.shape[0])
-        return verts, indices, normals
+        # Both requests retry the same missing tiles, so count each tile once
+        missing = {tile for _, tile, _ in failed} | {tile for _, tile, _ in normals_failed}
+        if missing:
+            post_message('{} elevation tiles could not be retrieved. Features may not follow terrain.'.format(
+                len(missing)
+            ), 1)
+        return heights, normals, not missing
+
+    def _extract_rings(self, task=None):
+        """
+        Collect the exterior ring of every polygon, without the closing coordinate, into a single (n, 2) array.
+        Returns (coords, ring_offsets, feature_rings), where ring i is coords[ring_offsets[i]:ring_offsets[i + 1]] and
+        feature_rings[j] is the number of rings in features 0..j, or None if the task was stopped.
+        """
+
+        if task:
+            task.progress = 0
+            task.target = self.data_src.get_num_features()
+
+        coords = []
+        ring_offsets = [0]
+        feature_rings = []
+        for feature in self.data_src.get_features():
+            shape = shp.shape(feature['geometry'])
+            if task:
+                if task.should_stop:
+                    return None
+                task.inc_progress()
+
+            if isinstance(shape, shp.Polygon):
+                polys = [shape]
+            elif isinstance(shape, shp.MultiPolygon):
+                polys = list(shape.geoms)
+            else:
+                raise ValueError("Can't render non polygons!")
+
+            for p in polys:
+                ring = numpy.asarray(p.exterior.coords)[:-1, :2]
+                coords.append(ring)
+                ring_offsets.append(ring_offsets[-1] + len(ring))
+            feature_rings.append(len(ring_offsets) - 1)
+
+        return numpy.concatenate(coords), numpy.array(ring_offsets), numpy.array(feature_rings)
+
+    @staticmethod
+    def _triangulate(coords, ring_offsets, task=None):
+        """
+        Triangulate rings in chunks across a process pool. Returns (triangles, ring_sizes) as from triangulate_rings(),
+        or None if the task was stopped.
+        """
+
+        num_rings = len(ring_offsets) - 1
+        if task:
+            task.progress = 0
+            task.target = num_rings
+
+        chunks = []
+        for start in range(0, num_rings, TRIANGULATE_CHUNK_RINGS):
+            end = min(start + TRIANGULATE_CHUNK_RINGS, num_rings)
+            first, last = ring_offsets[start], ring_offsets[end]
+            chunks.append((coords[first:last], ring_offsets[start:end + 1] - first))
+
+        if len(chunks) == 1:
+            results = [triangulate_rings(*chunks[0])]
+        else:
+            with ProcessPoolExecutor() as pool:
+                futures = [pool.submit(triangulate_rings, *chunk) for chunk in chunks]
+                results = []
+                for future, (_, chunk_offsets) in zip(futures, chunks):
+                    if task and task.should_stop:
+                        for f in futures:
+                            f.cancel()
+                        return None
+                    results.append(future.result())
+                    if task:
+                        task.inc_progress(len(chunk_offsets) - 1)
+
+        return numpy.concatenate([r[0] for r in results]), numpy.concatenate([r[1] for r in results])
 
     @staticmethod
     def _default_color_function(feature, data):
@@ -191,43 +383,86 @@ class FeatureFactory(MapMeshFactory):
         return RGBColor(0.5, 0.5, 0.5)
 
     def set_color_function(self, func):
+        """ Color features with `func(feature, data)`, which returns an RGBColor for a single feature. """
+
         self._color_func = func
+        self._column_color_func = None
+        self._color_variables = None
+
+    def set_column_color_function(self, func, variables):
+        """
+        Color all features at once with `func(columns)`, which is passed a dict of variable -> attribute column (see
+        FeatureDataPlugin.get_columns) and returns an (n_features, 3) array of RGB colors.
+        """
+
+        self._color_func = None
+        self._column_color_func = func
+        self._color_variables = list(variables)
 
-    def generate_colors(self, task=None):
-        """ Generates a color buffer for the feature collection """
+    def vertex_ranges(self, features=None):
+        """ Returns arrays of the first and (exclusive) last vertex of each feature, or only of `features` if given. """
+
+        # Offsets are cumulative coordinate counts, with two coordinates per vertex
+        stops = self.offsets // 2
+        starts = numpy.concatenate(([0], stops[:-1]))
+        if features is not None:
+            return starts[features], stops[features]
+        return starts, stops
+
+    def generate_colors(self, task=None, features=None):
+        """
+        Generates a color buffer for the feature collection, or only the colors of the vertices of `features` (an array
+        of feature indices) if given.
+        """
 
         # Color indices are stored in the cache
         if self.offsets is None:
-            self.offsets = numpy.load(self._npz_path)['offsets']
-        color_func = self._color_func
-        if not color_func:
-            color_func = self._default_color_function
-        colors = []
+            mesh = self.feature_cache.load_mesh() if self.use_cache else None
+            if mesh is None:
+                mesh = self._build_mesh(task)     # Cache is disabled or was removed since the mesh was built
+                if mesh is None:
+                    return None
+            self.offsets = mesh[1]
+
+        if self._column_color_func is not None:
+            if task:
+                task.status = task.INDETERMINATE
+            columns = self.data_src.get_columns(self._color_variables)
+            colors = self._column_color_func(columns)
+        elif self._color_func is not None:
+            colors = self._generate_feature_colors(self._color_func, task)
+        else:
+            colors = numpy.array([self._default_color_function(None, None).rgb.rgb_list])
+            colors = numpy.repeat(colors, len(self.offsets), axis=0)
+
+        if colors is None:
+            return None
+
+        colors = numpy.asarray(colors, dtype=numpy.float32)
+        if features is not None:
+            colors = colors[features]
+        starts, stops = self.vertex_ranges(features)
+        return numpy.repeat(colors, stops - starts, axis=0)
+
+    def _generate_feature_colors(self, color_func, task=None):
+        """ Returns an (n_features, 3) array of colors from a per-feature color function, or None if stopped. """
 
         if task:
             task.progress = 0
             task.target = self.data_src.get_num_features()
 
+        colors = numpy.empty((len(self.offsets), 3), dtype=numpy.float32)
+
         # We use a mutable data structure that is limited to this thread's scope and can be mutated
         # based on color_func's scope. This allows multiple color threads to occur without locking.
         mutable_color_data = {}
         for i, feature in enumerate(self.data_src.get_features()):
-            if i == 0:
-                left = 0
-            else:
-                left = self.offsets[i - 1]
-            right = self.offsets[i]
-
             if task:
                 if task.should_stop:
-                    break
+                    return None
                 task.inc_progress()
 
-            num_vertices = (right - left) // 2
-            color = numpy.array(color_func(feature, mutable_color_data).rgb.rgb_list, dtype=numpy.float32)
-            for v in range(num_vertices):
-                colors.append(color)
-        colors = numpy.stack(colors)
+            colors[i] = color_func(feature, mutable_color_data).rgb.rgb_list
 
         return colors
 
@@ -9,6 +9,32 @@ from vistas.core.bounds import BoundingBox
 from vistas.core.graphics.utils import map_buffer
 
 
+def vertex_bounding_box(vertices):
+    """ Compute the BoundingBox of an array of vertices. """
+
+    vertices = vertices.reshape(-1, 3)
+    mins = vertices.min(axis=0)
+    maxs = vertices.max(axis=0)
+    return BoundingBox(*(float(x) for x in mins), *(float(x) for x in maxs))
+
+
+class PreparedGeometry:
+    """
+    Vertex data for a Geometry, computed without OpenGL so that it can be built outside of the main thread. Pass it to
+    Geometry.load() on the main thread to copy it into the geometry's buffers.
+    """
+
+    def __init__(self, vertices=None, indices=None, normals=None, texcoords=None, colors=None, bounding_box=None):
+        self.vertices = vertices
+        self.indices = indices
+        self.normals = normals
+        self.texcoords = texcoords
+        self.colors = colors
+        self.bounding_box = bounding_box
+        if bounding_box is None and vertices is not None:
+            self.bounding_box = vertex_bounding_box(vertices)
+
+
 class Geometry:
     """ Base geometry class for 3D objects. Provides ability to specify vertex, normal, and color array buffers. """
 
@@ -103,6 +129,22 @@ class Geometry:
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
         glBindVertexArray(0)
 
+    @property
+    def nbytes(self):
+        """ The total size of this geometry's GPU buffers. """
+
+        size = self.num_indices * sizeof(c_uint) if self.has_index_array else 0
+        per_vertex = 0
+        if self.has_vertex_array:
+            per_vertex += 3
+        if self.has_normal_array:
+            per_vertex += 3
+        if self.has_color_array:
+            per_vertex += 4 if self.use_rgba else 3
+        if self.has_texture_coords:
+            per_vertex += 2
+        return size + self.num_vertices * per_vertex * sizeof(GLfloat)
+
     @property
     def indices(self):
         if self._indices is None and self.has_index_array:
@@ -178,22 +220,55 @@ class Geometry:
         color_buf[:] = self._colors
         self.release_color_array()
 
-    def compute_bounding_box(self):
-        """ Compute the BoundingBox for this geometry directly from the vertex data. """
+    def update_colors(self, colors, starts, stops, max_gap=256):
+        """
+        Replace the colors of some vertex ranges, uploading only those ranges rather than the whole color buffer.
+        :param colors: The new colors of the vertices of every range, in order.
+        :param starts: The first vertex of each range. Ranges must be sorted and must not overlap.
+        :param stops: The (exclusive) last vertex of each range.
+        :param max_gap: Ranges separated by at most this many vertices are uploaded together, to limit GL calls.
+        """
+
+        size = 4 if self.use_rgba else 3
+        if self._colors is None or self._colors.dtype != numpy.float32:
+            self._colors = numpy.array(self.colors, dtype=numpy.float32).ravel()
+        current = self._colors.reshape(-1, size)
 
-        vertices = self.vertices.reshape(-1, 3)
-        xs = vertices[:, 0]
-        ys = vertices[:, 1]
-        zs = vertices[:, 2]
+        counts = stops - starts
+        if not counts.sum():
+            return
+        vertices = numpy.arange(counts.sum()) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+        current[vertices] = numpy.asarray(colors, dtype=numpy.float32).reshape(-1, size)
 
-        x_min = float(xs.min())
-        x_max = float(xs.max())
-        y_min = float(ys.min())
-        y_max = float(ys.max())
-        z_min = float(zs.min())
-        z_max = float(zs.max())
+        breaks = numpy.flatnonzero(starts[1:] - stops[:-1] > max_gap) + 1
+        glBindBuffer(GL_ARRAY_BUFFER, self.color_buffer)
+        for start, stop in zip(starts[numpy.concatenate(([0], breaks))], stops[numpy.append(breaks - 1, -1)]):
+            glBufferSubData(
+                GL_ARRAY_BUFFER, int(start) * size * sizeof(GLfloat), int(stop - start) * size * sizeof(GLfloat),
+                current[start:stop]
+            )
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def load(self, prepared: PreparedGeometry):
+        """ Copy prepared vertex data into this geometry's buffers. Only the arrays that were prepared are copied. """
+
+        if prepared.indices is not None:
+            self.indices = prepared.indices
+        if prepared.vertices is not None:
+            self.vertices = prepared.vertices
+        if prepared.normals is not None:
+            self.normals = prepared.normals
+        if prepared.texcoords is not None:
+            self.texcoords = prepared.texcoords
+        if prepared.colors is not None:
+            self.colors = prepared.colors
+        if prepared.bounding_box is not None:
+            self.bounding_box = prepared.bounding_box
+
+    def compute_bounding_box(self):
+        """ Compute the BoundingBox for this geometry directly from the vertex data. """
 
-        self.bounding_box = BoundingBox(x_min, y_min, z_min, x_max, y_max, z_max)
+        self.bounding_box = vertex_bounding_box(self.vertices)
 
     def compute_normals(self):
         """ Compute vertex normals for a geometry. """
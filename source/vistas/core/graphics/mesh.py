@@ -7,6 +7,7 @@ from vistas.core.color import RGBColor
 from vistas.core.graphics.bounding_box import BoundingBoxHelper
 from vistas.core.graphics.geometry import Geometry, InstancedGeometry
 from vistas.core.graphics.object import Object3D, Face, Intersection
+from vistas.core.graphics.plane import make_grid_indices
 from vistas.core.math import Triangle, distance_from
 from vistas.core.plugins.visualization import VisualizationPlugin3D
 
@@ -113,20 +114,10 @@ class Mesh(Object3D):
             height, width, _ = grid.shape
             grid = grid.reshape(-1, 3)
 
-            index_array = []
-            for j in range(height - 1):
-                for i in range(width - 1):
-                    a = i + width * j
-                    b = i + width * (j + 1)
-                    c = (i + 1) + width * (j + 1)
-                    d = (i + 1) + width * j
-                    index_array += [a, b, d]
-                    index_array += [b, c, d]
-
-            if not index_array:
+            if height < 2 or width < 2:
                 return intersects
 
-            index_array = numpy.array(index_array).reshape(-1, 3)
+            index_array = make_grid_indices(width, height).reshape(-1, 3)
             v1, v2, v3 = numpy.rollaxis(grid[index_array], axis=-2)
 
         # Otherwise, use all triangles
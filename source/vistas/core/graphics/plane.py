@@ -1,12 +1,80 @@
-from numpy import indices, flipud, zeros, float32, array
+from threading import Lock
 
-from vistas.core.graphics.geometry import Geometry
+from numpy import indices, flipud, zeros, empty, float32, uint32, mgrid, stack, gradient, sqrt
+
+from vistas.core.graphics.geometry import Geometry, PreparedGeometry
+
+
+def make_grid_indices(width, height):
+    """ Build triangle indices for a regular (height, width) grid of vertices, two triangles per cell. """
+
+    j, i = mgrid[0:height - 1, 0:width - 1].astype(uint32)
+    a = i + width * j
+    b = a + width
+    c = b + 1
+    d = a + 1
+    return stack((a, b, d, b, c, d), axis=-1).ravel()
+
+
+_grid_index_cache = {}
+_grid_index_lock = Lock()
+
+
+def get_grid_indices(width, height):
+    """
+    Return triangle indices for a (height, width) grid from a process-wide cache. The returned array is shared between
+    geometries and is read-only.
+    """
+
+    key = (width, height)
+    with _grid_index_lock:
+        index_array = _grid_index_cache.get(key)
+        if index_array is None:
+            index_array = make_grid_indices(width, height)
+            index_array.setflags(write=False)
+            _grid_index_cache[key] = index_array
+    return index_array
+
+
+def clear_grid_index_cache():
+    """ Release all cached grid indices. """
+
+    with _grid_index_lock:
+        _grid_index_cache.clear()
+
+
+def compute_grid_normals(heights, cellsize):
+    """
+    Compute unit vertex normals for a regular heightfield directly from finite differences of the height grid. Rows
+    run along the x-axis and columns along the y-axis, matching the vertex layout of PlaneGeometry.
+    """
+
+    height, width = heights.shape
+    normals = empty((height, width, 3), dtype=float32)
+    normals[:, :, 2] = 1.0
+    if height < 2 or width < 2:
+        normals[:, :, 0:2] = 0.0
+        return normals
+
+    dx, dy = gradient(heights.astype(float32), cellsize)
+    normals[:, :, 0] = -dx
+    normals[:, :, 1] = -dy
+    normals /= sqrt((normals ** 2).sum(axis=2))[:, :, None]
+    return normals
 
 
 class PlaneGeometry(Geometry):
     """ A flat plane geometry with normals and texture coordinates for use with Textures. """
 
-    def __init__(self, width, height, cellsize):
+    def __init__(self, width, height, cellsize, prepared=None):
+        """
+        Constructor
+        :param width: The number of vertices along the y-axis.
+        :param height: The number of vertices along the x-axis.
+        :param cellsize: The distance between vertices.
+        :param prepared: Vertex data from PlaneGeometry.prepare(). Computed here if not given.
+        """
+
         num_vertices = width * height
         num_indices = 6 * (width - 1) * (height - 1)
         super().__init__(num_indices=num_indices, num_vertices=num_vertices, has_normal_array=True,
@@ -16,27 +84,48 @@ class PlaneGeometry(Geometry):
         self.width = width
         self.height = height
 
+        if prepared is None:
+            prepared = self.prepare(width, height, cellsize)
+        self.load(prepared)
+
+    @staticmethod
+    def prepare(width, height, cellsize, heights=None):
+        """
+        Compute the vertex data for a plane, optionally displaced by a (height, width) grid of heights. Doesn't use
+        OpenGL, so it can run in a worker thread.
+        """
+
         vertices = zeros((height, width, 3), dtype=float32)
         idx = indices((height, width))
         vertices[:, :, 0] = idx[0] * cellsize
         vertices[:, :, 1] = idx[1] * cellsize
-
-        index_array = []
-        for j in range(height - 1):
-            for i in range(width - 1):
-                a = i + width * j
-                b = i + width * (j + 1)
-                c = (i + 1) + width * (j + 1)
-                d = (i + 1) + width * j
-                index_array += [a, b, d]
-                index_array += [b, c, d]
-        index_array = array(index_array)
+        if heights is not None:
+            vertices[:, :, 2] = heights
 
         tex_coords = zeros((height, width, 2))
         tex_coords[:, :, 0] = idx[1] / width                # u   (0,1) --- (1,1)  UV coords origin is Cartesian
         tex_coords[:, :, 1] = flipud(idx[0] / height)       # v   (0,0) --- (1,0)
-        self.vertices = vertices
-        self.indices = index_array
-        self.texcoords = tex_coords
-        self.compute_normals()
-        self.compute_bounding_box()
+
+        return PreparedGeometry(
+            vertices=vertices, indices=get_grid_indices(width, height),
+            normals=compute_grid_normals(vertices[:, :, 2], cellsize), texcoords=tex_coords
+        )
+
+    def compute_normals(self, edges_only=False):
+        """
+        Compute vertex normals from the grid heights. If `edges_only` is set, only the normals influenced by the
+        outermost rows and columns are recomputed, e.g. after neighboring tiles have been stitched together.
+        """
+
+        heights = self.vertices.reshape((self.height, self.width, 3))[:, :, 2]
+        if not edges_only or self._normals is None or self.height < 3 or self.width < 3:
+            self.normals = compute_grid_normals(heights, self.cellsize)
+            return
+
+        # Normals of the two outermost rows/columns depend only on the three outermost rows/columns of heights
+        normals = self._normals.reshape((self.height, self.width, 3))
+        normals[:2] = compute_grid_normals(heights[:3], self.cellsize)[:2]
+        normals[-2:] = compute_grid_normals(heights[-3:], self.cellsize)[-2:]
+        normals[:, :2] = compute_grid_normals(heights[:, :3], self.cellsize)[:, :2]
+        normals[:, -2:] = compute_grid_normals(heights[:, -3:], self.cellsize)[:, -2:]
+        self.normals = normals
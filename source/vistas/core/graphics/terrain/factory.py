@@ -1,5 +1,4 @@
-from mercantile import Tile
-from numpy import arange
+import numpy
 from pyrr import Vector3
 
 from vistas.core.gis.elevation import ElevationService, TILE_SIZE, meters_per_px
@@ -7,23 +6,43 @@ from vistas.core.graphics.factory import MapMeshFactory, MeshFactoryWorker, use_
 from vistas.core.graphics.mesh import Mesh
 from vistas.core.graphics.terrain.geometry import TerrainTileGeometry
 from vistas.core.graphics.terrain.shader import TerrainTileShaderProgram
+from vistas.ui.utils import post_message
 
 
 class TerrainTileWorker(MeshFactoryWorker):
+    """
+    Builds terrain tiles. Seams are stitched and vertex data is prepared in this thread; the main thread only copies
+    the prepared data into new meshes, a batch of tiles at a time.
+    """
 
     task_name = "Building Terrain"
+    upload_batch_size = 16
 
     @use_event_loop
     def run(self):
-        grids = ElevationService().create_data_dem(self.factory.extent, self.factory.zoom)
-        for tile in self.factory.tiles:
-            if tile not in grids:       # Race condition
+        tiles = list(self.factory.tiles)
+        grids, failed = ElevationService().create_data_dem(self.factory.extent, tiles[0].z)
+        if self.should_stop:
+            return
+        if failed:
+            post_message('{} elevation tiles could not be retrieved. Terrain may have flat areas.'.format(
+                len(failed)
+            ), 1)
+
+        heights = {(t.x, t.y): grids[t] / meters_per_px(t.z) for t in tiles}
+        heights.update(stitch_seams(heights))
+
+        batch = []
+        for tile in tiles:
+            if self.should_stop:
                 return
-            data = grids[tile]
-            data /= meters_per_px(tile.z)
-            self.sync_with_main(self.factory.add_tile, (tile, data), block=True)
+            batch.append((tile, TerrainTileGeometry.prepare_tile(heights[(tile.x, tile.y)])))
             self.task.inc_progress()
-        self.sync_with_main(self.factory.resolve_seams, block=True)
+            if len(batch) == self.upload_batch_size:
+                self.sync_with_main(self.factory.add_tiles, (batch,), block=True)
+                batch = []
+        if batch:
+            self.sync_with_main(self.factory.add_tiles, (batch,), block=True)
 
 
 class TerrainTileFactory(MapMeshFactory):
@@ -37,50 +56,65 @@ class TerrainTileFactory(MapMeshFactory):
         super().__init__(extent, shader, plugin, initial_zoom)
 
     def add_tile(self, tile, heights):
-        tile_mesh = Mesh(TerrainTileGeometry(tile, heights), self.shader, plugin=self.plugin)
+        self.items.append(self._make_tile_mesh(TerrainTileGeometry(tile, heights)))
+        self.update()
+
+    def add_tiles(self, tiles):
+        """ Add meshes for a batch of (tile, PreparedGeometry) pairs from TerrainTileGeometry.prepare_tile(). """
+
+        for tile, prepared in tiles:
+            self.items.append(self._make_tile_mesh(TerrainTileGeometry(tile, prepared=prepared)))
+        self.update()
+
+    def _make_tile_mesh(self, geometry):
+        tile = geometry.tile
+        tile_mesh = Mesh(geometry, self.shader, plugin=self.plugin)
         right = (tile.y - self._ul.y) * (TILE_SIZE - 1)
         down = (tile.x - self._ul.x) * (TILE_SIZE - 1)
         tile_mesh.position = Vector3([right, down, 0.0])
         tile_mesh.update()
-        self.items.append(tile_mesh)
-        self.update()
+        return tile_mesh
 
     def resolve_seams(self):
-        tile_indices = arange(TILE_SIZE ** 2)
-        left_indices = tile_indices[::TILE_SIZE]
-        bottom_indices = tile_indices[TILE_SIZE**2 - TILE_SIZE:]
-        right_indices = tile_indices[TILE_SIZE - 1::TILE_SIZE]
-        top_indices = tile_indices[:TILE_SIZE]
-
-        for mesh in self.items:
-            geometry = mesh.geometry
-            t = geometry.tile
-
-            left = Tile(t.x - 1, t.y, t.z)
-            bottom = Tile(t.x, t.y + 1, t.x)
-            right = Tile(t.x + 1, t.y, t.z)
-            top = Tile(t.x, t.y - 1, t.z)
-
-            neighborhood = [x.geometry for x in self.items if x.geometry.tile in (left, bottom, right, top)]
-            if neighborhood:
-                heights = geometry.heights.ravel()
-                for neighbor in neighborhood:
-                    ntile = neighbor.tile
-                    if ntile == left:
-                        indices = left_indices
-                        neighbor_indices = right_indices
-                    elif ntile == bottom:
-                        indices = bottom_indices
-                        neighbor_indices = top_indices
-                    elif ntile == right:
-                        indices = right_indices
-                        neighbor_indices = left_indices
-                    elif ntile == top:
-                        indices = top_indices
-                        neighbor_indices = bottom_indices
-                    else:
-                        raise ValueError("Neighbor is not a neighbor!")
-                    neighbor_heights = neighbor.heights.ravel()
-                    heights[indices] = neighbor_heights[neighbor_indices]
-
-                geometry.heights = heights.reshape((TILE_SIZE, TILE_SIZE))
+        """ Match the edges of neighboring tiles so there are no gaps between them. """
+
+        meshes = {(mesh.geometry.tile.x, mesh.geometry.tile.y): mesh for mesh in self.items}
+        stitched = stitch_seams({key: mesh.geometry.heights for key, mesh in meshes.items()})
+        for key, heights in stitched.items():
+            meshes[key].geometry.update_heights(heights, edges_only=True)
+
+
+def stitch_seams(grids):
+    """
+    Copy the shared edges of neighboring tiles so that adjacent tiles agree along their seams: the last column of a
+    tile takes the first column of its eastern neighbor, and the last row takes the first row of its southern neighbor.
+    :param grids: A dict of {(x, y): 2D heights} for tiles at a single zoom level.
+    :return: A dict of {(x, y): stitched heights} for the tiles whose edges changed.
+    """
+
+    if not grids:
+        return {}
+
+    min_x = min(x for x, _ in grids)
+    min_y = min(y for _, y in grids)
+    width = max(x for x, _ in grids) - min_x + 1
+    height = max(y for _, y in grids) - min_y + 1
+    rows, cols = next(iter(grids.values())).shape
+
+    # Lay all tiles out in a single (tile row, tile column, row, column) array, so seams can be copied as slices
+    mosaic = numpy.zeros((height, width, rows, cols), dtype=numpy.float32)
+    present = numpy.zeros((height, width), dtype=bool)
+    for (x, y), grid in grids.items():
+        mosaic[y - min_y, x - min_x] = grid
+        present[y - min_y, x - min_x] = True
+
+    east = present[:, :-1] & present[:, 1:]
+    numpy.copyto(mosaic[:, :-1, :, -1], mosaic[:, 1:, :, 0], where=east[:, :, numpy.newaxis])
+    south = present[:-1] & present[1:]
+    numpy.copyto(mosaic[:-1, :, -1, :], mosaic[1:, :, 0, :], where=south[:, :, numpy.newaxis])
+
+    # Only tiles with an eastern or southern neighbor have changed
+    stitched = numpy.zeros_like(present)
+    stitched[:, :-1] |= east
+    stitched[:-1] |= south
+    return {(x, y): mosaic[y - min_y, x - min_x] for x, y in grids if stitched[y - min_y, x - min_x]}
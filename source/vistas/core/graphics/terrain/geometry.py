@@ -1,4 +1,5 @@
 import mercantile
+import numpy
 from vistas.core.gis.elevation import meters_per_px, TILE_SIZE
 from OpenGL.GL import *
 from vistas.core.graphics.plane import PlaneGeometry
@@ -8,11 +9,13 @@ from vistas.core.graphics.utils import map_buffer
 class TerrainGeometry(PlaneGeometry):
     """ Basic terrain-like geometry with height represented in the z-dimension. """
 
-    def __init__(self, width, height, cellsize, heights=None):
-        super().__init__(width, height, cellsize)
+    def __init__(self, width, height, cellsize, heights=None, prepared=None):
+        if prepared is None and heights is not None:
+            prepared = self.prepare(width, height, cellsize, heights)
+        super().__init__(width, height, cellsize, prepared)
         self._heights = None
-        if heights is not None:
-            self.heights = heights
+        if prepared is not None:
+            self._heights = self.vertices.reshape((height, width, 3))[:, :, 2]
 
     @property
     def heights(self):
@@ -22,13 +25,28 @@ class TerrainGeometry(PlaneGeometry):
     def heights(self, heights):
         """ A 2D array of terrain heights, usually created from source data. """
 
+        self.update_heights(heights)
+
+    def update_heights(self, heights, edges_only=False):
+        """
+        Set the terrain heights. If only the outermost rows and columns have changed (e.g. when resolving seams
+        between tiles), `edges_only` limits normal and bounding box computation to the affected border.
+        """
+
         assert heights.shape == (self.height, self.width)
         self._heights = heights
         verts = self.vertices.reshape((self.height, self.width, 3))
         verts[:, :, 2] = heights
         self.vertices = verts
-        self.compute_bounding_box()
-        self.compute_normals()
+
+        if edges_only and self.bounding_box is not None:
+            # Grow the bounding box to include the new edges. It may end up slightly loose, but always contains the grid
+            edges = numpy.concatenate((heights[0], heights[-1], heights[:, 0], heights[:, -1]))
+            self.bounding_box.min_z = min(self.bounding_box.min_z, float(edges.min()))
+            self.bounding_box.max_z = max(self.bounding_box.max_z, float(edges.max()))
+        else:
+            self.compute_bounding_box()
+        self.compute_normals(edges_only)
 
 
 class TerrainColorGeometry(TerrainGeometry):
@@ -56,6 +74,10 @@ class TerrainColorGeometry(TerrainGeometry):
         if values is not None:
             self.values = values
 
+    @property
+    def nbytes(self):
+        return super().nbytes + self.num_vertices * self.value_size * sizeof(GLfloat)
+
     def dispose(self):
         super().dispose()
         glDeleteBuffers(1, [self.value_buffer])
@@ -88,26 +110,16 @@ class TerrainColorGeometry(TerrainGeometry):
 class TerrainTileGeometry(TerrainGeometry):
     """ TerrainGeometry that is derived from XYZ tiles. """
 
-    def __init__(self, tile: mercantile.Tile, heights=None):
+    def __init__(self, tile: mercantile.Tile, heights=None, prepared=None):
         self.tile = tile
-        super().__init__(TILE_SIZE, TILE_SIZE, 1)
-        if heights is not None:
-            self.heights = heights
+        super().__init__(TILE_SIZE, TILE_SIZE, 1, heights, prepared)
+
+    @classmethod
+    def prepare_tile(cls, heights):
+        """ Compute the vertex data for a tile from its heights, e.g. in a worker thread. """
+
+        return cls.prepare(TILE_SIZE, TILE_SIZE, 1, heights)
 
     @property
     def zoom(self):
         return self.tile.z
-
-    @property
-    def heights(self):
-        return self._heights
-
-    @heights.setter
-    def heights(self, heights):
-        assert heights.shape == (TILE_SIZE, TILE_SIZE)
-        self._heights = heights
-        verts = self.vertices.reshape((self.height, self.width, 3))
-        verts[:, :, 2] = self._heights
-        self.vertices = verts
-        self.compute_bounding_box()
-        self.compute_normals()
@@ -1,9 +1,31 @@
 import os
+import time
+import weakref
+from bisect import bisect_left
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, RLock
 from typing import Optional
 
+import numpy
+
+from vistas.core.cache import LRUCache
 from vistas.core.stats import PluginStats, VariableStats
 from vistas.core.gis.extent import Extent
 from vistas.core.plugins.interface import Plugin
+from vistas.core.preferences import Preferences
+
+GRID_CACHE_BYTES = 512 * 1024 ** 2
+BACKGROUND_READ_WORKERS = 2
+
+# Guards RasterDataPlugin._accessed, which is written by get_data() on any thread, including the background pool
+_accessed_lock = Lock()
+
+
+def grid_nbytes(grid):
+    """ Size function for cached grids, including the mask of masked arrays. """
+
+    mask = numpy.ma.getmask(grid)
+    return grid.nbytes + (mask.nbytes if mask is not numpy.ma.nomask else 0)
 
 
 class TemporalInfo:
@@ -25,10 +47,22 @@ class DataPlugin(Plugin):
     extensions = []  # A list of extensions this plugin can load
     data_type = None
 
+    _background_pool = None
+    _background_pool_lock = Lock()
+
     def __init__(self):
         self.path = None
         self.stats = None
 
+    @classmethod
+    def background_pool(cls):
+        """ The thread pool shared by all data plugins for background reads """
+
+        with cls._background_pool_lock:
+            if DataPlugin._background_pool is None:
+                DataPlugin._background_pool = ThreadPoolExecutor(BACKGROUND_READ_WORKERS)
+            return DataPlugin._background_pool
+
     def set_path(self, path):
         """ Set the path to the data """
 
@@ -41,6 +75,14 @@ class DataPlugin(Plugin):
 
         pass
 
+    def close(self):
+        """
+        Hook implemented by subclasses to release resources held open for reading, such as file handles. Called by the
+        project when the data is removed from it.
+        """
+
+        pass
+
     @property
     def data_name(self):
         raise NotImplemented
@@ -110,6 +152,11 @@ class DataPlugin(Plugin):
 
         pass
 
+    def get_data_async(self, variable, date=None):
+        """ Returns a concurrent.futures.Future for the result of get_data(), which is run on a background thread. """
+
+        return self.background_pool().submit(self.get_data, variable, date)
+
 
 class ArrayDataPlugin(DataPlugin):
     """ Base class for 1-dimensional array data """
@@ -121,10 +168,35 @@ class ArrayDataPlugin(DataPlugin):
 
 
 class RasterDataPlugin(DataPlugin):
-    """ Base class for n-dimensional raster data """
+    """
+    Base class for n-dimensional raster data. Subclasses implement read_data(), and grids are served by get_data()
+    from an LRU cache shared by all raster plugins, so that revisiting a timestep doesn't read it from disk again.
+    """
 
     data_type = DataPlugin.RASTER
 
+    _grid_cache = None
+    _grid_cache_lock = Lock()
+
+    _pending = {}   # Cache key -> Future of a grid being read
+    _pending_lock = Lock()
+
+    _accessed = weakref.WeakKeyDictionary()     # Plugin -> {variable: time of last get_data()}
+
+    def __init__(self):
+        super().__init__()
+        self._read_lock = RLock()
+
+    @classmethod
+    def grid_cache(cls):
+        """ The shared grid cache, bounded by the 'grid_cache_bytes' preference. Its stats count hits and misses. """
+
+        with cls._grid_cache_lock:
+            if RasterDataPlugin._grid_cache is None:
+                max_bytes = Preferences.app().get('grid_cache_bytes', GRID_CACHE_BYTES)
+                RasterDataPlugin._grid_cache = LRUCache(max_bytes, sizeof=grid_nbytes)
+            return RasterDataPlugin._grid_cache
+
     @property
     def shape(self):
         """ Returns the grid shape """
@@ -143,11 +215,184 @@ class RasterDataPlugin(DataPlugin):
 
         raise NotImplemented
 
+    def timestep(self, date=None):
+        """
+        Returns the timestamp of the timestep nearest to `date`, or to the current time if `date` is None. Returns None
+        if the data isn't temporal.
+        """
+
+        time_info = self.time_info
+        if time_info is None or not time_info.is_temporal:
+            return None
+
+        if date is None:
+            from vistas.core.timeline import Timeline
+            date = Timeline.app().current
+
+        timestamps = time_info.timestamps
+        i = bisect_left(timestamps, date)
+        if i == 0:
+            return timestamps[0]
+        if i == len(timestamps):
+            return timestamps[-1]
+        before, after = timestamps[i - 1], timestamps[i]
+        return before if date - before <= after - date else after
+
     def get_data(self, variable, date=None):
-        """ Returns a numpy array for the data at the given time """
+        """ Returns a numpy array for the data at the given time. The array is a copy, which callers may modify. """
+
+        date = self.timestep(date)
+        with _accessed_lock:
+            RasterDataPlugin._accessed.setdefault(self, {})[variable] = time.monotonic()
+
+        grid = self._cached_grid(variable, date)
+        return None if grid is None else grid.copy()
+
+    def get_data_async(self, variable, date=None):
+        return super().get_data_async(variable, self.timestep(date))
+
+    def sample(self, variable, date, rows, cols):
+        """
+        Returns the values of a variable at grid cells at the given time. Values come from the cached grid if there is
+        one, otherwise only the window around the cells is read from disk. Cells must lie within the grid.
+        :param variable: The variable to sample.
+        :param date: The time to sample at, or None for the current time.
+        :param rows: A row index, or an array of row indices.
+        :param cols: A column index, or an array of column indices broadcastable with `rows`.
+        :return: A masked array shaped like the broadcast rows and columns, or a scalar for a single cell.
+        """
+
+        rows, cols = numpy.broadcast_arrays(numpy.asarray(rows, dtype=int), numpy.asarray(cols, dtype=int))
+        date = self.timestep(date)
+
+        grid = self.grid_cache().get((self.id, self.path, variable, date))
+        window = None
+        if grid is None:
+            window = self._cell_window(rows, cols)
+            with self._read_lock:
+                grid = self.read_window(variable, date, window)
+
+        # Plugins without windowed reads are sampled from the whole grid
+        if grid is None:
+            window = None
+            grid = self._cached_grid(variable, date)
+
+        return self._window_values(grid, window, rows, cols)[()]
+
+    def time_series(self, variable, rows, cols):
+        """
+        Returns the values of a variable at grid cells for every timestep. Plugins should override this if a cell's
+        history can be read more efficiently than one timestep at a time.
+        :return: A masked array shaped (timesteps,) + the broadcast shape of `rows` and `cols`.
+        """
+
+        rows, cols = numpy.broadcast_arrays(numpy.asarray(rows, dtype=int), numpy.asarray(cols, dtype=int))
+        time_info = self.time_info
+        dates = time_info.timestamps if time_info is not None and time_info.is_temporal else [None]
+
+        samples = [numpy.ma.asarray(self.sample(variable, date, rows, cols)) for date in dates]
+        return numpy.ma.array(
+            [numpy.ma.getdata(s) for s in samples], mask=[numpy.ma.getmaskarray(s) for s in samples]
+        )
+
+    @staticmethod
+    def _cell_window(rows, cols):
+        """ Returns the ((row_start, row_stop), (col_start, col_stop)) window containing a set of cells. """
+
+        if not rows.size:
+            return (0, 0), (0, 0)
+        return (int(rows.min()), int(rows.max()) + 1), (int(cols.min()), int(cols.max()) + 1)
+
+    @staticmethod
+    def _window_values(grid, window, rows, cols):
+        """ Returns the values of cells from a grid read over `window`, or over the whole grid if `window` is None. """
+
+        (row_start, _), (col_start, _) = window or ((0, None), (0, None))
+        values = numpy.ma.asarray(grid)[(rows - row_start).ravel(), (cols - col_start).ravel()]
+        return values.reshape(rows.shape)
+
+    def prefetch(self, variable, dates):
+        """
+        Read the grids of a variable at several dates into the grid cache on background threads. Timesteps that are
+        already cached or being read are skipped.
+        :return: A list of futures for the reads that were started.
+        """
+
+        cache = self.grid_cache()
+        futures = []
+        for date in dates:
+            date = self.timestep(date)
+            key = (self.id, self.path, variable, date)
+            with RasterDataPlugin._pending_lock:
+                if key in cache or key in RasterDataPlugin._pending:
+                    continue
+            futures.append(self.background_pool().submit(self._cached_grid, variable, date))
+        return futures
+
+    @classmethod
+    def active_variables(cls, since=None):
+        """ Returns (plugin, variable) pairs requested through get_data() since a time.monotonic() time. """
+
+        with _accessed_lock:
+            return [
+                (plugin, variable) for plugin, variables in RasterDataPlugin._accessed.items()
+                for variable, accessed in variables.items() if since is None or accessed >= since
+            ]
+
+    def _cached_grid(self, variable, date):
+        """ Returns the grid of a timestep from the cache, reading it or waiting for a pending read on a miss. """
+
+        key = (self.id, self.path, variable, date)
+        cache = self.grid_cache()
+        grid = cache.get(key)
+        if grid is not None:
+            return grid
+
+        with RasterDataPlugin._pending_lock:
+            future = RasterDataPlugin._pending.get(key)
+            if future is not None:
+                reading = False
+            else:
+                future = RasterDataPlugin._pending[key] = Future()
+                reading = True
+
+        if not reading:
+            return future.result()
+
+        try:
+            with self._read_lock:
+                grid = self.read_data(variable, date)
+            if grid is not None:
+                cache.put(key, grid)
+            future.set_result(grid)
+            return grid
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with RasterDataPlugin._pending_lock:
+                RasterDataPlugin._pending.pop(key, None)
+
+    def read_data(self, variable, date=None):
+        """
+        Read a grid from disk. Implemented by subclasses.
+        :param variable: The variable to read.
+        :param date: The timestamp of the timestep to read, as returned by timestep(), or None if not temporal.
+        """
 
         raise NotImplemented
 
+    def read_window(self, variable, date, window):
+        """
+        Read part of a grid from disk. Plugins that can read windows without reading the whole grid should override
+        this; by default it returns None, and the whole grid is read instead.
+        :param variable: The variable to read.
+        :param date: The timestamp of the timestep to read, as returned by timestep(), or None if not temporal.
+        :param window: The ((row_start, row_stop), (col_start, col_stop)) window to read.
+        """
+
+        return None
+
 
 class FeatureDataPlugin(DataPlugin):
     """ Base class for feature data (e.g., shapefile) """
@@ -163,3 +408,16 @@ class FeatureDataPlugin(DataPlugin):
         """ Returns an array of shapely features for the given time """
 
         raise NotImplemented
+
+    def get_columns(self, variables, date=None):
+        """
+        Returns a dict of variable -> numpy array holding the value of the variable for every feature, in feature order.
+        Plugins should override this if columns can be read more efficiently than by iterating over features.
+        """
+
+        values = {var: [] for var in variables}
+        for feature in self.get_features(date):
+            properties = feature.get('properties')
+            for var in variables:
+                values[var].append(properties.get(var))
+        return {var: numpy.array(column) for var, column in values.items()}
@@ -0,0 +1,80 @@
+import math
+import time
+
+from vistas.core.plugins.data import RasterDataPlugin
+from vistas.core.timeline import Timeline
+
+PREFETCH_SECONDS = 2.0
+MAX_PREFETCH_STEPS = 8
+
+
+class TimelinePrefetcher:
+    """
+    Follows the timeline and prefetches upcoming timesteps of the raster data that visualizations are reading, so that
+    get_data() hits memory during playback. Timesteps are prefetched in the direction the timeline is moving, far
+    enough ahead to cover a few seconds at the current playback speed.
+    """
+
+    _app_prefetcher = None
+
+    @classmethod
+    def app(cls):
+        """ Prefetcher for the global timeline """
+
+        if cls._app_prefetcher is None:
+            cls._app_prefetcher = TimelinePrefetcher(Timeline.app())
+
+        return cls._app_prefetcher
+
+    def __init__(self, timeline, seconds=PREFETCH_SECONDS, max_steps=MAX_PREFETCH_STEPS):
+        """
+        Constructor
+        :param timeline: The Timeline to follow.
+        :param seconds: How far ahead to prefetch, in seconds of playback at the current speed.
+        :param max_steps: The maximum number of timesteps to prefetch.
+        """
+
+        self.timeline = timeline
+        self.seconds = seconds
+        self.max_steps = max_steps
+
+        self.direction = 1
+        self.steps_per_second = 0.0
+        self.futures = []
+        self._last_index = None
+        self._last_time = None
+
+    @property
+    def num_steps(self):
+        return max(1, min(self.max_steps, math.ceil(self.steps_per_second * self.seconds)))
+
+    def timeline_changed(self):
+        """ Update direction and speed from the new timeline position, and prefetch the timesteps ahead of it. """
+
+        now = time.monotonic()
+        index = self.timeline.current_index
+        since = self._last_time
+
+        if self._last_index is not None and index != self._last_index:
+            steps = index - self._last_index
+            self.direction = 1 if steps > 0 else -1
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                rate = abs(steps) / elapsed
+                self.steps_per_second = rate if not self.steps_per_second else (self.steps_per_second + rate) / 2
+        self._last_index, self._last_time = index, now
+
+        # Reads that haven't started are no longer ahead of the timeline
+        for future in self.futures:
+            future.cancel()
+
+        timestamps = self.timeline.timestamps
+        indices = (index + self.direction * step for step in range(1, self.num_steps + 1))
+        dates = [timestamps[i] for i in indices if 0 <= i < len(timestamps)]
+
+        # Only data read since the previous timeline change is prefetched, i.e. what visualizations currently show
+        self.futures = []
+        if dates:
+            for plugin, variable in RasterDataPlugin.active_variables(since):
+                if plugin.time_info is not None and plugin.time_info.is_temporal:
+                    self.futures += plugin.prefetch(variable, dates)
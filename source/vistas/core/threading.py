@@ -8,11 +8,10 @@ import wx.lib.newevent
 ThreadSyncEvent, EVT_THREAD_SYNC = wx.lib.newevent.NewEvent()
 
 
-class Thread(threading.Thread, wx.EvtHandler):
-    """ Base threading class. Enables event-based synchronization of the worker thread with the main thread. """
+class ThreadSyncHandler(wx.EvtHandler):
+    """ Enables event-based synchronization of work running outside the main thread with the main thread. """
 
-    def __init__(self, *args, **kwargs):
-        threading.Thread.__init__(self, *args, **kwargs)
+    def __init__(self):
         wx.EvtHandler.__init__(self)
         self.loop = None
 
@@ -42,3 +41,11 @@ class Thread(threading.Thread, wx.EvtHandler):
             asyncio.set_event_loop(asyncio.SelectorEventLoop())
 
         self.loop = asyncio.get_event_loop()
+
+
+class Thread(threading.Thread, ThreadSyncHandler):
+    """ Base threading class. Enables event-based synchronization of the worker thread with the main thread. """
+
+    def __init__(self, *args, **kwargs):
+        threading.Thread.__init__(self, *args, **kwargs)
+        ThreadSyncHandler.__init__(self)
@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import tempfile
+import zlib
+
+import numpy
+
+from vistas.core.cache import LRUCache
+from vistas.core.utils import DatetimeEncoder, DatetimeDecoder
+
+CUBE_VERSION = 1
+TIME_CHUNK = 16
+SPACE_CHUNK = 256
+CHUNK_CACHE_BYTES = 64 * 1024 ** 2
+
+
+def chunk_dir(path):
+    """ The directory holding the chunks of the cube described by the metadata file at `path`. """
+
+    return '{}.chunks'.format(path)
+
+
+def ingest(plugin, path, time_chunk=TIME_CHUNK, space_chunk=SPACE_CHUNK, compression='zlib', task=None):
+    """
+    Convert every variable of a RasterDataPlugin into a time cube: a JSON metadata file at `path`, and a directory of
+    (time, row, column) chunks next to it. Grids are stored as floats, with NaN where they are masked.
+    :param plugin: The RasterDataPlugin to convert.
+    :param path: The path of the cube metadata file, usually with a .vcube extension.
+    :param time_chunk: The number of timesteps in each chunk.
+    :param space_chunk: The number of rows and columns in each chunk.
+    :param compression: 'zlib' to compress chunks, or None to store them as memory-mappable .npy files.
+    :param task: An optional Task that is advanced once per timestep. Ingestion is abandoned if the task is stopped.
+    :return: True if the cube was written, False if the task was stopped.
+    """
+
+    if compression not in ('zlib', None):
+        raise ValueError('Unsupported compression: {}'.format(compression))
+
+    time_info = plugin.time_info
+    timestamps = list(time_info.timestamps) if time_info is not None and time_info.is_temporal else []
+    dates = timestamps or [None]
+    variables = list(plugin.variables)
+    height, width = plugin.shape[-2:]
+
+    if task:
+        task.progress = 0
+        task.target = len(dates) * len(variables)
+
+    # The metadata file is written last, so that an incomplete cube is never opened
+    chunks_path = chunk_dir(path)
+    if os.path.exists(chunks_path):
+        shutil.rmtree(chunks_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+    dtypes = {}
+    for variable in variables:
+        os.makedirs(os.path.join(chunks_path, str(variables.index(variable))), exist_ok=True)
+        for t in range(0, len(dates), time_chunk):
+            grids = []
+            for date in dates[t:t + time_chunk]:
+                if task and task.should_stop:
+                    return False
+                grids.append(plugin.get_data(variable, date))
+                if task:
+                    task.inc_progress()
+
+            dtype = numpy.result_type(grids[0].dtype, numpy.float32)
+            dtypes[variable] = dtype.str
+            block = numpy.stack([numpy.ma.filled(numpy.ma.asarray(g).astype(dtype), numpy.nan) for g in grids])
+            for row in range(0, height, space_chunk):
+                for col in range(0, width, space_chunk):
+                    chunk = numpy.ascontiguousarray(block[:, row:row + space_chunk, col:col + space_chunk])
+                    _write_chunk(
+                        _chunk_path(chunks_path, variables.index(variable), t // time_chunk, row // space_chunk,
+                                    col // space_chunk, compression), chunk, compression
+                    )
+
+    extent = plugin.extent
+    projection = extent.projection if extent is not None else None
+    metadata = {
+        'version': CUBE_VERSION,
+        'data_name': plugin.data_name,
+        'variables': variables,
+        'dtypes': dtypes,
+        'shape': [len(dates), height, width],
+        'chunks': [time_chunk, space_chunk, space_chunk],
+        'compression': compression,
+        'timestamps': timestamps,
+        'affine': list(plugin.affine)[:6] if plugin.affine is not None else None,
+        'resolution': plugin.resolution,
+        'bounds': [extent.xmin, extent.ymin, extent.xmax, extent.ymax] if extent is not None else None,
+        'projection': projection.srs if projection is not None else None
+    }
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(metadata, f, cls=DatetimeEncoder)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _chunk_path(chunks_path, variable_index, t, row, col, compression):
+    extension = 'npy' if compression is None else 'z'
+    return os.path.join(chunks_path, str(variable_index), '{}_{}_{}.{}'.format(t, row, col, extension))
+
+
+def _write_chunk(path, chunk, compression):
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        if compression is None:
+            numpy.save(f, chunk)
+        else:
+            f.write(zlib.compress(chunk.tobytes()))
+    os.replace(tmp_path, path)
+
+
+class TimeCube:
+    """
+    Reads grids from a time cube written by ingest(). Uncompressed chunks are memory-mapped, and compressed chunks are
+    kept decompressed in a small LRU cache, so that stepping through consecutive timesteps decompresses each chunk once.
+    """
+
+    def __init__(self, path, chunk_cache_bytes=CHUNK_CACHE_BYTES):
+        self.path = path
+        self.chunks_path = chunk_dir(path)
+
+        with open(path, 'r') as f:
+            metadata = json.load(f, cls=DatetimeDecoder)
+        if metadata.get('version') != CUBE_VERSION:
+            raise ValueError('Unsupported time cube version: {}'.format(metadata.get('version')))
+
+        self.data_name = metadata['data_name']
+        self.variables = metadata['variables']
+        self.dtypes = {variable: numpy.dtype(dtype) for variable, dtype in metadata['dtypes'].items()}
+        self.shape = tuple(metadata['shape'])
+        self.chunks = tuple(metadata['chunks'])
+        self.compression = metadata['compression']
+        self.timestamps = metadata['timestamps']
+        self.affine = metadata['affine']
+        self.resolution = metadata['resolution']
+        self.bounds = metadata['bounds']
+        self.projection = metadata['projection']
+
+        self._chunk_cache = LRUCache(chunk_cache_bytes)
+
+    def read(self, variable, index, window=None):
+        """
+        Returns the grid of a variable at a timestep as a masked array.
+        :param variable: The variable to read.
+        :param index: The index of the timestep.
+        :param window: An optional ((row_start, row_stop), (col_start, col_stop)) window to read.
+        """
+
+        (row_start, row_stop), (col_start, col_stop) = window or ((0, self.shape[1]), (0, self.shape[2]))
+        time_chunk, space_chunk = self.chunks[0], self.chunks[1]
+        t, offset = divmod(index, time_chunk)
+
+        grid = numpy.empty((row_stop - row_start, col_stop - col_start), dtype=self.dtypes[variable])
+        for row in range(row_start // space_chunk, (row_stop - 1) // space_chunk + 1):
+            for col in range(col_start // space_chunk, (col_stop - 1) // space_chunk + 1):
+                chunk = self.chunk(variable, t, row, col)
+
+                # Intersect the window with the chunk
+                top, left = row * space_chunk, col * space_chunk
+                r0, r1 = max(row_start, top), min(row_stop, top + chunk.shape[1])
+                c0, c1 = max(col_start, left), min(col_stop, left + chunk.shape[2])
+                grid[r0 - row_start:r1 - row_start, c0 - col_start:c1 - col_start] = \
+                    chunk[offset, r0 - top:r1 - top, c0 - left:c1 - left]
+
+        return numpy.ma.masked_invalid(grid, copy=False)
+
+    def chunk(self, variable, t, row, col):
+        """ Returns the (time, row, column) array of a chunk. """
+
+        key = (variable, t, row, col)
+        chunk = self._chunk_cache.get(key)
+        if chunk is not None:
+            return chunk
+
+        path = _chunk_path(self.chunks_path, self.variables.index(variable), t, row, col, self.compression)
+        if self.compression is None:
+            return numpy.load(path, mmap_mode='r')
+
+        time_chunk, space_chunk = self.chunks[0], self.chunks[1]
+        shape = (
+            min(time_chunk, self.shape[0] - t * time_chunk),
+            min(space_chunk, self.shape[1] - row * space_chunk),
+            min(space_chunk, self.shape[2] - col * space_chunk)
+        )
+        with open(path, 'rb') as f:
+            chunk = numpy.frombuffer(zlib.decompress(f.read()), dtype=self.dtypes[variable]).reshape(shape)
+        self._chunk_cache.put(key, chunk)
+        return chunk
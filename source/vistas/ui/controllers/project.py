@@ -6,6 +6,7 @@ import wx
 
 from vistas.core.graphics.flythrough import Flythrough
 from vistas.core.graphics.scene import Scene
+from vistas.core.plugins.data import RasterDataPlugin
 from vistas.core.plugins.management import get_data_plugins, get_visualization_plugins, get_2d_visualization_plugins
 from vistas.core.plugins.visualization import VisualizationPlugin3D
 from vistas.core.timeline import Timeline
@@ -13,7 +14,7 @@ from vistas.ui.events import ProjectChangedEvent
 from vistas.ui.project import Project, SceneNode, FolderNode, VisualizationNode, DataNode, FlythroughNode
 from vistas.ui.utils import post_message
 from vistas.ui.windows.create_dem_dialog import GenerateDEMThread
-from vistas.ui.windows.data_dialog import DataDialog, CalculateStatsThread
+from vistas.ui.windows.data_dialog import DataDialog, CalculateStatsThread, ConvertTimeCubeThread
 from vistas.ui.windows.flythrough_dialog import FlythroughDialog
 from vistas.ui.windows.task_dialog import TaskDialog
 from vistas.ui.windows.viz_dialog import VisualizationDialog
@@ -42,6 +43,7 @@ class ProjectController(wx.EvtHandler):
     POPUP_ADD_FLYTHROUGH = 6
     POPUP_DELETE = 7
     POPUP_FETCH_DEM = 8
+    POPUP_CONVERT_TIME_CUBE = 9
 
     scene_count = 0
     flythrough_count = 0
@@ -410,6 +412,16 @@ class ProjectController(wx.EvtHandler):
             thread.start()
             TaskDialog(wx.GetTopLevelParent(self.project_panel), thread.task).ShowModal()
 
+    def ConvertTimeCube(self, node):
+        fd = wx.FileDialog(
+            wx.GetTopLevelParent(self.project_panel), "Choose a file", wildcard="*.vcube",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT
+        )
+        if fd.ShowModal() == wx.ID_OK:
+            thread = ConvertTimeCubeThread(node, self, fd.GetPath())
+            thread.start()
+            TaskDialog(wx.GetTopLevelParent(self.project_panel), thread.task).ShowModal()
+
     def DeleteSelectedItem(self, node, tree, tree_item):
         if node.is_folder:
             message = 'Are you sure you wish to delete this folder? This will also delete any items it contains.'
@@ -482,6 +494,9 @@ class ProjectController(wx.EvtHandler):
                 extent = node.data.extent
                 if extent.projection is not None:
                     popup_menu.Append(self.POPUP_FETCH_DEM, 'Fetch DEM')
+                if isinstance(node.data, RasterDataPlugin) and node.data.time_info is not None and \
+                        node.data.time_info.is_temporal:
+                    popup_menu.Append(self.POPUP_CONVERT_TIME_CUBE, 'Convert to time cube...')
 
             if tree == self.project_panel.visualization_tree and not node.is_visualization and not node.is_flythrough:
                 popup_menu.Append(self.POPUP_ADD_VISUALIZATION, 'Add new visualization')
@@ -534,6 +549,9 @@ class ProjectController(wx.EvtHandler):
         elif event_id == self.POPUP_FETCH_DEM:
             self.FetchDEM(node)
 
+        elif event_id == self.POPUP_CONVERT_TIME_CUBE:
+            self.ConvertTimeCube(node)
+
     def OnTreeBeginDrag(self, event):
         item = event.GetItem()
 
@@ -657,6 +675,8 @@ class ProjectController(wx.EvtHandler):
                 if refresh_visualization and isinstance(visualization, VisualizationPlugin3D):
                     visualization.refresh()
 
+            data.close()
+
         elif node.is_visualization:
             visualization = node.visualization
 
@@ -320,16 +320,13 @@ class VisualizationNode(ProjectNode):
             plugin.scene = data.get('parent').scene
 
         # Load data sources
-        idx = 0
         for i, pair in enumerate(plugin.data_roles):
             dtype, role = pair
-            data_info = data['data'][idx]
-            idx += 1
-            node_data = [data_info]
-            if plugin.role_supports_multiple_inputs(i):
-                while idx < len(data['data']) and data['data'][idx]['role_id'] == i:
-                    node_data.append(data['data'][idx])
-                    idx += 1
+
+            # Roles with multiple inputs have no entries when they're empty
+            node_data = [x for x in data['data'] if x['role_id'] == i]
+            if not plugin.role_supports_multiple_inputs(i):
+                node_data = node_data[:1]
 
             for node in node_data:
                 data_id = node['data_id']
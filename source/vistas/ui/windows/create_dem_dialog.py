@@ -1,10 +1,11 @@
 import asyncio
 import sys
 
-from vistas.core.gis.elevation import ElevationService
+from vistas.core.gis.elevation import ElevationService, MissingTilesError
 from vistas.core.task import Task
 from vistas.core.threading import Thread
 from vistas.ui.project import DataNode
+from vistas.ui.utils import post_message
 
 
 class GenerateDEMThread(Thread):
@@ -28,7 +29,13 @@ class GenerateDEMThread(Thread):
         else:
             asyncio.set_event_loop(asyncio.SelectorEventLoop())
 
-        plugin = self.service.create_dem_from_plugin(self.data_plugin, self.path, self.task)
+        try:
+            plugin = self.service.create_dem_from_plugin(self.data_plugin, self.path, self.task)
+        except MissingTilesError as e:
+            post_message('Could not generate DEM: {}. Please try again.'.format(e), 1)
+            self.task.status = Task.COMPLETE
+            return
+
         DataNode(plugin, plugin.data_name, self.controller.project.data_root)
         self.controller.PopulateTreesFromProject(self.controller.project)
         self.task.status = Task.COMPLETE
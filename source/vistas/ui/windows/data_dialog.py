@@ -6,7 +6,9 @@ import wx.richtext
 from vistas.core.plugins.data import DataPlugin
 from vistas.core.task import Task
 from vistas.core.threading import Thread
+from vistas.core.timecube import ingest
 from vistas.ui.controls.options_panel import OptionsPanel
+from vistas.ui.project import DataNode
 
 
 class CalculateStatsThread(Thread):
@@ -23,6 +25,27 @@ class CalculateStatsThread(Thread):
         self.task.status = Task.COMPLETE
 
 
+class ConvertTimeCubeThread(Thread):
+    """ A worker thread for converting a RasterDataPlugin into a time cube and adding it to the project. """
+
+    def __init__(self, node, controller, path):
+        super().__init__()
+        self.data_plugin = node.data
+        self.parent = node.parent
+        self.controller = controller
+        self.path = path
+        self.task = Task("Converting to Time Cube", "Please wait: converting data to a time cube...")
+
+    def run(self):
+        if ingest(self.data_plugin, self.path, task=self.task):
+            plugin = DataPlugin.by_name('time_cube')()
+            plugin.set_path(self.path)
+            plugin.calculate_stats()
+            DataNode(plugin, plugin.data_name, self.parent)
+            self.controller.PopulateTreesFromProject(self.controller.project)
+        self.task.status = Task.COMPLETE
+
+
 class DataDialog(wx.Dialog):
     """ A Dialog for viewing information about a DataPlugin. """
 
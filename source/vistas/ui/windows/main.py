@@ -4,6 +4,7 @@ from PIL.Image import Image
 
 from vistas.core.graphics.overlay import BasicOverlayButton
 from vistas.core.paths import get_resource_bitmap, get_resources_directory
+from vistas.core.plugins.prefetch import TimelinePrefetcher
 from vistas.core.plugins.visualization import EVT_VISUALIZATION_UPDATED
 from vistas.core.utils import get_platform
 from vistas.ui.controllers.project import ProjectController
@@ -329,6 +330,9 @@ class MainWindow(wx.Frame):
         for node in self.project_controller.project.all_visualizations:
             node.visualization.timeline_changed()
 
+        # Read ahead of the timeline, so that the next timesteps are already in memory
+        TimelinePrefetcher.app().timeline_changed()
+
     def OnCameraModeChanged(self, event):
         wx.PostEvent(self.viewer_container_panel, event)
 